@@ -13,12 +13,15 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 import os
 import clickreviews.remote
 
 USER_DATA_FILE = os.path.join(clickreviews.remote.DATA_DIR,
                               'apparmor-easyprof-ubuntu.json')
 
+POLICY_KINDS = ['templates', 'policy_groups']
+
 # XXX: This is a hack and will be gone, as soon as myapps has an API for this.
 AA_POLICY_DATA_URL = \
     "http://bazaar.launchpad.net/~store-reviewers/click-reviewers-tools/trunk/download/head:/apparmoreasyprofubun-20140711222314-oeohtxzvf9a58fa6-1/apparmor-easyprof-ubuntu.json"
@@ -30,8 +33,109 @@ def get_policy_file(fn):
     clickreviews.remote.get_remote_file(fn, AA_POLICY_DATA_URL)
 
 
+def index_version(entry):
+    '''Index the templates and policy groups of a policy version: their
+       names sorted by type and all together, the type of each name (the
+       first type listing it) and the sorted basenames of the names'''
+    index = dict()
+    for kind in POLICY_KINDS:
+        types = dict()
+        by_type = dict()
+        names = []
+        for aa_type in entry.get(kind, {}):
+            by_type[aa_type] = sorted(entry[kind][aa_type])
+            names += entry[kind][aa_type]
+            for name in entry[kind][aa_type]:
+                types.setdefault(name, aa_type)
+        index[kind] = {'types': types,
+                       'by_type': by_type,
+                       'all': sorted(names),
+                       'basenames': sorted(set(os.path.basename(n)
+                                               for n in names)),
+                       }
+    return index
+
+
+def index_policy(policy):
+    '''Index the policy by vendor: its versions (sorted as strings) and
+       the index_version() of each of them'''
+    index = dict()
+    for vendor in policy:
+        index[vendor] = {'versions': sorted(policy[vendor].keys()),
+                         'policy': dict(),
+                         }
+        for version in policy[vendor]:
+            index[vendor]['policy'][version] = \
+                index_version(policy[vendor][version])
+    return index
+
+
+class PolicyIndex(object):
+    '''Lookups of templates and policy groups by vendor and version, in
+       the indexes built by index_policy()'''
+    def __init__(self, indexes):
+        self.indexes = indexes
+        # sets of basenames by (vendor, version, kind), built when needed
+        self._basenames = dict()
+
+    def has_vendor(self, vendor):
+        return vendor in self.indexes
+
+    def versions(self, vendor):
+        '''Return the versions of vendor, sorted as strings'''
+        return self.indexes[vendor]['versions']
+
+    def has_version(self, vendor, version):
+        return vendor in self.indexes and \
+            str(version) in self.indexes[vendor]['policy']
+
+    def add_version(self, vendor, version):
+        '''Add version (without templates and policy groups) to vendor'''
+        version = str(version)
+        if vendor not in self.indexes:
+            self.indexes[vendor] = {'versions': [], 'policy': dict()}
+        if version not in self.indexes[vendor]['policy']:
+            bisect.insort(self.indexes[vendor]['versions'], version)
+            self.indexes[vendor]['policy'][version] = index_version({})
+
+    def _get(self, vendor, version, kind):
+        if not self.has_version(vendor, version):
+            return None
+        return self.indexes[vendor]['policy'][str(version)][kind]
+
+    def names(self, vendor, version, kind, aa_type="all"):
+        '''Return the sorted names of kind ('templates' or
+           'policy_groups') of type aa_type'''
+        index = self._get(vendor, version, kind)
+        if index is None:
+            return []
+        if aa_type == "all":
+            return list(index['all'])
+        return list(index['by_type'].get(aa_type, []))
+
+    def get_type(self, vendor, version, kind, name):
+        '''Return the type of name, None if it is unknown'''
+        index = self._get(vendor, version, kind)
+        if index is None:
+            return None
+        return index['types'].get(name)
+
+    def has_name(self, vendor, version, kind, name):
+        return self.get_type(vendor, version, kind, name) is not None
+
+    def has_basename(self, vendor, version, kind, basename):
+        '''Return if a name of kind has the given basename'''
+        key = (vendor, str(version), kind)
+        if key not in self._basenames:
+            index = self._get(vendor, version, kind)
+            self._basenames[key] = \
+                set(index['basenames'] if index is not None else [])
+        return basename in self._basenames[key]
+
+
 class ApparmorPolicy(object):
     def __init__(self, local_copy_fn=None):
-        self.policy = clickreviews.remote.read_cr_file(USER_DATA_FILE,
-                                                       AA_POLICY_DATA_URL,
-                                                       local_copy_fn)
+        (self.policy, indexes) = clickreviews.remote.read_cr_data(
+            USER_DATA_FILE, AA_POLICY_DATA_URL, local_copy_fn,
+            indexer=index_policy)
+        self.index = PolicyIndex(indexes)
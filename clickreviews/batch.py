@@ -0,0 +1,156 @@
+'''batch.py: review many packages in one process'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import contextlib
+import multiprocessing
+import os
+import sys
+import traceback
+
+from clickreviews import common, modules
+
+PACKAGE_EXTENSIONS = ['.click', '.snap']
+
+# Review classes by module name, loaded once per process by
+# load_review_classes(). Loading them before forking the worker pool means
+# the workers never import the review modules themselves.
+_review_classes = None
+
+
+def find_packages(path):
+    '''Return the packages to review. 'path' is either a directory, in which
+       case all the packages in it are returned, or a file listing one
+       package per line.'''
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path))
+                if os.path.splitext(f)[1] in PACKAGE_EXTENSIONS]
+
+    packages = []
+    with open(path, 'r') as f:
+        for line in f.readlines():
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            packages.append(line)
+    return packages
+
+
+def load_review_classes():
+    '''Load the review classes of all modules'''
+    global _review_classes
+    if _review_classes is None:
+        _review_classes = []
+        for module_name in modules.get_modules():
+            cls = modules.find_main_class(module_name)
+            if cls is not None:
+                _review_classes.append((module_name, cls))
+    return _review_classes
+
+
+def review_rc(results, runtime_errors):
+    '''Return the click-review exit code for the given results'''
+    if runtime_errors:
+        return 1
+    if [s for s in results if results[s]['error']]:
+        return 2
+    if [s for s in results if results[s]['warn']]:
+        return 3
+    return 0
+
+
+def review_package(fn, overrides=None, cache=None):
+    '''Review a package with all modules. Returns a dictionary with the
+       results by section (as with 'click-review --json'), the click-review
+       exit code and any runtime errors. With a report_cache.ReportCache,
+       cached results are returned instead of reviewing the package again
+       and new results without runtime errors are added to the cache.'''
+    key = None
+    if cache is not None and os.path.isfile(fn):
+        key = cache.key(fn, overrides, common.SELECTION)
+        results = cache.get(key)
+        if results is not None:
+            return {'filename': fn,
+                    'rc': review_rc(results, []),
+                    'results': results,
+                    }
+
+    results = dict()
+    runtime_errors = []
+
+    # stdout is reserved for the results, so send anything printed while
+    # reviewing to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            with common.PackageContext(fn) as context:
+                pkg_type = modules.package_type(context.pkgfmt)
+                for (module_name, cls) in load_review_classes():
+                    if not modules.review_selected(cls):
+                        continue
+                    section = modules.module_section(module_name)
+                    if not modules.reviews_package_type(module_name,
+                                                        pkg_type):
+                        results[section] = modules.empty_report()
+                        continue
+                    try:
+                        review = cls(fn, overrides, context=context)
+                        review.do_checks()
+                    except Exception:
+                        runtime_errors.append(traceback.format_exc())
+                        continue
+                    results[section] = review.click_report
+        except SystemExit as e:
+            # common.error() exits, but that must not stop the batch
+            runtime_errors.append("review exited with '%s'" % e.code)
+        finally:
+            common.cleanup_unpack()
+
+    report = {'filename': fn,
+              'rc': review_rc(results, runtime_errors),
+              'results': results,
+              }
+    if runtime_errors:
+        report['runtime_errors'] = runtime_errors
+    elif key is not None:
+        cache.put(key, results)
+    return report
+
+
+def _pool_review_package(args):
+    (fn, overrides, cache) = args
+    return review_package(fn, overrides, cache)
+
+
+def review_packages(packages, overrides=None, jobs=1, cache=None):
+    '''Review each package with review_package(), yielding the reports in
+       the order of 'packages'. With jobs > 1 the packages are spread across
+       a pool of that many worker processes.'''
+    load_review_classes()
+
+    if jobs <= 1 or len(packages) <= 1:
+        for fn in packages:
+            yield review_package(fn, overrides, cache)
+        return
+
+    pool = multiprocessing.get_context('fork').Pool(min(jobs, len(packages)))
+    try:
+        args = [(fn, overrides, cache) for fn in packages]
+        for report in pool.imap(_pool_review_package, args):
+            yield report
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
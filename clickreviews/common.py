@@ -16,24 +16,59 @@
 
 from __future__ import print_function
 import atexit
+import bisect
 import codecs
+import collections
+import concurrent.futures
+import copy
+import fnmatch
+import functools
+import hashlib
 import inspect
 import json
 import logging
-import magic
 import os
+import posixpath
+import pprint
 import re
 import shutil
+import stat
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
+import time
 import types
 
+from clickreviews import deb
+from clickreviews import packagefs
+from clickreviews import squashfs
 
 DEBUGGING = False
+# When set, reviews add the profile_delta() of their setup and of each
+# check to their report under 'profile'
+PROFILE = False
+# Number of processes started by cmd() and cmd_pipe()
+_subprocess_count = 0
+# The CheckSelection of the checks to run, None to run them all
+SELECTION = None
 UNPACK_DIR = None
-RAW_UNPACK_DIR = None
 TMP_DIR = None
+MIME = None
+# Files are hashed this many bytes at a time
+HASH_CHUNK_SIZE = 1024 * 1024
+# libmagic classifies files by this many leading bytes
+MAGIC_PEEK_SIZE = 64 * 1024
+# libmagic results by (file size, hash of the leading bytes), at most
+# MIME_CACHE_SIZE of them, least recently used first
+MIME_CACHE_SIZE = 16384
+_mime_cache = collections.OrderedDict()
+_mime_cache_lock = threading.Lock()
+# Idle libmagic handles for file_mime(), which are kept for the life of the
+# process
+_magic_handles = []
+_magic_handles_lock = threading.Lock()
 VALID_SYSCALL = r'^[a-z0-9_]{2,64}$'
 # This needs to match up with snapcraft
 MKSQUASHFS_OPTS = ['-noappend', '-comp', 'xz', '-all-root', '-no-xattrs']
@@ -59,10 +94,6 @@ def cleanup_unpack():
     if UNPACK_DIR is not None and os.path.isdir(UNPACK_DIR):
         recursive_rm(UNPACK_DIR)
         UNPACK_DIR = None
-    global RAW_UNPACK_DIR
-    if RAW_UNPACK_DIR is not None and os.path.isdir(RAW_UNPACK_DIR):
-        recursive_rm(RAW_UNPACK_DIR)
-        RAW_UNPACK_DIR = None
     global TMP_DIR
     if TMP_DIR is not None and os.path.isdir(TMP_DIR):
         recursive_rm(TMP_DIR)
@@ -84,6 +115,80 @@ class ReviewException(Exception):
         return repr(self.value)
 
 
+class CheckSelection(object):
+    '''This class represents the checks selected with --only and --skip:
+       fnmatch patterns over the 'review_type:check' names of the checks,
+       as in check-names.list. A check is selected if it matches one of the
+       'only' patterns (if any) and none of the 'skip' patterns.'''
+    def __init__(self, only=None, skip=None):
+        self.only = list(only or [])
+        self.skip = list(skip or [])
+
+    def _matches(self, name, patterns):
+        name = ':'.join(name.split(':')[:2])
+        for pattern in patterns:
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+    def selected(self, name):
+        '''Return True if the check name is selected. Only the review type
+           and check parts of name are considered.'''
+        if self.only and not self._matches(name, self.only):
+            return False
+        return not self._matches(name, self.skip)
+
+    def review_selected(self, review_type):
+        '''Return False if none of the checks of review_type can be
+           selected'''
+        prefix = review_type + ':'
+        for pattern in self.skip:
+            # a trailing '*' matches whatever follows the prefix
+            if pattern.endswith('*') and fnmatch.fnmatchcase(prefix, pattern):
+                return False
+        if not self.only:
+            return True
+        for pattern in self.only:
+            literal = re.split(r'[*?[]', pattern)[0]
+            if prefix.startswith(literal) or literal.startswith(prefix):
+                return True
+        return False
+
+    def to_json(self):
+        '''Return the selection as a dict, e.g. for cache keys'''
+        return {'only': sorted(self.only), 'skip': sorted(self.skip)}
+
+
+def reports(*names):
+    '''Decorator declaring the names (without the review type) of the checks
+       a check_ method reports. When a CheckSelection is in use, the method
+       is only run if one of these is selected. Methods without it are
+       always run and only their selected results are kept.'''
+    def decorator(func):
+        func.check_names = names
+        return func
+    return decorator
+
+
+def requires(*inputs):
+    '''Decorator declaring the setup a check_ method (or a helper of checks)
+       needs: the names of methods of the review which are run once, before
+       the first method that requires them, instead of when the review is
+       created. The setup of checks which aren't selected is then skipped
+       altogether.'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            for name in inputs:
+                if name not in self._inputs_done:
+                    getattr(self, name)()
+                    self._inputs_done.add(name)
+            return func(self, *args, **kwargs)
+        wrapper.check_inputs = inputs
+        return wrapper
+    return decorator
+
+
 class Review(object):
     '''Common review class'''
     magic_binary_file_descriptions = [
@@ -91,9 +196,17 @@ class Review(object):
         'application/x-sharedlib; charset=binary',
         'application/x-object; charset=binary',
     ]
+    # Reviews which read the package only through self.fs set this to False
+    # so that they can be run with a PackageContext which doesn't unpack it
+    needs_unpack = True
 
-    def __init__(self, fn, review_type, overrides=None):
+    def __init__(self, fn, review_type, overrides=None, context=None):
         self.pkg_filename = fn
+        self._fs = None
+        # setup methods which were run for requires()
+        self._inputs_done = set()
+        self._profile_start = profile_counters() if PROFILE else None
+        self._profile_setup = dict()
         self._check_package_exists()
 
         self.review_type = review_type
@@ -108,22 +221,34 @@ class Review(object):
 
         self.click_report_output = "json"
 
-        global UNPACK_DIR
-        if UNPACK_DIR is None:
-            UNPACK_DIR = unpack_pkg(fn)
-        self.unpack_dir = UNPACK_DIR
-
-        global RAW_UNPACK_DIR
-        if RAW_UNPACK_DIR is None:
-            RAW_UNPACK_DIR = raw_unpack_pkg(fn)
-        self.raw_unpack_dir = RAW_UNPACK_DIR
-
         self.is_click = False
         self.is_snap1 = False
         self.is_snap2 = False
         self.pkgfmt = {"type": "", "version": ""}
 
-        (self.pkgfmt["type"], pkgver) = detect_package(fn, self.unpack_dir)
+        # When given a PackageContext, use its unpacked tree and detected
+        # package type instead of doing this work for every review
+        self.context = context
+        if self.context is not None:
+            if self.needs_unpack and not self.context.unpacked:
+                error("%s needs the package to be unpacked" %
+                      self.__class__.__name__)
+            self.unpack_dir = self.context.unpack_dir
+            (self.pkgfmt["type"], pkgver) = self.context.pkgfmt
+        else:
+            global UNPACK_DIR
+            start = profile_counters() if PROFILE else None
+            if UNPACK_DIR is None:
+                UNPACK_DIR = unpack_pkg(fn)
+            self.unpack_dir = UNPACK_DIR
+            if start is not None:
+                self._profile_setup['unpack'] = profile_delta(start)
+                start = profile_counters()
+
+            (self.pkgfmt["type"], pkgver) = detect_package(fn,
+                                                           self.unpack_dir)
+            if start is not None:
+                self._profile_setup['detect'] = profile_delta(start)
 
         if self._pkgfmt_type() == "snap":
             if pkgver < 2:
@@ -140,11 +265,12 @@ class Review(object):
 
         # Get a list of all unpacked files
         self.pkg_files = []
+        self._inventory = None
+        self._inventory_files = None
         self._list_all_files()
 
         # Setup what is needed to get a list of all unpacked compiled binaries
-        self.mime = magic.open(magic.MAGIC_MIME)
-        self.mime.load()
+        self._mime = None
         self.pkg_bin_files = []
         # Don't run this here since only cr_lint.py and cr_functional.py need
         # it now
@@ -154,12 +280,28 @@ class Review(object):
 
         self.override_result_type = None
 
+    @property
+    def mime(self):
+        '''The loaded libmagic database, loaded when first needed'''
+        if self._mime is None:
+            if self.context is not None:
+                self._mime = self.context.mime
+            else:
+                start = profile_counters() if PROFILE else None
+                self._mime = open_magic()
+                if start is not None:
+                    self._profile_setup['magic'] = profile_delta(start)
+        return self._mime
+
     def _check_innerpath_executable(self, fn):
         '''Check that the provided path exists and is executable'''
         return os.access(fn, os.X_OK)
 
     def _extract_statinfo(self, fn):
         '''Extract statinfo from file'''
+        entry = self.pkg_inventory.get(fn)
+        if entry is not None and entry.exists and not entry.is_symlink:
+            return entry
         try:
             st = os.stat(fn)
         except Exception:
@@ -168,20 +310,34 @@ class Review(object):
 
     def _extract_file(self, rel):
         '''Extract file'''
-        fn = os.path.join(self.unpack_dir, rel)
-        if not os.path.isfile(fn):
+        if not self.fs.isfile(rel):
             error("Could not find '%s'" % rel)
-        return open_file_read(fn)
+        return self.fs.open_text(rel)
+
+    @property
+    def fs(self):
+        '''The PackageFS for reading the package files by relative path'''
+        if self.context is not None and not self.context.unpacked:
+            return self.context.fs
+        unpack_dir = self._get_unpack_dir()
+        if self._fs is None or self._fs.root != unpack_dir:
+            self._fs = packagefs.DirFS(unpack_dir)
+        return self._fs
 
     def _path_join(self, dirname, rest):
         return os.path.join(dirname, rest)
 
     def _get_sha512sum(self, fn):
         '''Get sha512sum of file'''
-        (rc, out) = cmd(['sha512sum', fn])
-        if rc != 0:
-            return None
-        return out.split()[0]
+        return hash_file(fn, 'sha512')
+
+    def _get_archive_sha512sum(self, member):
+        '''Get sha512sum of a member of the package's ar archive'''
+        return archive_sha512sum(self.pkg_filename, member)
+
+    def _get_sha512sums(self, fns):
+        '''Get sha512sums of files in parallel, by filename'''
+        return thread_map(self._get_sha512sum, fns)
 
     def _pkgfmt_type(self):
         '''Return the package format type'''
@@ -202,9 +358,35 @@ class Review(object):
 
     def _list_all_files(self):
         '''List all files included in this click package.'''
-        for root, dirnames, filenames in os.walk(self.unpack_dir):
-            for f in filenames:
-                self.pkg_files.append(os.path.join(root, f))
+        if self.context is not None:
+            self._inventory = self.context.inventory
+        else:
+            self._inventory = PackageInventory.scan(self.unpack_dir)
+        self.pkg_files = self._inventory.paths()
+        self._inventory_files = self.pkg_files
+
+    @property
+    def pkg_inventory(self):
+        '''PackageInventory of self.pkg_files. It is updated when pkg_files
+           is replaced or appended to.'''
+        if self._inventory is None or \
+                self._inventory_files is not self.pkg_files or \
+                len(self._inventory) != len(self.pkg_files):
+            self._inventory = PackageInventory.from_paths(
+                self._get_unpack_dir(), self.pkg_files, self._inventory)
+            self._inventory_files = self.pkg_files
+        return self._inventory
+
+    def _get_unpack_dir(self):  # pragma: nocover
+        '''Get unpack directory'''
+        return self.unpack_dir
+
+    def _get_cached(self, name, loader):
+        '''Return the result of loader(). With a package context the loader
+           is only called once per package and each review gets a copy.'''
+        if self.context is None:
+            return loader()
+        return self.context.get_cached(name, loader)
 
     def _check_if_message_catalog(self, fn):
         '''Check if file is a message catalog (.mo file).'''
@@ -214,18 +396,17 @@ class Review(object):
 
     def _list_all_compiled_binaries(self):
         '''List all compiled binaries in this click package.'''
-        for i in self.pkg_files:
-            try:
-                res = self.mime.file(i)
-            except Exception:  # pragma: nocover
-                # workaround for zesty python3-magic
-                debug("could not detemine mime type of '%s'" % i)
-                continue
+        if self.context is not None:
+            mimes = self.context.file_mimes
+        else:
+            mimes = classify_files(self.pkg_inventory)
 
+        bin_files = set()
+        for (fn, res) in mimes.items():
             if res in self.magic_binary_file_descriptions and \
-               not self._check_if_message_catalog(i) and \
-               i not in self.pkg_bin_files:
-                self.pkg_bin_files.append(i)
+                    not self._check_if_message_catalog(fn):
+                bin_files.add(fn)
+        self.pkg_bin_files = [fn for fn in self.pkg_files if fn in bin_files]
 
     def _get_check_name(self, name, app='', extra=''):
         name = ':'.join([self.review_type, name])
@@ -266,6 +447,9 @@ class Review(object):
         if result_type not in self.result_types:
             error("Invalid result type '%s'" % result_type)
 
+        if SELECTION is not None and not SELECTION.selected(review_name):
+            return
+
         prefix = ""
         if override_result_type is not None:
             if override_result_type not in self.result_types:
@@ -311,10 +495,8 @@ class Review(object):
         '''Print report'''
         if self.click_report_output == "console":
             # TODO: format better
-            import pprint
             pprint.pprint(self.click_report)
         elif self.click_report_output == "json":
-            import json
             msg(json.dumps(self.click_report,
                            sort_keys=True,
                            indent=2,
@@ -329,6 +511,15 @@ class Review(object):
 
     def do_checks(self):
         '''Run all methods that start with check_'''
+        profile = None
+        if self._profile_start is not None:
+            # everything since the review was created is its setup
+            profile = {'init': profile_delta(self._profile_start),
+                       'checks': dict()}
+            profile['init'].update(self._profile_setup)
+            if self.context is not None and self.context.profile:
+                profile['package'] = self.context.profile
+
         methodList = [name for name, member in
                       inspect.getmembers(self, inspect.ismethod)
                       if isinstance(member, types.MethodType)]
@@ -336,17 +527,268 @@ class Review(object):
             if not methodname.startswith("check_"):
                 continue
             func = getattr(self, methodname)
+            if not self._check_selected(func):
+                continue
+            if profile is None:
+                func()
+                continue
+            start = profile_counters()
             func()
+            profile['checks'][methodname] = profile_delta(start)
+
+        if profile is not None:
+            self.click_report['profile'] = profile
+
+    def _check_selected(self, func):
+        '''Return False if func reports() none of the selected checks'''
+        if SELECTION is None or not hasattr(func, 'check_names'):
+            return True
+        for name in func.check_names:
+            if SELECTION.selected(self._get_check_name(name)):
+                return True
+        return False
 
     def set_review_type(self, name):
         '''Set review name'''
         self.review_type = name
 
 
+class PackageContext(object):
+    '''This class represents the state shared by all reviews of a package.
+       The package is unpacked, its type detected and its files listed once,
+       and the libmagic database and any parsed metadata are loaded on first
+       use and then reused by every Review created with this context.
+
+       With unpack=False the package is read in place through 'fs' and
+       unpack_dir is only the prefix of the paths in pkg_files. Only reviews
+       which don't need_unpack can be run with such a context.
+
+       Given the PackageBaseline of a previous revision of the package, the
+       per-file results of unchanged files are taken from it instead of
+       being worked out again.'''
+    def __init__(self, fn, unpack=True, baseline=None):
+        if not os.path.exists(fn):
+            error("Could not find '%s'" % fn)
+        self.pkg_filename = fn
+        self.unpacked = unpack
+        self.baseline = baseline
+        # profile_delta()s of the shared setup when PROFILE is set
+        self.profile = dict()
+
+        start = profile_counters() if PROFILE else None
+        if unpack:
+            self.unpack_dir = unpack_pkg(fn)
+            self.fs = packagefs.DirFS(self.unpack_dir)
+        else:
+            self.fs = open_package_fs(fn)
+            self.unpack_dir = self.fs.root
+        if start is not None:
+            self.profile['unpack'] = profile_delta(start)
+            start = profile_counters()
+
+        if unpack:
+            self.pkgfmt = detect_package(fn, self.unpack_dir)
+        else:
+            self.pkgfmt = detect_package(fn, fs=self.fs)
+        if start is not None:
+            self.profile['detect'] = profile_delta(start)
+            start = profile_counters()
+
+        if unpack:
+            self.inventory = PackageInventory.scan(self.unpack_dir)
+        else:
+            self.inventory = PackageInventory.from_fs(self.fs)
+        self.pkg_files = self.inventory.paths()
+        if start is not None:
+            self.profile['inventory'] = profile_delta(start)
+
+        self._mime = None
+        self._file_mimes = None
+        self._changed = None
+        self._cache = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+    @property
+    def mime(self):
+        '''The loaded libmagic database'''
+        if self._mime is None:
+            start = profile_counters() if PROFILE else None
+            self._mime = load_mime()
+            if start is not None:
+                self.profile['magic'] = profile_delta(start)
+        return self._mime
+
+    @property
+    def file_mimes(self):
+        '''The classify_files() libmagic mime types of the package files'''
+        if self._file_mimes is None:
+            if self.baseline is None:
+                self._file_mimes = classify_files(self.inventory)
+            else:
+                self._file_mimes = self.baseline.mimes(self.inventory,
+                                                       self.changed)
+                self._file_mimes.update(classify_files(
+                    [e for e in self.inventory if e.path in self.changed]))
+        return self._file_mimes
+
+    @property
+    def changed(self):
+        '''The paths of the package files which differ from the baseline
+           (all of them without one)'''
+        if self._changed is None:
+            if self.baseline is None:
+                self._changed = frozenset(self.inventory.paths())
+            else:
+                self._changed = self.baseline.changed(self.inventory)
+        return self._changed
+
+    def get_cached(self, name, loader):
+        '''Return a copy of the result of loader(), calling it only the first
+           time 'name' is requested. Copies are returned since reviews are
+           free to modify what they are given.'''
+        if name not in self._cache:
+            self._cache[name] = loader()
+        return copy.deepcopy(self._cache[name])
+
+    def cleanup(self):
+        '''Remove the unpacked package'''
+        if not self.unpacked:
+            self.fs.close()
+        elif self.unpack_dir and os.path.isdir(self.unpack_dir):
+            recursive_rm(self.unpack_dir)
+        self.unpack_dir = None
+
+
+def _baseline_mtime(entry):
+    return None if entry.is_symlink else entry.st_mtime
+
+
+class PackageBaseline(object):
+    '''This class represents the per-file data of a reviewed package: the
+       size, mode, mtime, libmagic mime type and symlink target of each file
+       by relative path. A new revision of the package is compared against
+       it so that only changed files need to be looked at again. Packages
+       keep the mtimes of their files, so comparing them is enough to tell
+       which files changed without reading them. Symlinks are compared by
+       target since their mtimes aren't always kept when unpacking.'''
+    FORMAT = 2
+
+    def __init__(self, files):
+        self.files = files
+
+    @classmethod
+    def from_context(cls, context):
+        '''Return the baseline of the package of the PackageContext'''
+        files = dict()
+        for e in context.inventory:
+            if not e.exists:
+                continue
+            files[e.relpath] = {'size': e.st_size,
+                                'mode': e.st_mode,
+                                'mtime': _baseline_mtime(e),
+                                'mime': context.file_mimes.get(e.path),
+                                'target': e.link_target,
+                                }
+        return cls(files)
+
+    @classmethod
+    def from_package(cls, fn):
+        '''Return the baseline of the package fn'''
+        with PackageContext(fn) as context:
+            return cls.from_context(context)
+
+    @classmethod
+    def from_json(cls, data):
+        '''Return the baseline of to_json() data'''
+        if not isinstance(data, dict) or \
+                data.get('format') != cls.FORMAT or \
+                not isinstance(data.get('files'), dict):
+            raise ValueError("not a baseline")
+        return cls(data['files'])
+
+    def to_json(self):
+        '''Return the baseline as json serializable data'''
+        return {'format': self.FORMAT, 'files': self.files}
+
+    @classmethod
+    def load(cls, fn):
+        '''Return the baseline saved with save() in fn, or of the package
+           fn'''
+        if not fn.endswith('.json'):
+            return cls.from_package(fn)
+        try:
+            with open(fn, 'r') as f:
+                return cls.from_json(json.load(f))
+        except ValueError as e:
+            error("Could not load baseline '%s': %s" % (fn, e))
+
+    def save(self, fn):
+        '''Save the baseline as json in fn'''
+        with open(fn, 'w') as f:
+            json.dump(self.to_json(), f, sort_keys=True)
+
+    def changed(self, inventory):
+        '''Return the paths of the files in the PackageInventory which
+           aren't in the baseline with the same size, mode, mtime and symlink
+           target'''
+        changed = set()
+        for e in inventory:
+            f = self.files.get(e.relpath)
+            if f is None or not e.exists or f['size'] != e.st_size or \
+                    f['mode'] != e.st_mode or \
+                    f['mtime'] != _baseline_mtime(e) or \
+                    f['target'] != e.link_target:
+                changed.add(e.path)
+        return frozenset(changed)
+
+    def mimes(self, inventory, changed):
+        '''Return the baseline mime types of the unchanged files in the
+           PackageInventory by path'''
+        mimes = dict()
+        for e in inventory:
+            if e.path in changed:
+                continue
+            mime = self.files[e.relpath]['mime']
+            if mime is not None:
+                mimes[e.path] = mime
+        return mimes
+
+
 #
 # Utility functions
 #
 
+def open_magic():
+    '''Return a new libmagic handle with the mime database loaded'''
+    # libmagic is only needed to classify files, so don't import it before
+    import magic
+    mime = magic.open(magic.MAGIC_MIME)
+    mime.load()
+    return mime
+
+
+def load_mime(jobs=None):
+    '''Return the libmagic database, loading it the first time this is
+       called in the process. Handles for classifying files in 'jobs'
+       threads (by default one per cpu) are loaded too.'''
+    global MIME
+    if MIME is None:
+        MIME = open_magic()
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    with _magic_handles_lock:
+        missing = jobs - len(_magic_handles)
+    handles = [open_magic() for i in range(missing)]
+    with _magic_handles_lock:
+        _magic_handles.extend(handles)
+    return MIME
+
+
 def error(out, exit_code=1, do_exit=True):
     '''Print error message and exit'''
     try:
@@ -384,9 +826,48 @@ def debug(out):
             pass
 
 
+def _bytes_read():
+    '''Return the number of bytes this process has read, None if the
+       kernel doesn't tell'''
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def profile_counters():
+    '''Return the current wall clock and cpu times, number of processes
+       started through cmd() and bytes read, for profile_delta()'''
+    t = os.times()
+    return (time.monotonic(),
+            t.user + t.system + t.children_user + t.children_system,
+            _subprocess_count, _bytes_read())
+
+
+def profile_delta(start):
+    '''Return what was used since the profile_counters() start: wall clock
+       and cpu seconds (including subprocesses), subprocesses started
+       through cmd() and bytes read'''
+    now = profile_counters()
+    bytes_read = None
+    if now[3] is not None and start[3] is not None:
+        bytes_read = now[3] - start[3]
+    return {'wall': round(now[0] - start[0], 6),
+            'cpu': round(now[1] - start[1], 6),
+            'subprocesses': now[2] - start[2],
+            'bytes_read': bytes_read,
+            }
+
+
 def cmd(command):
     '''Try to execute the given command.'''
     debug(command)
+    global _subprocess_count
+    _subprocess_count += 1
     try:
         sp = subprocess.Popen(command, stdout=subprocess.PIPE,
                               stderr=subprocess.STDOUT)
@@ -401,8 +882,109 @@ def cmd(command):
     return [sp.returncode, out]
 
 
+def hash_file(fn, algorithm):
+    '''Return the hex digest of fn using the given hashlib algorithm, or
+       None if fn could not be read'''
+    h = hashlib.new(algorithm)
+    try:
+        with open(fn, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+    except (IOError, OSError):
+        return None
+    return h.hexdigest()
+
+
+def thread_map(func, items, jobs=None):
+    '''Return a dictionary of func(item) by item for the (hashable) items,
+       calling func in a pool of 'jobs' threads (by default one per cpu).
+       This is only worthwhile when func releases the GIL, eg while doing
+       IO or hashing.'''
+    items = list(set(items))
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1 or len(items) <= 1:
+        return dict((item, func(item)) for item in items)
+
+    with concurrent.futures.ThreadPoolExecutor(min(jobs, len(items))) as ex:
+        return dict(zip(items, ex.map(func, items)))
+
+
+def hash_files(fns, algorithm, jobs=None):
+    '''Return a dictionary of the hash_file() hex digests of fns by
+       filename, hashing them in parallel with thread_map()'''
+    return thread_map(lambda fn: hash_file(fn, algorithm), fns, jobs)
+
+
+def file_mime(fn):
+    '''Return the libmagic mime type of fn, determined from its first
+       MAGIC_PEEK_SIZE bytes, or None if it can't be read. Results are
+       memoized by file size and content so identical files are only
+       classified once.'''
+    return _file_magic(fn, False)
+
+
+def file_description(fn):
+    '''Return the libmagic description of fn, as with 'file -b', determined
+       and memoized like file_mime()'''
+    return _file_magic(fn, True)
+
+
+def _file_magic(fn, description):
+    try:
+        with open(fn, 'rb') as f:
+            data = f.read(MAGIC_PEEK_SIZE)
+            size = os.fstat(f.fileno()).st_size
+    except (IOError, OSError):
+        return None
+
+    key = (size, hashlib.sha1(data).digest(), description)
+    with _mime_cache_lock:
+        if key in _mime_cache:
+            _mime_cache.move_to_end(key)
+            return _mime_cache[key]
+
+    # libmagic handles aren't thread-safe, so each thread borrows an idle
+    # one, which is returned for later calls
+    with _magic_handles_lock:
+        mime = _magic_handles.pop() if _magic_handles else None
+    if mime is None:
+        mime = open_magic()
+    try:
+        if description:
+            import magic
+            mime.setflags(magic.MAGIC_NONE)
+            try:
+                res = mime.buffer(data)
+            finally:
+                mime.setflags(magic.MAGIC_MIME)
+        else:
+            res = mime.buffer(data)
+    finally:
+        with _magic_handles_lock:
+            _magic_handles.append(mime)
+
+    with _mime_cache_lock:
+        _mime_cache[key] = res
+        while len(_mime_cache) > MIME_CACHE_SIZE:
+            _mime_cache.popitem(last=False)
+    return res
+
+
+def classify_files(inventory, jobs=None):
+    '''Return a dictionary of the file_mime() mime types of the regular
+       files in the PackageInventory by path, classifying them in parallel
+       with thread_map()'''
+    fns = [e.path for e in inventory
+           if e.exists and stat.S_ISREG(e.st_mode)]
+    mimes = thread_map(file_mime, fns, jobs)
+    return dict((fn, res) for (fn, res) in mimes.items() if res is not None)
+
+
 def cmd_pipe(command1, command2):
     '''Try to pipe command1 into command2.'''
+    global _subprocess_count
+    _subprocess_count += 2
     try:
         sp1 = subprocess.Popen(command1, stdout=subprocess.PIPE)
         sp2 = subprocess.Popen(command2, stdin=sp1.stdout)
@@ -446,9 +1028,22 @@ def _unpack_snap_squashfs(snap_pkg, dest):
 
 
 def _unpack_click_deb(pkg, dest):
+    '''Unpack a click package to dest like 'dpkg-deb -R', hashing its ar
+       members along the way for archive_sha512sum()'''
     d = tempfile.mkdtemp(prefix='review-')
-    return _unpack_cmd(['dpkg-deb', '-R',
-                        os.path.abspath(pkg), d], d, dest)
+    try:
+        with deb.DebFile(pkg) as debfile:
+            debfile.extract(d)
+    except (deb.DebException, tarfile.TarError, OSError) as e:
+        recursive_rm(d)
+        error("unpacking failed: %s" % e)
+
+    if dest is None:
+        dest = d
+    else:
+        shutil.move(d, dest)
+
+    return dest
 
 
 def unpack_pkg(fn, dest=None):
@@ -469,6 +1064,15 @@ def unpack_pkg(fn, dest=None):
     return _unpack_click_deb(fn, dest)
 
 
+def open_package_fs(fn):
+    '''Return a PackageFS reading the package fn without unpacking it'''
+    try:
+        return packagefs.open_package_fs(fn)
+    except (deb.DebException, squashfs.SquashfsException,
+            packagefs.PackageFSException, tarfile.TarError, OSError) as e:
+        error("Could not read '%s': %s" % (fn, e))
+
+
 def is_squashfs(filename):
     '''Return true if the given filename as a squashfs header'''
     with open(filename, 'rb') as f:
@@ -476,38 +1080,202 @@ def is_squashfs(filename):
     return header.startswith(b"hsqs")
 
 
-def raw_unpack_pkg(fn, dest=None):
-    '''Unpack raw package'''
-    if not os.path.isfile(fn):
-        error("Could not find '%s'" % fn)
-    pkg = fn
-    if not pkg.startswith('/'):
-        pkg = os.path.abspath(pkg)
-    # nothing to do for squashfs images
-    if is_squashfs(pkg):
-        return ""
-
-    if dest is not None and os.path.exists(dest):
-        error("'%s' exists. Aborting." % dest)
+def archive_sha512sum(fn, member):
+    '''Return the sha512sum of the ar member of the click package fn.
+       This is recorded when the package is unpacked.'''
+    try:
+        return deb.member_hash(fn, member, 'sha512')
+    except (deb.DebException, IOError, OSError):
+        return None
 
-    d = tempfile.mkdtemp(prefix='review-')
 
-    curdir = os.getcwd()
-    os.chdir(d)
-    (rc, out) = cmd(['ar', 'x', pkg])
-    os.chdir(curdir)
+def list_all_files(unpack_dir):
+    '''List all files in the unpacked package'''
+    return PackageInventory.scan(unpack_dir).paths()
 
-    if rc != 0:
-        if os.path.isdir(d):
-            recursive_rm(d)
-        error("'ar x' failed with '%d':\n%s" % (rc, out))
 
-    if dest is None:
-        dest = d
-    else:
-        shutil.move(d, dest)
+class InventoryEntry(object):
+    '''This class represents a file in a PackageInventory along with its
+       lstat() data. The realpath is resolved on first use.'''
+    __slots__ = ['path', 'relpath', 'st_mode', 'st_size', 'st_uid', 'st_gid',
+                 'st_mtime', 'link_target', '_realpath']
 
-    return dest
+    def __init__(self, path, relpath, st=None, link_target=None):
+        self.path = path
+        self.relpath = relpath
+        if st is None:  # file is missing
+            (self.st_mode, self.st_size, self.st_uid, self.st_gid,
+             self.st_mtime) = (None, None, None, None, None)
+        else:
+            (self.st_mode, self.st_size, self.st_uid, self.st_gid,
+             self.st_mtime) = (st.st_mode, st.st_size, st.st_uid, st.st_gid,
+                               st.st_mtime)
+        self.link_target = link_target
+        self._realpath = None
+
+    def __repr__(self):
+        return "InventoryEntry(%r)" % self.relpath
+
+    @property
+    def exists(self):
+        return self.st_mode is not None
+
+    @property
+    def is_symlink(self):
+        return self.exists and stat.S_ISLNK(self.st_mode)
+
+    @property
+    def basename(self):
+        return os.path.basename(self.relpath)
+
+    @property
+    def realpath(self):
+        if self._realpath is None:
+            self._realpath = os.path.realpath(self.path)
+        return self._realpath
+
+
+def _inventory_entry(path, relpath, st):
+    '''Return the InventoryEntry for path with lstat() data st'''
+    link_target = None
+    if st is not None and stat.S_ISLNK(st.st_mode):
+        try:
+            link_target = os.readlink(path)
+        except OSError:
+            pass
+    return InventoryEntry(path, relpath, st, link_target)
+
+
+class PackageInventory(object):
+    '''This class represents the files of an unpacked package (the same
+       files as list_all_files(), in the same order) indexed by path,
+       basename, extension and directory, so that checks can look files up
+       instead of walking and stat()ing the package again.'''
+    def __init__(self, unpack_dir, entries):
+        self.unpack_dir = unpack_dir
+        self.entries = entries
+        self._by_path = dict()
+        self._by_basename = dict()
+        self._by_extension = dict()
+        for e in entries:
+            self._by_path[e.path] = e
+            name = e.basename
+            self._by_basename.setdefault(name, []).append(e)
+            ext = os.path.splitext(name)[1]
+            if ext:
+                self._by_extension.setdefault(ext, []).append(e)
+        self._sorted = sorted(entries, key=lambda e: e.relpath)
+        self._sorted_relpaths = [e.relpath for e in self._sorted]
+
+    @classmethod
+    def scan(cls, unpack_dir):
+        '''Inventory unpack_dir with os.scandir(). Like os.walk(), symlinks
+           to directories are not followed and not listed.'''
+        entries = []
+        stack = [(unpack_dir, '')]
+        while stack:
+            (top, reltop) = stack.pop()
+            subdirs = []
+            try:
+                it = os.scandir(top)
+            except OSError:
+                continue
+            for d in it:
+                relpath = reltop + d.name
+                try:
+                    is_dir = d.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not d.is_symlink():
+                        subdirs.append((d.path, relpath + '/'))
+                    continue
+                try:
+                    st = d.stat(follow_symlinks=False)
+                except OSError:
+                    st = None
+                entries.append(_inventory_entry(d.path, relpath, st))
+            # os.walk() order: each directory's files, then its
+            # subdirectories depth first
+            stack.extend(reversed(subdirs))
+        return cls(unpack_dir, entries)
+
+    @classmethod
+    def from_paths(cls, unpack_dir, paths, previous=None):
+        '''Inventory the given paths, reusing the entries of the previous
+           inventory where possible'''
+        entries = []
+        for path in paths:
+            e = previous.get(path) if previous is not None else None
+            if e is None:
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    st = None
+                relpath = path if unpack_dir is None else \
+                    os.path.relpath(path, unpack_dir)
+                e = _inventory_entry(path, relpath, st)
+            entries.append(e)
+        return cls(unpack_dir, entries)
+
+    @classmethod
+    def from_fs(cls, fs):
+        '''Inventory the files of the PackageFS fs, with fs.path() paths.
+           As with scan(), symlinks to directories are not listed.'''
+        entries = []
+        for (top, dirnames, filenames) in fs.walk():
+            for name in filenames:
+                relpath = posixpath.join(top, name)
+                st = fs.lstat(relpath)
+                link_target = fs.readlink(relpath) \
+                    if stat.S_ISLNK(st.st_mode) else None
+                entries.append(InventoryEntry(fs.path(relpath), relpath, st,
+                                              link_target))
+        return cls(fs.root, entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return path in self._by_path
+
+    def paths(self):
+        '''Return the list of paths of all files'''
+        return [e.path for e in self.entries]
+
+    def get(self, path):
+        '''Return the entry for path, None if it is not in the package'''
+        return self._by_path.get(path, None)
+
+    def basenames(self):
+        '''Return all the distinct file basenames'''
+        return self._by_basename.keys()
+
+    def with_basename(self, name):
+        '''Return the entries with the given basename'''
+        return self._by_basename.get(name, [])
+
+    def with_extension(self, ext):
+        '''Return the entries with extension 'ext' (eg, '.desktop'), in
+           os.walk() order'''
+        return self._by_extension.get(ext, [])
+
+    def under(self, directory):
+        '''Return the entries somewhere under the relative 'directory',
+           sorted by relative path'''
+        prefix = directory.rstrip('/') + '/'
+        start = bisect.bisect_left(self._sorted_relpaths, prefix)
+        # '0' sorts right after '/'
+        end = bisect.bisect_left(self._sorted_relpaths, prefix[:-1] + '0',
+                                 start)
+        return self._sorted[start:end]
+
+    def symlinks(self):
+        '''Return the entries which are symlinks'''
+        return [e for e in self.entries if e.is_symlink]
 
 
 def create_tempdir():
@@ -551,13 +1319,29 @@ def recursive_rm(dirPath, contents_only=False):
 
 
 def run_check(cls):
-    if len(sys.argv) < 2:
-        error("Must give path to package")
-
     # extract args
-    fn = sys.argv[1]
-    if len(sys.argv) > 2:
-        overrides = json.loads(sys.argv[2])
+    global PROFILE
+    global SELECTION
+    args = sys.argv[1:]
+    if '--profile' in args:
+        args.remove('--profile')
+        PROFILE = True
+    only = []
+    skip = []
+    for (option, patterns) in [('--only', only), ('--skip', skip)]:
+        while option in args:
+            i = args.index(option)
+            if i + 1 >= len(args):
+                error("%s needs a pattern" % option)
+            patterns.append(args[i + 1])
+            del args[i:i + 2]
+    if only or skip:
+        SELECTION = CheckSelection(only, skip)
+    if len(args) < 1:
+        error("Must give path to package")
+    fn = args[0]
+    if len(args) > 1:
+        overrides = json.loads(args[1])
     else:
         overrides = None
 
@@ -567,22 +1351,15 @@ def run_check(cls):
     sys.exit(rc)
 
 
-def detect_package(fn, dir=None):
-    '''Detect what type of package this is'''
+def detect_package(fn, dir=None, fs=None):
+    '''Detect what type of package this is, looking at the unpacked package
+       in dir or the PackageFS fs if given'''
     pkgtype = None
     pkgver = None
 
     if not os.path.isfile(fn):
         error("Could not find '%s'" % fn)
 
-    if dir is None:
-        unpack_dir = unpack_pkg(fn)
-    else:
-        unpack_dir = dir
-
-    if not os.path.isdir(unpack_dir):
-        error("Could not find '%s'" % unpack_dir)
-
     pkg = fn
     if not pkg.startswith('/'):
         pkg = os.path.abspath(pkg)
@@ -590,9 +1367,19 @@ def detect_package(fn, dir=None):
     # check if its a squashfs based snap
     if is_squashfs(pkg):
         # 16.04+ squashfs snaps
-        pkgtype = "snap"
-        pkgver = 2
-    elif os.path.exists(os.path.join(unpack_dir, "meta/package.yaml")):
+        return ("snap", 2)
+
+    if fs is not None:
+        is_snap1 = fs.exists("meta/package.yaml")
+    elif dir is not None:
+        if not os.path.isdir(dir):
+            error("Could not find '%s'" % dir)
+        is_snap1 = os.path.exists(os.path.join(dir, "meta/package.yaml"))
+    else:
+        with open_package_fs(pkg) as pkg_fs:
+            is_snap1 = pkg_fs.exists("meta/package.yaml")
+
+    if is_snap1:
         # 15.04 ar-based snaps
         pkgtype = "snap"
         pkgver = 1
@@ -600,13 +1387,10 @@ def detect_package(fn, dir=None):
         pkgtype = "click"
         pkgver = 1
 
-    if dir is None and os.path.isdir(unpack_dir):
-        recursive_rm(unpack_dir)
-
     return (pkgtype, pkgver)
 
 
-def find_external_symlinks(unpack_dir, pkg_files, pkgname):
+def find_external_symlinks(inventory, pkgname):
     '''Check if symlinks in the package go out to the system.'''
     common = '(-[0-9.]+)?\.so(\.[0-9.]+)?'
     libc6_libs = ['ld-*.so',
@@ -648,20 +1432,22 @@ def find_external_symlinks(unpack_dir, pkg_files, pkgname):
         return False
 
     def _is_external(link, pats, pkgname):
-        rp = os.path.realpath(link)
-        if not rp.startswith(unpack_dir + "/") and \
+        rp = link.realpath
+        if not rp.startswith(inventory.unpack_dir + "/") and \
                 not rp.startswith(os.path.join("/snap", pkgname) + "/") and \
                 not rp.startswith(
                     os.path.join("/var/snap", pkgname) + "/") and \
-                not _in_patterns(pats, os.path.basename(link)):
+                not _in_patterns(pats, link.basename):
             return True
         return False
 
+    # only symlinks can point out of the package since the walk doesn't
+    # follow symlinked directories
     external_symlinks = list(filter(lambda link:
                              _is_external(link, libc6_pats, pkgname),
-                             pkg_files))
+                             inventory.symlinks()))
 
-    return [os.path.relpath(i, unpack_dir) for i in external_symlinks]
+    return [link.relpath for link in external_symlinks]
 
 
 # check_results(report, expected_counts, expected)
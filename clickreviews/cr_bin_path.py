@@ -22,9 +22,13 @@ import os
 
 class ClickReviewBinPath(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
+    review_type = "bin-path"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
         # bin-path is ignored by snappy install so don't bother with peerhooks
-        ClickReview.__init__(self, fn, "bin-path", overrides=overrides)
+        ClickReview.__init__(self, fn, self.review_type, overrides=overrides,
+                             context=context)
 
         self.bin_paths_files = dict()
         self.bin_paths = dict()
@@ -60,15 +64,14 @@ class ClickReviewBinPath(ClickReview):
     def _extract_bin_path(self, app):
         '''Get bin-path for app'''
         rel = self.bin_paths[app]
-        fn = os.path.join(self.unpack_dir, rel)
-        if not os.path.exists(fn):
+        if not self.fs.exists(rel):
             error("Could not find '%s'" % rel)
-        return fn
+        return self.fs.path(rel)
 
     def _check_bin_path_executable(self, app):
         '''Check that the provided path exists'''
         fn = self.bin_paths_files[app]
-        return os.access(fn, os.X_OK)
+        return self.fs.access_x(self.fs.relpath(fn))
 
     def _verify_required(self, my_dict, test_str):
         for app in sorted(my_dict):
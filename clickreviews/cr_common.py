@@ -15,20 +15,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
-from debian.deb822 import Deb822
 import glob
 import json
 import os
 import pprint
 import re
-import yaml
 
 
 from clickreviews.common import (
     Review,
     ReviewException,
     error,
-    open_file_read,
 )
 
 
@@ -94,8 +91,9 @@ class ClickReview(Review):
                            "security-policy"]
 
     def __init__(self, fn, review_type, peer_hooks=None, overrides=None,
-                 peer_hooks_link=None):
-        Review.__init__(self, fn, review_type, overrides=overrides)
+                 peer_hooks_link=None, context=None):
+        Review.__init__(self, fn, review_type, overrides=overrides,
+                        context=context)
 
         # The cr_* scripts only support 15.04 snaps (v1). Use sr_* scripts for
         # 16.04 (v2) or higher
@@ -119,15 +117,9 @@ class ClickReview(Review):
         self.peer_hooks_link = peer_hooks_link
 
         if self.is_snap1:
-            pkg_yaml = self._extract_package_yaml()
-            if pkg_yaml:
-                try:
-                    self.pkg_yaml = yaml.safe_load(pkg_yaml)
-                except Exception:
-                    error("Could not load package.yaml. Is it properly formatted?")
-                self._verify_package_yaml_structure()
-            else:
-                error("Could not load package.yaml.")
+            self.pkg_yaml = self._get_cached('pkg_yaml',
+                                             self._load_package_yaml)
+            self._verify_package_yaml_structure()
 
             #  default to 'app'
             if 'type' not in self.pkg_yaml:
@@ -150,8 +142,7 @@ class ClickReview(Review):
 
         if self.is_click or self.is_snap1:
             # Get some basic information from the control file
-            control_file = self._extract_control_file()
-            tmp = list(Deb822.iter_paragraphs(control_file))
+            tmp = self._get_cached('control', self._load_control_file)
             if len(tmp) != 1:
                 error("malformed control file: too many paragraphs")
             control = tmp[0]
@@ -163,15 +154,36 @@ class ClickReview(Review):
                 self.pkgfmt["version"] = str(control['Click-Version'])
 
             # Parse and store the manifest
-            manifest_json = self._extract_manifest_file()
-            try:
-                self.manifest = json.load(manifest_json)
-            except Exception:
-                error("Could not load manifest file. Is it properly formatted?")
+            self.manifest = self._get_cached('manifest',
+                                             self._load_manifest_file)
             self._verify_manifest_structure()
 
             self.valid_frameworks = self._extract_click_frameworks()
 
+    def _load_package_yaml(self):
+        '''Load the snappy 15.04 package.yaml'''
+        pkg_yaml = self._extract_package_yaml()
+        if not pkg_yaml:
+            error("Could not load package.yaml.")
+        import yaml
+        try:
+            return yaml.safe_load(pkg_yaml)
+        except Exception:
+            error("Could not load package.yaml. Is it properly formatted?")
+
+    def _load_control_file(self):
+        '''Load the paragraphs of the control file'''
+        from debian.deb822 import Deb822
+        return list(Deb822.iter_paragraphs(self._extract_control_file()))
+
+    def _load_manifest_file(self):
+        '''Load the manifest file'''
+        manifest_json = self._extract_manifest_file()
+        try:
+            return json.load(manifest_json)
+        except Exception:
+            error("Could not load manifest file. Is it properly formatted?")
+
     def _extract_click_frameworks(self):
         '''Extract installed click frameworks'''
         # TODO: update to use libclick API when available
@@ -188,27 +200,24 @@ class ClickReview(Review):
 
     def _extract_manifest_file(self):
         '''Extract and read the manifest file'''
-        m = os.path.join(self.unpack_dir, "DEBIAN/manifest")
-        if not os.path.isfile(m):
+        if not self.fs.isfile("DEBIAN/manifest"):
             error("Could not find manifest file")
-        return open_file_read(m)
+        return self.fs.open_text("DEBIAN/manifest")
 
     def _extract_package_yaml(self):
         '''Extract and read the snappy 15.04 package.yaml'''
-        y = os.path.join(self.unpack_dir, "meta/package.yaml")
-        if not os.path.isfile(y):
+        if not self.fs.isfile("meta/package.yaml"):
             return None  # snappy packaging is still optional
-        return open_file_read(y)
+        return self.fs.open_text("meta/package.yaml")
 
     def _extract_hashes_yaml(self):
         '''Extract and read the snappy hashes.yaml'''
-        y = os.path.join(self.unpack_dir, "DEBIAN/hashes.yaml")
-        return open_file_read(y)
+        return self.fs.open_text("DEBIAN/hashes.yaml")
 
     def _extract_control_file(self):
         '''Extract '''
-        fh = open_file_read(os.path.join(self.unpack_dir, "DEBIAN/control"))
-        return fh.readlines()
+        with self.fs.open_text("DEBIAN/control") as fh:
+            return fh.readlines()
 
     def _verify_manifest_structure(self):
         '''Verify manifest has the expected structure'''
@@ -282,6 +291,7 @@ class ClickReview(Review):
         '''Verify package.yaml has the expected structure'''
         # https://developer.ubuntu.com/en/snappy/guides/packaging-format-apps/
         # lp:click doc/file-format.rst
+        import yaml
         yp = yaml.dump(self.pkg_yaml, default_flow_style=False, indent=4)
         if not isinstance(self.pkg_yaml, dict):
             error("package yaml malformed:\n%s" % self.pkg_yaml)
@@ -390,12 +400,12 @@ class ClickReview(Review):
         if not self.aa_policy:
             return None
 
-        if vendor not in self.aa_policy:
+        if not self.aa_index.has_vendor(vendor):
             error("Could not find vendor '%s'" % vendor, do_exit=False)
             return None
 
         supported_policy_versions = []
-        for i in self.aa_policy[vendor].keys():
+        for i in self.aa_index.versions(vendor):
             supported_policy_versions.append("%.1f" % float(i))
 
         return sorted(supported_policy_versions)
@@ -405,69 +415,48 @@ class ClickReview(Review):
         if not self.aa_policy:
             return None
 
-        templates = []
-        if aa_type == "all":
-            for k in self.aa_policy[vendor][version]['templates'].keys():
-                templates += self.aa_policy[vendor][version]['templates'][k]
-        else:
-            templates = self.aa_policy[vendor][version]['templates'][aa_type]
-
-        return sorted(templates)
+        return self.aa_index.names(vendor, version, 'templates', aa_type)
 
     def _has_policy_version(self, vendor, version):
         '''Determine if has specified policy version'''
         if not self.aa_policy:
             return None
 
-        if vendor not in self.aa_policy:
+        if not self.aa_index.has_vendor(vendor):
             error("Could not find vendor '%s'" % vendor, do_exit=False)
             return False
 
-        if str(version) not in self.aa_policy[vendor]:
-            return False
-        return True
+        return self.aa_index.has_version(vendor, version)
 
     def _get_policy_groups(self, vendor, version, aa_type="all"):
         '''Get policy groups by type'''
         if not self.aa_policy:
             return None
 
-        groups = []
-        if vendor not in self.aa_policy:
+        if not self.aa_index.has_vendor(vendor):
             error("Could not find vendor '%s'" % vendor, do_exit=False)
-            return groups
+            return []
 
         if not self._has_policy_version(vendor, version):
             error("Could not find version '%s'" % version, do_exit=False)
-            return groups
-
-        v = str(version)
-        if aa_type == "all":
-            for k in self.aa_policy[vendor][v]['policy_groups'].keys():
-                groups += self.aa_policy[vendor][v]['policy_groups'][k]
-        else:
-            groups = self.aa_policy[vendor][v]['policy_groups'][aa_type]
+            return []
 
-        return sorted(groups)
+        return self.aa_index.names(vendor, version, 'policy_groups', aa_type)
 
     def _get_policy_group_type(self, vendor, version, policy_group):
         '''Return policy group type'''
         if not self.aa_policy:
             return None
 
-        for t in self.aa_policy[vendor][version]['policy_groups']:
-            if policy_group in self.aa_policy[vendor][version]['policy_groups'][t]:
-                return t
-        return None
+        return self.aa_index.get_type(vendor, version, 'policy_groups',
+                                      policy_group)
 
     def _get_template_type(self, vendor, version, template):
         '''Return template type'''
         if not self.aa_policy:
             return None
 
-        for t in self.aa_policy[vendor][version]['templates']:
-            if template in self.aa_policy[vendor][version]['templates'][t]:
-                return t
+        return self.aa_index.get_type(vendor, version, 'templates', template)
 
     def check_peer_hooks(self, hooks_sublist=[]):
         '''Check if peer hooks are valid'''
@@ -16,22 +16,25 @@
 
 from __future__ import print_function
 
-from clickreviews.cr_common import ClickReview, error, open_file_read
+from clickreviews.cr_common import ClickReview, error
 import json
 import os
 
 
 class ClickReviewContentHub(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
+    review_type = "content_hub"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
         peer_hooks = dict()
         my_hook = 'content-hub'
         peer_hooks[my_hook] = dict()
         peer_hooks[my_hook]['allowed'] = ClickReview.app_allowed_peer_hooks
         peer_hooks[my_hook]['required'] = []
 
-        ClickReview.__init__(self, fn, "content_hub", peer_hooks=peer_hooks,
-                             overrides=overrides)
+        ClickReview.__init__(self, fn, self.review_type, peer_hooks=peer_hooks,
+                             overrides=overrides, context=context)
         if not self.is_click and not self.is_snap1:
             return
 
@@ -56,13 +59,13 @@ class ClickReviewContentHub(ClickReview):
     def _extract_content_hub(self, app):
         '''Get content-hub hook content'''
         c = self.manifest['hooks'][app]['content-hub']
-        fn = os.path.join(self.unpack_dir, c)
+        fn = self.fs.path(c)
 
         bn = os.path.basename(fn)
-        if not os.path.exists(fn):
+        if not self.fs.exists(c):
             error("Could not find '%s'" % bn)
 
-        fh = open_file_read(fn)
+        fh = self.fs.open_text(c)
         contents = ""
         for line in fh.readlines():
                 contents += line
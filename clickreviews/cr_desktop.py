@@ -16,30 +16,32 @@
 
 from __future__ import print_function
 
-from clickreviews.cr_common import ClickReview, error, open_file_read
-import glob
+from clickreviews.cr_common import ClickReview, error
+from clickreviews.common import reports, requires
 import json
 import os
 import re
 from urllib.parse import urlsplit
-from xdg.DesktopEntry import DesktopEntry
-from xdg.Exceptions import ParsingError as xdgParsingError
 
 
 class ClickReviewDesktop(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
+    review_type = "desktop"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
         peer_hooks = dict()
         my_hook = 'desktop'
         peer_hooks[my_hook] = dict()
         peer_hooks[my_hook]['allowed'] = ClickReview.app_allowed_peer_hooks
         peer_hooks[my_hook]['required'] = ["apparmor"]
 
-        ClickReview.__init__(self, fn, "desktop", peer_hooks=peer_hooks,
-                             overrides=overrides)
+        ClickReview.__init__(self, fn, self.review_type, peer_hooks=peer_hooks,
+                             overrides=overrides, context=context)
         if not self.is_click and not self.is_snap1:
             return
 
+        # filled in by _extract_desktop_entries()
         self.desktop_files = dict()  # click-show-files and a couple tests
         self.desktop_entries = dict()
         self.desktop_hook_entries = 0
@@ -47,17 +49,6 @@ class ClickReviewDesktop(ClickReview):
         if self.manifest is None:
             return
 
-        for app in self.manifest['hooks']:
-            if 'desktop' not in self.manifest['hooks'][app]:
-                # msg("Skipped missing desktop hook for '%s'" % app)
-                continue
-            if not isinstance(self.manifest['hooks'][app]['desktop'], str):
-                error("manifest malformed: hooks/%s/desktop is not str" % app)
-            self.desktop_hook_entries += 1
-            (de, full_fn) = self._extract_desktop_entry(app)
-            self.desktop_entries[app] = de
-            self.desktop_files[app] = full_fn
-
         self.required_keys = ['Name',
                               'Type',
                               'Icon',
@@ -74,28 +65,49 @@ class ClickReviewDesktop(ClickReview):
         # TODO: the desktop hook will actually handle this correctly
         self.blacklisted_keys = ['Path']
 
+    def _extract_desktop_entries(self):
+        '''Parse the desktop files of all the apps'''
+        if not self.is_click and not self.is_snap1:
+            return
+        if self.manifest is None:
+            return
+
+        for app in self.manifest['hooks']:
+            if 'desktop' not in self.manifest['hooks'][app]:
+                # msg("Skipped missing desktop hook for '%s'" % app)
+                continue
+            if not isinstance(self.manifest['hooks'][app]['desktop'], str):
+                error("manifest malformed: hooks/%s/desktop is not str" % app)
+            self.desktop_hook_entries += 1
+            (de, full_fn) = self._extract_desktop_entry(app)
+            self.desktop_entries[app] = de
+            self.desktop_files[app] = full_fn
+
     def _extract_desktop_entry(self, app):
         '''Get DesktopEntry for desktop file and verify it'''
         d = self.manifest['hooks'][app]['desktop']
-        fn = os.path.join(self.unpack_dir, d)
+        fn = self.fs.path(d)
 
         bn = os.path.basename(fn)
-        if not os.path.exists(fn):
+        if not self.fs.exists(d):
             error("Could not find '%s'" % bn)
 
-        fh = open_file_read(fn)
+        fh = self.fs.open_text(d)
         contents = ""
         for line in fh.readlines():
             contents += line
         fh.close()
 
+        # pyxdg is slow to import and only needed here
+        from xdg.DesktopEntry import DesktopEntry
+        from xdg.Exceptions import ParsingError as xdgParsingError
         try:
-            de = DesktopEntry(fn)
+            de = DesktopEntry(self.fs.local_path(d))
         except xdgParsingError as e:
             error("desktop file unparseable: %s (%s):\n%s" % (bn, str(e),
                                                               contents))
         try:
-            de.parse(fn)
+            de.parse(self.fs.local_path(d))
         except Exception as e:
             error("desktop file unparseable: %s (%s):\n%s" % (bn, str(e),
                                                               contents))
@@ -105,14 +117,18 @@ class ClickReviewDesktop(ClickReview):
         '''Get DesktopEntry from parsed values'''
         return self.desktop_entries[app]
 
+    @requires('_extract_desktop_entries')
     def _get_desktop_files(self):
         '''Get desktop_files (abstracted out for mock)'''
         return self.desktop_files
 
+    @requires('_extract_desktop_entries')
     def _get_desktop_filename(self, app):
         '''Get desktop file filenames'''
         return self.desktop_files[app]
 
+    @reports('files_usable')
+    @requires('_extract_desktop_entries')
     def check_desktop_file(self):
         '''Check desktop file'''
         if not self.is_click and not self.is_snap1:
@@ -128,6 +144,8 @@ class ClickReviewDesktop(ClickReview):
             s = 'Skipped: could not find any desktop files'
         self._add_result(t, n, s)
 
+    @reports('validates')
+    @requires('_extract_desktop_entries')
     def check_desktop_file_valid(self):
         '''Check desktop file validates'''
         if not self.is_click and not self.is_snap1:
@@ -147,6 +165,8 @@ class ClickReviewDesktop(ClickReview):
                 link = 'http://askubuntu.com/questions/417377/what-does-desktop-validates-mean/417378'
             self._add_result(t, n, s, link)
 
+    @reports('required_keys', 'required_fields_not_empty')
+    @requires('_extract_desktop_entries')
     def check_desktop_required_keys(self):
         '''Check for required keys'''
         if not self.is_click and not self.is_snap1:
@@ -178,6 +198,8 @@ class ClickReviewDesktop(ClickReview):
                 s = 'Empty required keys: %s' % ",".join(empty)
             self._add_result(t, n, s)
 
+    @reports('blacklisted_keys')
+    @requires('_extract_desktop_entries')
     def check_desktop_blacklisted_keys(self):
         '''Check for blacklisted keys'''
         if not self.is_click and not self.is_snap1:
@@ -197,6 +219,8 @@ class ClickReviewDesktop(ClickReview):
                 s = 'found blacklisted keys: %s' % ",".join(found)
             self._add_result(t, n, s)
 
+    @reports('Exec')
+    @requires('_extract_desktop_entries')
     def check_desktop_exec(self):
         '''Check Exec entry'''
         if not self.is_click and not self.is_snap1:
@@ -233,6 +257,9 @@ class ClickReviewDesktop(ClickReview):
                     t = 'info'
             self._add_result(t, n, s, link)
 
+    @reports('Exec_webapp_container', 'Exec_webapp_container_webapp',
+             'Exec_webapp_container_13.10')
+    @requires('_extract_desktop_entries')
     def check_desktop_exec_webapp_container(self):
         '''Check Exec=webapp-container entry'''
         if not self.is_click and not self.is_snap1:
@@ -290,6 +317,9 @@ class ClickReviewDesktop(ClickReview):
                     "framework" % self.manifest['framework']
             self._add_result(t, n, s)
 
+    @reports('Exec_webbrowser', 'Exec_webbrowser_webapp',
+             'Exec_webbrowser_13.10')
+    @requires('_extract_desktop_entries')
     def check_desktop_exec_webbrowser(self):
         '''Check Exec=webbrowser-app entry'''
         if not self.is_click and not self.is_snap1:
@@ -328,6 +358,9 @@ class ClickReviewDesktop(ClickReview):
                     self.manifest['framework']
             self._add_result(t, n, s)
 
+    @reports('Exec_webapp_args', 'Exec_webapp_args_minimal_chrome',
+             'Exec_webapp_args_required')
+    @requires('_extract_desktop_entries')
     def check_desktop_exec_webapp_args(self):
         '''Check Exec=web* args'''
         if not self.is_click and not self.is_snap1:
@@ -499,6 +532,15 @@ class ClickReviewDesktop(ClickReview):
 
             pattern_count += 1
 
+    @reports('Exec_webbrowser_webappUrlPatterns',
+             'Exec_webbrowser_webapp_url_patterns_has_https',
+             'Exec_webbrowser_webapp_url_patterns_uses_trailing_glob',
+             'Exec_webbrowser_webapp_url_patterns_uses_unsafe_glob',
+             'Exec_webbrowser_webapp_url_patterns_uses_safe_glob',
+             'Exec_webbrowser_target_exists',
+             'Exec_webbrowser_target_scheme_matches_patterns',
+             'Exec_webbrowser_target_netloc_matches_patterns')
+    @requires('_extract_desktop_entries')
     def check_desktop_exec_webbrowser_urlpatterns(self):
         '''Check Exec=webbrowser-app entry has valid --webappUrlPatterns'''
         if not self.is_click and not self.is_snap1:
@@ -545,20 +587,32 @@ class ClickReviewDesktop(ClickReview):
 
     def _extract_webapp_manifests(self):
         '''Extract webapp manifest file'''
-        files = sorted(glob.glob("%s/unity-webapps-*/manifest.json" %
-                       self.unpack_dir))
+        files = self.fs.glob("unity-webapps-*/manifest.json")
 
         manifests = dict()
-        for fn in files:
-            key = os.path.relpath(fn, self.unpack_dir)
+        for key in files:
             try:
-                manifests[key] = json.load(open_file_read(fn))
+                with self.fs.open_text(key) as f:
+                    manifests[key] = json.load(f)
             except Exception:
                 manifests[key] = None
-                error("Could not parse '%s'" % fn, do_exit=False)
+                error("Could not parse '%s'" % self.fs.path(key),
+                      do_exit=False)
 
         return manifests
 
+    @reports('Exec_webbrowser_webappModelSearchPath_present',
+             'Exec_webbrowser_webapp_manifest',
+             'Exec_webbrowser_webapp_manifest_wellformed',
+             'Exec_webbrowser_webapp_manifest_includes_present',
+             'Exec_webbrowser_webapp_url_patterns_has_https',
+             'Exec_webbrowser_webapp_url_patterns_uses_trailing_glob',
+             'Exec_webbrowser_webapp_url_patterns_uses_unsafe_glob',
+             'Exec_webbrowser_webapp_url_patterns_uses_safe_glob',
+             'Exec_webbrowser_target_exists',
+             'Exec_webbrowser_target_scheme_matches_patterns',
+             'Exec_webbrowser_target_netloc_matches_patterns')
+    @requires('_extract_desktop_entries')
     def check_desktop_exec_webbrowser_modelsearchpath(self):
         '''Check Exec=webbrowser-app entry has valid --webappModelSearchPath'''
         if not self.is_click and not self.is_snap1:
@@ -667,6 +721,8 @@ class ClickReviewDesktop(ClickReview):
 
                 self._check_patterns(app, m['includes'], args)
 
+    @reports('groups')
+    @requires('_extract_desktop_entries')
     def check_desktop_groups(self):
         '''Check Desktop Entry entry'''
         if not self.is_click and not self.is_snap1:
@@ -685,6 +741,8 @@ class ClickReviewDesktop(ClickReview):
                 s = "'[Desktop Entry]' group not found"
             self._add_result(t, n, s)
 
+    @reports('Type')
+    @requires('_extract_desktop_entries')
     def check_desktop_type(self):
         '''Check Type entry'''
         if not self.is_click and not self.is_snap1:
@@ -703,6 +761,8 @@ class ClickReviewDesktop(ClickReview):
                 s = 'does not use Type=Application'
             self._add_result(t, n, s)
 
+    @reports('X-Ubuntu-Touch')
+    @requires('_extract_desktop_entries')
     def check_desktop_x_ubuntu_touch(self):
         '''Check X-Ubuntu-Touch entry'''
         if not self.is_click and not self.is_snap1:
@@ -722,6 +782,8 @@ class ClickReviewDesktop(ClickReview):
                 s = 'does not use X-Ubuntu-Touch=true'
             self._add_result(t, n, s)
 
+    @reports('X-Ubuntu-StageHint')
+    @requires('_extract_desktop_entries')
     def check_desktop_x_ubuntu_stagehint(self):
         '''Check X-Ubuntu-StageHint entry'''
         if not self.is_click and not self.is_snap1:
@@ -742,6 +804,8 @@ class ClickReviewDesktop(ClickReview):
                     "(should be for example, 'SideStage')"
             self._add_result(t, n, s)
 
+    @reports('X-Ubuntu-Gettext-Domain')
+    @requires('_extract_desktop_entries')
     def check_desktop_x_ubuntu_gettext_domain(self):
         '''Check X-Ubuntu-Gettext-Domain entry'''
         if not self.is_click and not self.is_snap1:
@@ -767,6 +831,8 @@ class ClickReviewDesktop(ClickReview):
                      " or uses organizationName"
             self._add_result(t, n, s)
 
+    @reports('Terminal')
+    @requires('_extract_desktop_entries')
     def check_desktop_terminal(self):
         '''Check Terminal entry'''
         if not self.is_click and not self.is_snap1:
@@ -784,6 +850,8 @@ class ClickReviewDesktop(ClickReview):
                 s = 'does not use Terminal=false (%s)' % de.getTerminal()
             self._add_result(t, n, s)
 
+    @reports('Version')
+    @requires('_extract_desktop_entries')
     def check_desktop_version(self):
         '''Check Version entry'''
         if not self.is_click and not self.is_snap1:
@@ -805,6 +873,8 @@ class ClickReviewDesktop(ClickReview):
                 link = 'http://askubuntu.com/questions/419907/what-does-version-mean-in-the-desktop-file/419908'
             self._add_result(t, n, s, link)
 
+    @reports('Comment_boilerplate')
+    @requires('_extract_desktop_entries')
     def check_desktop_comment(self):
         '''Check Comment entry'''
         if not self.is_click and not self.is_snap1:
@@ -823,6 +893,8 @@ class ClickReviewDesktop(ClickReview):
                 link = 'http://askubuntu.com/questions/417359/what-does-desktop-comment-boilerplate-mean/417360'
             self._add_result(t, n, s, link)
 
+    @reports('Icon')
+    @requires('_extract_desktop_entries')
     def check_desktop_icon(self):
         '''Check Icon entry'''
         if not self.is_click and not self.is_snap1:
@@ -847,12 +919,9 @@ class ClickReviewDesktop(ClickReview):
                 s = "absolute path '%s' for icon given in .desktop file." % \
                     de.getIcon()
                 link = 'http://askubuntu.com/questions/417369/what-does-desktop-icon-mean/417370'
-            elif not os.path.exists(os.path.join(self.unpack_dir,
-                                                 de.getIcon())) and \
+            elif not self.fs.exists(de.getIcon()) and \
                     True not in filter(lambda a:
-                                       os.path.exists(os.path.join(
-                                                      self.unpack_dir,
-                                                      de.getIcon() + a)),
+                                       self.fs.exists(de.getIcon() + a),
                                        ICON_SUFFIXES):
                 t = 'error'
                 s = "'%s' specified as icon in .desktop file for app '%s', " \
@@ -861,6 +930,8 @@ class ClickReviewDesktop(ClickReview):
                 link = 'http://askubuntu.com/questions/417369/what-does-desktop-icon-mean/417370'
             self._add_result(t, n, s, link)
 
+    @reports('duplicate_keys')
+    @requires('_extract_desktop_entries')
     def check_desktop_duplicate_entries(self):
         '''Check desktop for duplicate entries'''
         if not self.is_click and not self.is_snap1:
@@ -873,7 +944,8 @@ class ClickReviewDesktop(ClickReview):
             n = self._get_check_name('duplicate_keys', app=app)
             s = 'OK'
             fn = self._get_desktop_filename(app)
-            content = open_file_read(fn).readlines()
+            with self.fs.open_text(self.fs.relpath(fn)) as f:
+                content = f.readlines()
             for line in content:
                 tmp = line.split('=')
                 if len(tmp) < 2:
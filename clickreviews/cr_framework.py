@@ -16,16 +16,19 @@
 
 from __future__ import print_function
 
-from clickreviews.cr_common import ClickReview, error, open_file_read
-import glob
+from clickreviews.cr_common import ClickReview, error
 import os
 import re
 
 
 class ClickReviewFramework(ClickReview):
     '''This class represents click framework reviews'''
-    def __init__(self, fn, overrides=None):
-        ClickReview.__init__(self, fn, "framework", overrides=overrides)
+    review_type = "framework"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
+        ClickReview.__init__(self, fn, self.review_type, overrides=overrides,
+                             context=context)
 
         self.frameworks_file = dict()
         self.frameworks = dict()
@@ -53,12 +56,12 @@ class ClickReviewFramework(ClickReview):
     def _extract_framework(self, app):
         '''Get framework for app'''
         rel = self.manifest['hooks'][app]['framework']
-        fn = os.path.join(self.unpack_dir, rel)
-        if not os.path.exists(fn):
+        fn = self.fs.path(rel)
+        if not self.fs.exists(rel):
             error("Could not find '%s'" % rel)
 
         data = dict()
-        fh = open_file_read(fn)
+        fh = self.fs.open_text(rel)
         for line in fh.readlines():
             tmp = line.split(':')
             if len(tmp) != 2:
@@ -72,29 +75,29 @@ class ClickReviewFramework(ClickReview):
         '''Get framework policy files'''
         policy_dict = dict()
         unknown = []
-        fpdir = os.path.join(self.unpack_dir, "meta", "framework-policy")
-        for i in glob.glob("%s/*" % fpdir):
+        for i in self.fs.glob("meta/framework-policy/*"):
             rel_i = os.path.basename(i)
-            if not os.path.isdir(i) or rel_i not in self.framework_policy_dirs:
-                unknown.append(os.path.relpath(i, self.unpack_dir))
+            if not self.fs.isdir(i) or \
+               rel_i not in self.framework_policy_dirs:
+                unknown.append(i)
                 continue
 
             policy_dict[rel_i] = dict()
-            for j in glob.glob("%s/*" % i):
+            for j in self.fs.glob("%s/*" % i):
                 rel_j = os.path.basename(j)
-                if not os.path.isdir(j) or \
+                if not self.fs.isdir(j) or \
                    rel_j not in self.framework_policy_subdirs:
-                    unknown.append(os.path.relpath(j, self.unpack_dir))
+                    unknown.append(j)
                     continue
 
                 policy_dict[rel_i][rel_j] = dict()
-                for k in glob.glob("%s/*" % j):
+                for k in self.fs.glob("%s/*" % j):
                     rel_k = os.path.basename(k)
-                    if not os.path.isfile(k):
-                        unknown.append(os.path.relpath(k, self.unpack_dir))
+                    if not self.fs.isfile(k):
+                        unknown.append(k)
                         continue
 
-                    fh = open_file_read(k)
+                    fh = self.fs.open_text(k)
                     policy_dict[rel_i][rel_j][rel_k] = fh.read()
                     fh.close()
         return (policy_dict, unknown)
@@ -104,9 +107,7 @@ class ClickReviewFramework(ClickReview):
         if not self.is_snap1:
             return False
 
-        return os.path.exists(os.path.join(self.unpack_dir, 'meta',
-                                           '%s.framework' %
-                                           self.pkg_yaml['name']))
+        return self.fs.exists('meta/%s.framework' % self.pkg_yaml['name'])
 
     def check_framework_hook_obsolete(self):
         '''Check manifest doesn't specify 'framework' hook'''
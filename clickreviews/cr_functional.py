@@ -19,7 +19,8 @@ import binascii
 import os
 import re
 
-from clickreviews.cr_common import ClickReview, open_file_read
+from clickreviews.common import open_file_read
+from clickreviews.cr_common import ClickReview
 
 # TODO: for QML apps, see if i18n.domain('%s') matches X-Ubuntu-Gettext-Domain
 #       compiled apps can use organizationName to match X-Ubuntu-Gettext-Domain
@@ -27,15 +28,16 @@ from clickreviews.cr_common import ClickReview, open_file_read
 
 class ClickReviewFunctional(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
-        ClickReview.__init__(self, fn, "functional", overrides=overrides)
+    review_type = "functional"
+
+    def __init__(self, fn, overrides=None, context=None):
+        ClickReview.__init__(self, fn, self.review_type, overrides=overrides,
+                             context=context)
         if not self.is_click and not self.is_snap1:
             return
 
-        self.qml_files = []
-        for i in self.pkg_files:
-            if i.endswith(".qml"):
-                self.qml_files.append(i)
+        self.qml_files = [f.path for f in
+                          self.pkg_inventory.with_extension(".qml")]
 
         self._list_all_compiled_binaries()
 
@@ -15,12 +15,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
-from debian.deb822 import Deb822
 import glob
 import os
 import re
 import stat
-import yaml
 
 from clickreviews.frameworks import Frameworks
 from clickreviews.cr_common import (
@@ -28,23 +26,38 @@ from clickreviews.cr_common import (
 )
 from clickreviews.common import (
     open_file_read,
-    cmd,
     error,
+    file_description,
+    hash_files,
+    thread_map,
 )
 from clickreviews.common import (
     find_external_symlinks,
+    reports,
+    requires,
 )
 
 CONTROL_FILE_NAMES = ["control", "manifest", "preinst"]
 MINIMUM_CLICK_FRAMEWORK_VERSION = "0.4"
 
 
+def _md5sum_line(digest, fn):
+    '''Return the line of 'md5sum' output for fn with the given digest'''
+    if '\\' in fn or '\n' in fn:
+        # md5sum escapes these and flags the line with a leading '\'
+        escaped = fn.replace('\\', '\\\\').replace('\n', '\\n')
+        return '\\%s  %s\n' % (digest, escaped)
+    return '%s  %s\n' % (digest, fn)
+
+
 class ClickReviewLint(ClickReview):
     '''This class represents click lint reviews'''
+    review_type = "lint"
 
-    def __init__(self, fn, overrides=None):
+    def __init__(self, fn, overrides=None, context=None):
         '''Set up the class.'''
-        ClickReview.__init__(self, fn, "lint", overrides=overrides)
+        ClickReview.__init__(self, fn, self.review_type, overrides=overrides,
+                             context=context)
         if not self.is_click and not self.is_snap1:
             return
 
@@ -107,8 +120,6 @@ class ClickReviewLint(ClickReview):
             self.is_core_scope = False
             self.is_core_snappy = False
 
-        self._list_all_compiled_binaries()
-
         self.known_hooks = ['accounts',
                             'account-application',
                             'account-provider',
@@ -193,6 +204,7 @@ class ClickReviewLint(ClickReview):
         if not self.is_click and not self.is_snap1:
             return
 
+        from debian.deb822 import Deb822
         fh = self._extract_control_file()
         tmp = list(Deb822.iter_paragraphs(fh))
         t = 'info'
@@ -360,18 +372,22 @@ class ClickReviewLint(ClickReview):
                     self._add_result(t, n, s)
                     return
 
-        curdir = os.getcwd()
         fh = open_file_read(self.control_files["md5sums"])
-        badsums = []
-        os.chdir(self.unpack_dir)
+        sums = []
         for line in fh.readlines():
             split_line = line.strip().split()
             fn = " ".join(split_line[1:])
-            (rc, out) = cmd(['md5sum', fn])
-            if line != out:
-                badsums.append(fn)
+            sums.append((line, fn))
         fh.close()
-        os.chdir(curdir)
+
+        digests = hash_files([os.path.join(self.unpack_dir, fn)
+                              for (line, fn) in sums], 'md5')
+        badsums = []
+        for (line, fn) in sums:
+            digest = digests[os.path.join(self.unpack_dir, fn)]
+            # compare with what 'md5sum fn' would output
+            if digest is None or line != _md5sum_line(digest, fn):
+                badsums.append(fn)
 
         s = 'OK'
         if len(badsums) > 0:
@@ -577,8 +593,7 @@ exit 1
                     self._add_result(t, n, s)
                     return
 
-        links = find_external_symlinks(self.unpack_dir, self.pkg_files,
-                                       self.click_pkgname)
+        links = find_external_symlinks(self.pkg_inventory, self.click_pkgname)
         if len(links) > 0:
             t = 'error'
             s = 'package contains external symlinks: %s' % ', '.join(links)
@@ -629,6 +644,8 @@ exit 1
             s = "not a valid architecture: %s" % self.pkg_arch[0]
         self._add_result(t, n, s)
 
+    @reports('control_architecture_valid_contents')
+    @requires('_list_all_compiled_binaries')
     def check_architecture_all(self):
         '''Check if actually architecture all'''
         if not self.is_click and not self.is_snap1:
@@ -651,6 +668,8 @@ exit 1
                 ", ".join(x_binaries)
         self._add_result(t, n, s)
 
+    @reports('architecture_specified_needed')
+    @requires('_list_all_compiled_binaries')
     def check_architecture_specified_needed(self):
         '''Check if the specified architecture is actually needed'''
         if not self.is_click and not self.is_snap1:
@@ -892,6 +911,7 @@ exit 1
             s = 'found .click in toplevel dir'
         self._add_result(t, n, s)
 
+    @reports('hardcoded_paths')
     def check_contents_for_hardcoded_paths(self):
         '''Check for known hardcoded paths.'''
         if not self.is_click and not self.is_snap1:
@@ -901,23 +921,21 @@ exit 1
         t = 'info'
         n = self._get_check_name('hardcoded_paths')
         s = 'OK'
-        for dirpath, dirnames, filenames in os.walk(self.unpack_dir):
-            for filename in filenames:
-                full_fn = os.path.join(dirpath, filename)
-                (rc, out) = cmd(['file', '-b', full_fn])
-                if 'text' not in out:
-                    continue
-                try:
-                    lines = open_file_read(full_fn).readlines()
-                    for bad_path in PATH_BLACKLIST:
-                        if list(filter(lambda line: bad_path in line, lines)):
-                            t = 'error'
-                            s = "Hardcoded path '%s' found in '%s'." % (
-                                bad_path, full_fn)
-                except FileNotFoundError:
-                    pass
-                except UnicodeDecodeError:
-                    pass
+        descriptions = thread_map(file_description, self.pkg_files)
+        for full_fn in self.pkg_files:
+            if 'text' not in (descriptions[full_fn] or ''):
+                continue
+            try:
+                lines = open_file_read(full_fn).readlines()
+                for bad_path in PATH_BLACKLIST:
+                    if list(filter(lambda line: bad_path in line, lines)):
+                        t = 'error'
+                        s = "Hardcoded path '%s' found in '%s'." % (
+                            bad_path, full_fn)
+            except FileNotFoundError:
+                pass
+            except UnicodeDecodeError:
+                pass
         self._add_result(t, n, s)
 
     def _verify_architecture(self, my_dict, test_str):
@@ -1156,7 +1174,7 @@ exit 1
             return
 
         fn = os.path.join(self.unpack_dir, 'meta/hooks/config')
-        if fn not in self.pkg_files:
+        if fn not in self.pkg_inventory:
             return
 
         t = 'info'
@@ -1212,6 +1230,7 @@ exit 1
                     return False
             return True
 
+        import yaml
         try:
             hashes_yaml = yaml.safe_load(self._extract_hashes_yaml())
         except Exception:
@@ -1228,8 +1247,7 @@ exit 1
         t = 'info'
         n = self._get_check_name('hashes_archive-sha512_valid')
         s = 'OK'
-        fn = self._path_join(self.raw_unpack_dir, 'data.tar.gz')
-        sum = self._get_sha512sum(fn)
+        sum = self._get_archive_sha512sum('data.tar.gz')
         if hashes_yaml['archive-sha512'] != sum:
             t = 'error'
             s = "hash mismatch: '%s' != '%s'" % (hashes_yaml['archive-sha512'],
@@ -1248,6 +1266,7 @@ exit 1
         # verify the individual files
         errors = []
         badsums = []
+        to_hash = []  # entries which passed the cheap tests
         hash_files = set([])  # used to check with extra files
         for entry in hashes_yaml['files']:
             if 'name' not in entry:
@@ -1325,9 +1344,13 @@ exit 1
 
             # ok, now all the cheap tests are done so we can check if we have a
             # valid sha512sum
-            sum = self._get_sha512sum(fn)
-            if entry['sha512'] != sum:
-                badsums.append("'%s' != '%s' for '%s'" % (entry['sha512'], sum,
+            to_hash.append((entry, fn))
+
+        sums = self._get_sha512sums([fn for (entry, fn) in to_hash])
+        for (entry, fn) in to_hash:
+            if entry['sha512'] != sums[fn]:
+                badsums.append("'%s' != '%s' for '%s'" % (entry['sha512'],
+                                                          sums[fn],
                                                           entry['name']))
 
         t = 'info'
@@ -1357,8 +1380,8 @@ exit 1
                                   "DEBIAN/preinst",
                                   "DEBIAN/manifest"
                                   ])
-        for f in self.pkg_files:
-            fn = os.path.relpath(f, self.unpack_dir)
+        for f in self.pkg_inventory:
+            fn = f.relpath
             if fn not in hash_files and fn not in click_compat_files:
                 extra.append(fn)
 
@@ -16,17 +16,18 @@
 
 from __future__ import print_function
 
-from clickreviews.cr_common import ClickReview, error, open_file_read
+from clickreviews.cr_common import ClickReview, error
 import json
 import os
 import re
-# http://lxml.de/tutorial.html
-import lxml.etree as etree
 
 
 class ClickReviewAccounts(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
+    review_type = "online_accounts"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
         peer_hooks = dict()
         peer_hooks['account-application'] = dict()
         peer_hooks['account-application']['allowed'] = \
@@ -65,10 +66,11 @@ class ClickReviewAccounts(ClickReview):
 
         ClickReview.__init__(self,
                              fn,
-                             "online_accounts",
+                             self.review_type,
                              peer_hooks=peer_hooks,
                              overrides=overrides,
-                             peer_hooks_link="https://wiki.ubuntu.com/SecurityTeam/Specifications/OnlineAccountsConfinement")
+                             peer_hooks_link="https://wiki.ubuntu.com/SecurityTeam/Specifications/OnlineAccountsConfinement",
+                             context=context)
         if not self.is_click and not self.is_snap1:
             return
 
@@ -129,10 +131,10 @@ class ClickReviewAccounts(ClickReview):
             return
 
         a = self.manifest['hooks'][app][account_type]
-        fn = os.path.join(self.unpack_dir, a)
+        fn = self.fs.path(a)
 
         bn = os.path.basename(fn)
-        if not os.path.exists(fn):
+        if not self.fs.exists(a):
             error("Could not find '%s'" % bn)
 
         # qml-plugin points to a QML file, so just set that we have the
@@ -140,7 +142,7 @@ class ClickReviewAccounts(ClickReview):
         if account_type == "account-qml-plugin":
             return (fn, True)
         elif account_type == "accounts":
-            fh = open_file_read(fn)
+            fh = self.fs.open_text(a)
             contents = ""
             for line in fh.readlines():
                 contents += line
@@ -157,6 +159,8 @@ class ClickReviewAccounts(ClickReview):
 
             return (fn, jd)
         else:
+            # http://lxml.de/tutorial.html
+            import lxml.etree as etree
             try:
                 tree = etree.parse(fn)
                 xml = tree.getroot()
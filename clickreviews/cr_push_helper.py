@@ -16,22 +16,25 @@
 
 from __future__ import print_function
 
-from clickreviews.cr_common import ClickReview, error, open_file_read
+from clickreviews.cr_common import ClickReview, error
 import json
 import os
 
 
 class ClickReviewPushHelper(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
+    review_type = "push_helper"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
         peer_hooks = dict()
         my_hook = 'push-helper'
         peer_hooks[my_hook] = dict()
         peer_hooks[my_hook]['allowed'] = ['apparmor']
         peer_hooks[my_hook]['required'] = ['apparmor']
 
-        ClickReview.__init__(self, fn, "push_helper", peer_hooks=peer_hooks,
-                             overrides=overrides)
+        ClickReview.__init__(self, fn, self.review_type, peer_hooks=peer_hooks,
+                             overrides=overrides, context=context)
 
         if not self.is_click and not self.is_snap1:
             return
@@ -59,13 +62,13 @@ class ClickReviewPushHelper(ClickReview):
     def _extract_push_helper(self, app):
         '''Get push-helper hook content'''
         c = self.manifest['hooks'][app]['push-helper']
-        fn = os.path.join(self.unpack_dir, c)
+        fn = self.fs.path(c)
 
         bn = os.path.basename(fn)
-        if not os.path.exists(fn):
+        if not self.fs.exists(c):
             error("Could not find '%s'" % bn)
 
-        fh = open_file_read(fn)
+        fh = self.fs.open_text(c)
         contents = ""
         for line in fh.readlines():
                 contents += line
@@ -17,7 +17,6 @@
 from __future__ import print_function
 
 from clickreviews.cr_common import ClickReview, error
-import codecs
 import configparser
 import os
 import re
@@ -30,15 +29,18 @@ KNOWN_SECTIONS = set(["ScopeConfig", "Appearance"])
 
 class ClickReviewScope(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
+    review_type = "scope"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
         peer_hooks = dict()
         my_hook = 'scope'
         peer_hooks[my_hook] = dict()
         peer_hooks[my_hook]['allowed'] = ClickReview.scope_allowed_peer_hooks
         peer_hooks[my_hook]['required'] = ['apparmor']
 
-        ClickReview.__init__(self, fn, "scope", peer_hooks=peer_hooks,
-                             overrides=overrides)
+        ClickReview.__init__(self, fn, self.review_type, peer_hooks=peer_hooks,
+                             overrides=overrides, context=context)
 
         if not self.is_click and not self.is_snap1:
             return
@@ -61,21 +63,22 @@ class ClickReviewScope(ClickReview):
         d = dict()
 
         s = self.manifest['hooks'][app]['scope']
-        fn = os.path.join(self.unpack_dir, s)
+        fn = self.fs.path(s)
 
         bn = os.path.basename(fn)
-        if not os.path.exists(fn):
+        if not self.fs.exists(s):
             error("Could not find '%s'" % bn)
-        elif not os.path.isdir(fn):
+        elif not self.fs.isdir(s):
             error("'%s' is not a directory" % bn)
 
         ini_fn = os.path.join(fn, "%s_%s.ini" % (self.manifest['name'], app))
-        ini_fn_bn = os.path.relpath(ini_fn, self.unpack_dir)
-        if not os.path.exists(ini_fn):
+        ini_fn_bn = self.fs.relpath(ini_fn)
+        if not self.fs.exists(ini_fn_bn):
             error("Could not find scope INI file '%s'" % ini_fn_bn)
         try:
             d["scope_config"] = configparser.ConfigParser()
-            d["scope_config"].read_file(codecs.open(ini_fn, "r", "utf8"))
+            with self.fs.open_text(ini_fn_bn) as f:
+                d["scope_config"].read_file(f)
         except Exception as e:
             error("scope config unparseable: %s (%s)" % (ini_fn_bn, str(e)))
 
@@ -19,9 +19,10 @@ from __future__ import print_function
 from clickreviews.common import (
     AA_PROFILE_NAME_MAXLEN,
     AA_PROFILE_NAME_ADVLEN,
+    reports,
+    requires,
 )
-from clickreviews.cr_common import ClickReview, error, open_file_read
-import clickreviews.cr_common as cr_common
+from clickreviews.cr_common import ClickReview, error
 import clickreviews.apparmor_policy as apparmor_policy
 import copy
 import json
@@ -30,7 +31,10 @@ import os
 
 class ClickReviewSecurity(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
+    review_type = "security"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
         peer_hooks = dict()
         my_hook = 'apparmor'
         peer_hooks[my_hook] = dict()
@@ -48,23 +52,12 @@ class ClickReviewSecurity(ClickReview):
             ClickReview.service_allowed_peer_hooks
         peer_hooks[my_hook2]['required'] = []
 
-        ClickReview.__init__(self, fn, "security", peer_hooks=peer_hooks,
-                             overrides=overrides)
+        ClickReview.__init__(self, fn, self.review_type, peer_hooks=peer_hooks,
+                             overrides=overrides, context=context)
 
         if not self.is_click and not self.is_snap1:
             return
 
-        # If local_copy is None, then this will check the server to see if
-        # we are up to date. However, if we are working within the development
-        # tree, use it unconditionally.
-        local_copy = None
-        branch_fn = os.path.join(os.path.dirname(__file__),
-                                 '../data/apparmor-easyprof-ubuntu.json')
-        if os.path.exists(branch_fn):
-            local_copy = branch_fn
-        p = apparmor_policy.ApparmorPolicy(local_copy)
-        self.aa_policy = p.policy
-
         self.all_fields = ['abstractions',
                            'author',
                            'binary',
@@ -140,8 +133,6 @@ class ClickReviewSecurity(ClickReview):
                 'policy_version': 15.04,
             },
         }
-        framework_overrides = self.overrides.get('framework', {})
-        self._override_framework_policies(framework_overrides)
 
         # snappy
         self.sec_skipped_types = ['oem',
@@ -217,6 +208,23 @@ class ClickReviewSecurity(ClickReview):
                     self._extract_security_profile(app)
                 self.security_apps_profiles.append(app)
 
+    def _load_aa_policy(self):
+        '''Load the apparmor policy, with the framework overrides'''
+        # If local_copy is None, then this will check the server to see if
+        # we are up to date. However, if we are working within the development
+        # tree, use it unconditionally.
+        local_copy = None
+        branch_fn = os.path.join(os.path.dirname(__file__),
+                                 '../data/apparmor-easyprof-ubuntu.json')
+        if os.path.exists(branch_fn):
+            local_copy = branch_fn
+        p = apparmor_policy.ApparmorPolicy(local_copy)
+        self.aa_policy = p.policy
+        self.aa_index = p.index
+
+        framework_overrides = self.overrides.get('framework', {})
+        self._override_framework_policies(framework_overrides)
+
     def _override_framework_policies(self, overrides):
         # override major framework policies
         self.major_framework_policy.update(overrides)
@@ -233,16 +241,16 @@ class ClickReviewSecurity(ClickReview):
                 # just ensure the version is defined
                 # TODO: add support to override templates and policy groups
                 self.aa_policy[vendor][version] = {}
+                self.aa_index.add_version(vendor, version)
 
     def _extract_security_manifest(self, app):
         '''Extract security manifest and verify it has the expected
            structure'''
-        d = self.manifest['hooks'][app]['apparmor']
-        fn = os.path.join(self.unpack_dir, d)
         rel_fn = self.manifest['hooks'][app]['apparmor']
 
         try:
-            m = json.load(cr_common.open_file_read(fn))
+            with self.fs.open_text(rel_fn) as f:
+                m = json.load(f)
         except Exception:
             error("Could not load '%s'. Is it properly formatted?" % rel_fn)
         mp = json.dumps(m, sort_keys=True, indent=2, separators=(',', ': '))
@@ -291,11 +299,10 @@ class ClickReviewSecurity(ClickReview):
         '''Extract security profile'''
         rel_fn = self.manifest['hooks'][app]['apparmor-profile']
 
-        fn = os.path.join(self.unpack_dir, rel_fn)
-        if not os.path.exists(fn):
+        if not self.fs.exists(rel_fn):
             error("Could not find '%s'" % rel_fn)
 
-        fh = open_file_read(fn)
+        fh = self.fs.open_text(rel_fn)
         contents = ""
         for line in fh.readlines():
             contents += line
@@ -319,14 +326,17 @@ class ClickReviewSecurity(ClickReview):
         p = self.security_profiles[f]
         return (f, p)
 
+    @requires('_load_aa_policy')
     def _get_highest_policy_version(self, vendor):
         '''Determine highest policy version for the vendor'''
-        if vendor not in self.aa_policy:
+        if not self.aa_index.has_vendor(vendor):
             error("Could not find vendor '%s'" % vendor, do_exit=False)
             return None
 
-        return float(sorted(self.aa_policy[vendor].keys())[-1])
+        return float(self.aa_index.versions(vendor)[-1])
 
+    @reports('policy_vendor', 'policy_vendor_matches_framework')
+    @requires('_load_aa_policy')
     def check_policy_vendor(self):
         '''Check policy_vendor'''
         if not self.is_click and not self.is_snap1:
@@ -338,7 +348,7 @@ class ClickReviewSecurity(ClickReview):
             n = self._get_check_name('policy_vendor', extra=f)
             s = "OK"
             if 'policy_vendor' in m and \
-               m['policy_vendor'] not in self.aa_policy:
+               not self.aa_index.has_vendor(m['policy_vendor']):
                 t = 'error'
                 s = "policy_vendor '%s' not found" % m['policy_vendor']
             self._add_result(t, n, s)
@@ -372,6 +382,9 @@ class ClickReviewSecurity(ClickReview):
                     s = "Invalid framework '%s'" % framework
             self._add_result(t, n, s)
 
+    @reports('policy_version_exists', 'policy_version_is_highest',
+             'policy_version_matches_framework')
+    @requires('_load_aa_policy')
     def check_policy_version(self):
         '''Check policy version'''
         if not self.is_click and not self.is_snap1:
@@ -392,8 +405,7 @@ class ClickReviewSecurity(ClickReview):
             if 'policy_vendor' in m:
                 vendor = m['policy_vendor']
             version = str(m['policy_version'])
-            if vendor not in self.aa_policy or \
-               not self._has_policy_version(vendor, version):
+            if not self.aa_index.has_version(vendor, version):
                 t = 'error'
                 s = 'could not find policy for %s/%s' % (vendor, version)
             self._add_result(t, n, s)
@@ -437,6 +449,9 @@ class ClickReviewSecurity(ClickReview):
                 s = "Invalid framework '%s'" % framework
             self._add_result(t, n, s, link)
 
+    @reports('template_exists', 'template_valid',
+             'template_with_policy_version')
+    @requires('_load_aa_policy')
     def check_template(self):
         '''Check template'''
         if not self.is_click and not self.is_snap1:
@@ -481,8 +496,7 @@ class ClickReviewSecurity(ClickReview):
                 vendor = m['policy_vendor']
             version = str(m['policy_version'])
 
-            templates = self._get_templates(vendor, version)
-            if len(templates) < 1:
+            if len(self._get_templates(vendor, version)) < 1:
                 t = 'error'
                 s = 'could not find templates'
                 self._add_result(t, n, s)
@@ -490,7 +504,8 @@ class ClickReviewSecurity(ClickReview):
             self._add_result(t, n, s)
 
             found = False
-            if m['template'] in self._get_templates(vendor, version):
+            if self.aa_index.has_name(vendor, version, 'templates',
+                                      m['template']):
                 found = True
             elif self.is_snap1:
                 frameworks = []
@@ -665,6 +680,9 @@ class ClickReviewSecurity(ClickReview):
                 s = "found unusual policy groups: %s" % ", ".join(bad)
             self._add_result(t, n, s)
 
+    @reports('policy_groups_duplicates', 'policy_groups_exists',
+             'policy_groups_safe', 'policy_groups_valid')
+    @requires('_load_aa_policy')
     def check_policy_groups(self):
         '''Check policy_groups'''
         if not self.is_click and not self.is_snap1:
@@ -690,8 +708,8 @@ class ClickReviewSecurity(ClickReview):
                 vendor = m['policy_vendor']
             version = str(m['policy_version'])
 
-            policy_groups = self._get_policy_groups(version=version, vendor=vendor)
-            if len(policy_groups) < 1:
+            if len(self._get_policy_groups(version=version,
+                                           vendor=vendor)) < 1:
                 t = 'error'
                 s = 'could not find policy groups'
                 self._add_result(t, n, s)
@@ -702,14 +720,16 @@ class ClickReviewSecurity(ClickReview):
             t = 'info'
             n = self._get_check_name('policy_groups_duplicates', app=app, extra=f)
             s = 'OK'
-            tmp = []
+            seen = set()
+            tmp = set()
             for p in m['policy_groups']:
-                if m['policy_groups'].count(p) > 1 and p not in tmp:
-                    tmp.append(p)
-                if len(tmp) > 0:
-                    tmp.sort()
-                    t = 'error'
-                    s = 'duplicate policy groups found: %s' % ", ".join(tmp)
+                if p in seen:
+                    tmp.add(p)
+                seen.add(p)
+            if len(tmp) > 0:
+                t = 'error'
+                s = 'duplicate policy groups found: %s' % \
+                    ", ".join(sorted(tmp))
             self._add_result(t, n, s)
 
             frameworks = []
@@ -738,20 +758,14 @@ class ClickReviewSecurity(ClickReview):
                     self._add_result(t, n, s)
                     continue
 
-                found = False
                 framework_found = False
-                for j in policy_groups:
-                    if i == os.path.basename(j):
-                        found = True
+                for f in frameworks:
+                    if i.startswith("%s_" % f):
+                        framework_found = True
                         break
-                    else:
-                        for f in frameworks:
-                            if i.startswith("%s_" % f):
-                                framework_found = True
-                                break
-                        if framework_found:
-                            found = True
-                            break
+                found = framework_found or \
+                    self.aa_index.has_basename(vendor, version,
+                                               'policy_groups', i)
 
                 if not found:
                     t = 'error'
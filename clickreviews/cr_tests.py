@@ -95,6 +95,11 @@ def _get_sha512sum(self, fn):
     return out.split()[0]
 
 
+def _get_archive_sha512sum(self, member):
+    '''Pretend we found performed a sha512 of an archive member'''
+    return _get_sha512sum(self, member)
+
+
 def _extract_statinfo(self, fn):
     '''Pretend we found performed an os.stat()'''
     return os.stat(os.path.realpath(__file__))
@@ -286,13 +291,15 @@ def create_patches():
     patches.append(patch('clickreviews.common.Review._path_join', _path_join))
     patches.append(patch(
         'clickreviews.common.Review._get_sha512sum', _get_sha512sum))
+    patches.append(patch(
+        'clickreviews.common.Review._get_archive_sha512sum',
+        _get_archive_sha512sum))
     patches.append(patch(
         'clickreviews.common.Review._extract_statinfo', _extract_statinfo))
     patches.append(patch(
         'clickreviews.cr_common.ClickReview._extract_click_frameworks',
         _extract_click_frameworks))
     patches.append(patch('clickreviews.common.unpack_pkg', _mock_func))
-    patches.append(patch('clickreviews.common.raw_unpack_pkg', _mock_func))
     patches.append(patch('clickreviews.common.detect_package',
                    _detect_package))
     patches.append(patch('clickreviews.common.Review._list_all_files',
@@ -16,7 +16,7 @@
 
 from __future__ import print_function
 
-from clickreviews.cr_common import ClickReview, error, open_file_read
+from clickreviews.cr_common import ClickReview, error
 import json
 import os
 
@@ -25,15 +25,18 @@ import os
 
 class ClickReviewUrlDispatcher(ClickReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
+    review_type = "url_dispatcher"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
         peer_hooks = dict()
         my_hook = 'urls'
         peer_hooks[my_hook] = dict()
         peer_hooks[my_hook]['allowed'] = ClickReview.app_allowed_peer_hooks
         peer_hooks[my_hook]['required'] = []
 
-        ClickReview.__init__(self, fn, "url_dispatcher", peer_hooks=peer_hooks,
-                             overrides=overrides)
+        ClickReview.__init__(self, fn, self.review_type, peer_hooks=peer_hooks,
+                             overrides=overrides, context=context)
 
         if not self.is_click and not self.is_snap1:
             return
@@ -62,15 +65,15 @@ class ClickReviewUrlDispatcher(ClickReview):
         u = self.manifest['hooks'][app]['urls']
         if not u:
             error("'urls' definition is empty for '%s'" % app)
-        fn = os.path.join(self.unpack_dir, u)
-        if not os.path.isfile(fn):
+        fn = self.fs.path(u)
+        if not self.fs.isfile(u):
             error("'%s' is not a file" % fn)
 
         bn = os.path.basename(fn)
-        if not os.path.exists(fn):
+        if not self.fs.exists(u):
             error("Could not find '%s'" % bn)
 
-        fh = open_file_read(fn)
+        fh = self.fs.open_text(u)
         contents = ""
         for line in fh.readlines():
             contents += line
@@ -0,0 +1,272 @@
+'''daemon.py: serve reviews over a local socket'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function
+import http.client
+import http.server
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from clickreviews import (
+    apparmor_policy,
+    batch,
+    common,
+    snapd_base_declaration,
+)
+
+RC_HEADER = 'X-Click-Review-Rc'
+REVIEW_TIMEOUT = 600
+
+
+class ReviewDaemonBusy(Exception):
+    '''Raised when the daemon has too many pending reviews'''
+
+
+class ReviewDaemonTimeout(Exception):
+    '''Raised when a review does not finish in time'''
+
+
+def preload():
+    '''Load everything the reviews need which does not depend on the
+       package, so that forked workers start with it already loaded'''
+    batch.load_review_classes()
+    common.load_mime()
+
+    # Use the same copies of the data files as the reviews do. These are
+    # cached by clickreviews.remote and reparsed when they change.
+    data_dir = os.path.join(os.path.dirname(__file__), '../data')
+    local_copy = os.path.join(data_dir, 'apparmor-easyprof-ubuntu.json')
+    apparmor_policy.ApparmorPolicy(local_copy if os.path.exists(local_copy)
+                                   else None)
+    local_copy = os.path.join(data_dir, 'snapd-base-declaration.yaml')
+    snapd_base_declaration.SnapdBaseDeclaration(
+        local_copy if os.path.exists(local_copy) else None)
+
+
+class ReviewDaemon(object):
+    '''Run reviews in a pool of 'jobs' preloaded worker processes. At most
+       'max_pending' reviews are accepted at a time (running or waiting for
+       a worker), any more raise ReviewDaemonBusy. Reviews taking longer
+       than 'timeout' seconds (including waiting for a worker) raise
+       ReviewDaemonTimeout and the workers are replaced, since they may be
+       stuck or gone. Results are reused from the report_cache.ReportCache
+       'cache' if given.'''
+    def __init__(self, jobs=1, max_pending=None, cache=None,
+                 timeout=REVIEW_TIMEOUT):
+        self.jobs = jobs
+        self.cache = cache
+        self.timeout = timeout
+        if max_pending is None:
+            max_pending = 2 * jobs
+        self.max_pending = max_pending
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.reload()
+
+    def reload(self):
+        '''Preload everything again and replace the workers. Reviews already
+           running finish in the old workers.'''
+        preload()
+        pool = multiprocessing.get_context('fork').Pool(self.jobs)
+        with self.lock:
+            (old_pool, self.pool) = (self.pool, pool)
+        if old_pool is not None:
+            old_pool.close()
+            threading.Thread(target=old_pool.join, daemon=True).start()
+
+    def _replace_pool(self, pool):
+        '''Replace the workers of pool with new ones, unless that was already
+           done, and kill them. Reviews still running in them time out.'''
+        new_pool = multiprocessing.get_context('fork').Pool(self.jobs)
+        with self.lock:
+            if self.pool is not pool:
+                new_pool.terminate()
+                return
+            self.pool = new_pool
+        threading.Thread(target=pool.terminate, daemon=True).start()
+
+    def review(self, fn, overrides=None):
+        '''Review fn in a worker, returning what batch.review_package()
+           does'''
+        if not self.slots.acquire(blocking=False):
+            raise ReviewDaemonBusy("too many pending reviews")
+        try:
+            with self.lock:
+                pool = self.pool
+                result = pool.apply_async(batch.review_package,
+                                          (fn, overrides, self.cache))
+            try:
+                return result.get(self.timeout)
+            except multiprocessing.TimeoutError:
+                self._replace_pool(pool)
+                raise ReviewDaemonTimeout("review did not finish in %d "
+                                          "seconds" % self.timeout)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        '''Stop the workers'''
+        with self.lock:
+            (pool, self.pool) = (self.pool, None)
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+class ReviewRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''Handle 'POST /review' with a json object with the 'filename' of the
+       package to review and optionally its 'overrides'. The response is the
+       same json as 'click-review --json', with the click-review exit code in
+       the X-Click-Review-Rc header.'''
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        # unix socket
+        return 'local'
+
+    def _send(self, code, body, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if headers:
+            for (name, value) in headers.items():
+                self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, code, msg):
+        self._send(code, json.dumps({'error': msg}))
+
+    def do_POST(self):
+        # always read the request, the client may still be sending it
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+        except ValueError as e:
+            self._send_error(400, "bad Content-Length: %s" % e)
+            return
+
+        if self.path != '/review':
+            self._send_error(404, "unknown path '%s'" % self.path)
+            return
+
+        try:
+            req = json.loads(body.decode('utf-8'))
+        except ValueError as e:
+            self._send_error(400, "could not parse request: %s" % e)
+            return
+        if not isinstance(req, dict) or \
+                not isinstance(req.get('filename'), str):
+            self._send_error(400, "'filename' is required")
+            return
+        overrides = req.get('overrides', None)
+        if overrides is not None and not isinstance(overrides, dict):
+            self._send_error(400, "'overrides' must be an object")
+            return
+        if not os.path.exists(req['filename']):
+            self._send_error(400, "'%s' does not exist" % req['filename'])
+            return
+
+        try:
+            report = self.server.review_daemon.review(req['filename'],
+                                                      overrides)
+        except ReviewDaemonBusy as e:
+            self._send_error(503, str(e))
+            return
+        except ReviewDaemonTimeout as e:
+            self.log_message("%s: %s", req['filename'], e)
+            self._send_error(504, str(e))
+            return
+
+        for e in report.get('runtime_errors', []):
+            self.log_message("%s: %s", req['filename'], e)
+        self._send(200, json.dumps(report['results'], sort_keys=True,
+                                   indent=2, separators=(',', ': ')),
+                   {RC_HEADER: str(report['rc'])})
+
+
+class ReviewHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    '''Serve reviews over http'''
+    daemon_threads = True
+
+    def __init__(self, address, review_daemon):
+        self.review_daemon = review_daemon
+        http.server.HTTPServer.__init__(self, address, ReviewRequestHandler)
+
+
+class ReviewUnixHTTPServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+    '''Serve reviews over http on a unix socket'''
+    daemon_threads = True
+
+    def __init__(self, path, review_daemon):
+        self.review_daemon = review_daemon
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path,
+                                               ReviewRequestHandler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''http.client.HTTPConnection for a ReviewUnixHTTPServer'''
+    def __init__(self, path, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        http.client.HTTPConnection.__init__(self, 'localhost',
+                                            timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def request_review(conn, fn, overrides=None):
+    '''Ask the daemon connected to with conn to review fn. Returns the
+       click-review exit code and the results.'''
+    req = {'filename': os.path.abspath(fn)}
+    if overrides is not None:
+        req['overrides'] = overrides
+    conn.request('POST', '/review', body=json.dumps(req),
+                 headers={'Content-Type': 'application/json'})
+    resp = conn.getresponse()
+    body = json.loads(resp.read().decode('utf-8'))
+    if resp.status != 200:
+        raise RuntimeError("review failed (%d): %s" % (resp.status,
+                                                       body['error']))
+    return (int(resp.getheader(RC_HEADER)), body)
+
+
+def serve(server):
+    '''Serve until interrupted'''
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.review_daemon.close()
+        print("Stopped.", file=sys.stderr)
@@ -0,0 +1,335 @@
+'''deb.py: read click packages (deb files) without dpkg-deb and ar'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A deb is an ar archive with the 'debian-binary', 'control.tar.*' and
+# 'data.tar.*' members (click packages add '_click-binary'). See deb(5) and
+# ar(5).
+
+from collections import namedtuple
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import tarfile
+
+AR_MAGIC = b'!<arch>\n'
+AR_HEADER_SIZE = 60
+# Members are streamed this many bytes at a time
+READ_SIZE = 1024 * 1024
+
+# member hashes by (package, algorithm), along with the package's
+# (st_mtime_ns, st_size) when they were computed
+_member_hash_cache = dict()
+
+# An ar member: 'offset' is where its data starts in the archive
+ArMember = namedtuple('ArMember', ['name', 'offset', 'size', 'mtime',
+                                   'mode'])
+
+
+class DebException(Exception):
+    '''This class represents deb exceptions'''
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class _MemberReader(io.RawIOBase):
+    '''Read-only file object for the data of an ar member, updating the
+       given hashes with everything read'''
+    def __init__(self, f, member, hashes=None, close_file=False):
+        self._f = f
+        self._remaining = member.size
+        self._hashes = hashes if hashes is not None else []
+        self._close_file = close_file
+        self._f.seek(member.offset)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if self._close_file and not self.closed:
+            self._f.close()
+        io.RawIOBase.close(self)
+
+    def readinto(self, b):
+        n = min(len(b), self._remaining)
+        if n == 0:
+            return 0
+        data = self._f.read(n)
+        if len(data) != n:
+            raise DebException("ar member is truncated")
+        b[:n] = data
+        self._remaining -= n
+        for h in self._hashes:
+            h.update(data)
+        return n
+
+    def drain(self):
+        '''Read (and hash) the rest of the member'''
+        while self.read(READ_SIZE):
+            pass
+
+
+class _TarStream(io.RawIOBase):
+    '''Read-only file object for the uncompressed data of a compressed tar
+       member, closing the member along with it'''
+    def __init__(self, member_file, f):
+        self._member_file = member_file
+        self._f = f
+
+    def readable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+            self._member_file.close()
+        io.RawIOBase.close(self)
+
+    def readinto(self, b):
+        return self._f.readinto(b)
+
+
+def _extraction_filter(member, dest_path):
+    '''Refuse members which tarfile.data_filter() finds unsafe, but extract
+       them as packaged: the reviews check the modes, special files and
+       symlinks pointing outside of the package. Symlinks and special files
+       only get their paths checked.'''
+    if member.isreg() or member.isdir() or member.islnk():
+        tarfile.data_filter(member, dest_path)
+    else:
+        tarfile.tar_filter(member, dest_path)
+    return member
+
+
+class _TarFile(tarfile.TarFile):
+    '''Extract as 'dpkg-deb -R' does for a regular user: keep the modes
+       and mtimes but don't change ownership'''
+    if hasattr(tarfile, 'data_filter'):
+        extraction_filter = staticmethod(_extraction_filter)
+
+    def chown(self, *args, **kwargs):
+        pass
+
+
+def _inside(path, top):
+    return path == top or path.startswith(top + '/')
+
+
+def _extract_tar(fileobj, dest):
+    '''Extract the tar stream in fileobj to dest, refusing members that
+       would end up outside of it'''
+    top = os.path.realpath(dest)
+    checked = set([top])
+    dirs = []
+    with _TarFile.open(fileobj=fileobj, mode='r|*', errorlevel=1) as tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if name == '.':
+                continue
+            if os.path.isabs(name) or name.split('/')[0] == '..':
+                raise DebException("'%s' is outside of the package" %
+                                   member.name)
+            # don't write through symlinks in the package
+            parent = os.path.dirname(os.path.join(dest, name))
+            if parent not in checked:
+                if not _inside(os.path.realpath(parent), top):
+                    raise DebException("'%s' is outside of the package" %
+                                       member.name)
+                checked.add(parent)
+            if member.islnk():
+                link = os.path.normpath(member.linkname)
+                if os.path.isabs(link) or link.split('/')[0] == '..' or \
+                        not _inside(os.path.realpath(os.path.join(dest,
+                                                                  link)),
+                                    top):
+                    raise DebException("'%s' links outside of the package" %
+                                       member.name)
+
+            # replace what is already there instead of writing through it,
+            # as tar does
+            path = os.path.join(dest, name)
+            if os.path.islink(path) or \
+                    (os.path.lexists(path) and not os.path.isdir(path)):
+                os.unlink(path)
+
+            member.name = name
+            try:
+                if member.isdir():
+                    # set directory permissions last in case they prevent
+                    # extracting their contents, as TarFile.extractall()
+                    # does
+                    tar.extract(member, dest, set_attrs=False)
+                    dirs.append(member)
+                else:
+                    tar.extract(member, dest)
+            except getattr(tarfile, 'FilterError', ()) as e:
+                raise DebException("'%s' is outside of the package: %s" %
+                                   (member.name, e))
+
+        for member in reversed(dirs):
+            path = os.path.join(dest, member.name)
+            tar.chmod(member, path)
+            tar.utime(member, path)
+
+
+class DebFile(object):
+    '''This class represents a deb archive opened for reading'''
+    def __init__(self, fn):
+        self.filename = fn
+        self._f = open(fn, 'rb')
+        try:
+            self.members = self._read_members()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Close the archive'''
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def _read_members(self):
+        '''Return the ArMembers of the archive, in order'''
+        if self._f.read(len(AR_MAGIC)) != AR_MAGIC:
+            raise DebException("'%s' is not an ar archive" % self.filename)
+        size = os.fstat(self._f.fileno()).st_size
+
+        members = []
+        pos = len(AR_MAGIC)
+        while size - pos >= AR_HEADER_SIZE:
+            self._f.seek(pos)
+            header = self._f.read(AR_HEADER_SIZE)
+            if len(header) != AR_HEADER_SIZE or header[58:60] != b'`\n':
+                raise DebException("malformed ar header at %d" % pos)
+            try:
+                name = header[0:16].decode('ascii').rstrip(' ')
+                mtime = int(header[16:28])
+                mode = int(header[40:48], 8)
+                member_size = int(header[48:58])
+            except ValueError:
+                raise DebException("malformed ar header at %d" % pos)
+            # GNU ar terminates names with '/'
+            if name.endswith('/') and name != '/':
+                name = name[:-1]
+            offset = pos + AR_HEADER_SIZE
+            if offset + member_size > size:
+                raise DebException("ar member '%s' is truncated" % name)
+            members.append(ArMember(name, offset, member_size, mtime, mode))
+            # data is padded to an even size
+            pos = offset + member_size + member_size % 2
+
+        if not members or members[0].name != 'debian-binary':
+            raise DebException("'%s' is not a deb" % self.filename)
+        return members
+
+    def get_member(self, name):
+        '''Return the ArMember called name'''
+        for member in self.members:
+            if member.name == name:
+                return member
+        raise DebException("'%s' has no member '%s'" %
+                           (self.filename, name))
+
+    def find_tar(self, prefix):
+        '''Return the first ArMember which is a tar starting with prefix'''
+        for member in self.members:
+            if member.name.startswith(prefix):
+                return member
+        raise DebException("'%s' has no %s member" %
+                           (self.filename, prefix))
+
+    def open_member(self, name):
+        '''Return a file object for the data of member name. The archive is
+           reopened so the member can be read alongside others.'''
+        member = self.get_member(name)
+        return io.BufferedReader(_MemberReader(open(self.filename, 'rb'),
+                                               member, close_file=True))
+
+    def open_tar(self, name):
+        '''Return a file object for the uncompressed tar stream of member
+           name, which may be compressed with gzip, bzip2 or xz'''
+        f = self.open_member(name)
+        magic = f.peek(6)[:6]
+        if magic.startswith(b'\x1f\x8b'):
+            tar = gzip.GzipFile(fileobj=f)
+        elif magic.startswith(b'BZh'):
+            tar = bz2.BZ2File(f)
+        elif magic.startswith(b'\xfd7zXZ\x00') or \
+                magic.startswith(b'\x5d\x00\x00'):
+            tar = lzma.LZMAFile(f)
+        else:
+            return f
+        return io.BufferedReader(_TarStream(f, tar), READ_SIZE)
+
+    def extract(self, dest, algorithm='sha512'):
+        '''Extract the package to dest like 'dpkg-deb -R': the data member
+           in dest and the control member in dest/DEBIAN. The archive is
+           read once, hashing every member as it is read. Returns the hex
+           digests of the members by name.'''
+        control = self.find_tar('control.tar')
+        data = self.find_tar('data.tar')
+        control_dir = os.path.join(dest, 'DEBIAN')
+        os.mkdir(control_dir, 0o755)
+
+        digests = dict()
+        for member in self.members:
+            h = hashlib.new(algorithm)
+            reader = _MemberReader(self._f, member, [h])
+            if member is control:
+                _extract_tar(io.BufferedReader(reader, READ_SIZE),
+                             control_dir)
+            elif member is data:
+                _extract_tar(io.BufferedReader(reader, READ_SIZE), dest)
+            reader.drain()
+            digests[member.name] = h.hexdigest()
+
+        _member_hash_cache[(os.path.abspath(self.filename), algorithm)] = \
+            (_file_key(self.filename), digests)
+        return digests
+
+
+def _file_key(fn):
+    st = os.stat(fn)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def member_hash(fn, name, algorithm='sha512'):
+    '''Return the hex digest of member name of the deb fn. This is free
+       after extracting the deb with DebFile.extract().'''
+    key = (os.path.abspath(fn), algorithm)
+    if key in _member_hash_cache:
+        (file_key, digests) = _member_hash_cache[key]
+        if file_key == _file_key(fn) and name in digests:
+            return digests[name]
+
+    h = hashlib.new(algorithm)
+    with DebFile(fn) as deb:
+        with deb.open_member(name) as f:
+            for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                h.update(chunk)
+    return h.hexdigest()
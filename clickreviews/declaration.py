@@ -0,0 +1,489 @@
+'''declaration.py: evaluate plugs and slots against snap declarations'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The base and snap declarations are compiled per side and interface into an
+# InterfaceDecision: one RuleSet for each combination of alternate
+# constraints, holding the deny-*/allow-* Rules which can flag a plug or slot
+# for manual review. Constraints on attributes are compiled into Matchers, with
+# their regular expressions compiled once. Evaluating a plug or slot then only
+# runs the rules of its interface. The combinations of alternate constraints
+# are generated (and compiled) lazily, as evaluation stops at the first
+# alternate which passes. The verdicts are remembered per interface and
+# attributes, and DeclarationEvaluators are shared by the reviews using the
+# same declarations.
+
+from clickreviews.sr_common import SnapReviewException
+from clickreviews.overrides import iface_attributes_noflag
+import copy
+import hashlib
+import itertools
+import json
+import re
+
+
+# Remembered verdicts per DeclarationEvaluator
+MAX_VERDICTS = 4096
+# DeclarationEvaluators by the fingerprints of their declarations
+MAX_EVALUATORS = 32
+_evaluators = dict()
+
+
+class SnapDeclarationException(SnapReviewException):
+    '''This class represents SnapDeclaration exceptions'''
+
+
+def is_bool(item):
+    '''Return True if item is True or False (and not 0 or 1)'''
+    return isinstance(item, int) and (item is True or item is False)
+
+
+class Matcher(object):
+    '''This class represents the constraint on the value of an attribute.
+       Subclasses match the values of the same type as the constraint.'''
+    def __init__(self, against):
+        self.against = against
+        # values which are never flagged (eg, '$SLOT(content)')
+        self.noflag = against in iface_attributes_noflag
+
+    def matches(self, val):
+        '''Return True if val matches the constraint'''
+        matched = False
+        if type(self.against) == type(val):
+            matched = self._matches(val)
+        return matched or self.noflag
+
+    def _matches(self, val):
+        raise SnapDeclarationException("unknown type '%s'" % val)
+
+
+class RegexMatcher(Matcher):
+    '''Strings are matched against the constraint as a regex'''
+    def __init__(self, against):
+        Matcher.__init__(self, against)
+        try:
+            # same as re.search(r'^(%s)$' % against, val)
+            self.regex = re.compile(r'(%s)\n?' % against)
+        except re.error:
+            # only an error when something is matched against it
+            self.regex = None
+
+    def _matches(self, val):
+        if self.regex is None:
+            re.compile(r'^(%s)$' % self.against)
+        return self.regex.fullmatch(val) is not None
+
+
+class ListMatcher(Matcher):
+    '''Lists match when they have the same items in any order'''
+    def __init__(self, against):
+        Matcher.__init__(self, against)
+        try:
+            self.items = sorted(against)
+        except TypeError:
+            # only an error when something is matched against it
+            self.items = None
+
+    def _matches(self, val):
+        if self.items is None:
+            return sorted(self.against) == sorted(val)
+        return self.items == sorted(val)
+
+
+class EqualMatcher(Matcher):
+    '''Bools and dicts must be equal (TODO: nested matches for dicts)'''
+    def _matches(self, val):
+        return self.against == val
+
+
+MATCHERS = {str: RegexMatcher,
+            list: ListMatcher,
+            bool: EqualMatcher,
+            dict: EqualMatcher,
+            }
+
+
+def compile_matcher(against):
+    '''Return the Matcher for the attribute constraint against'''
+    return MATCHERS.get(type(against), Matcher)(against)
+
+
+class Constraint(object):
+    '''This class represents a constraint of a deny-* or allow-* rule (eg,
+       'plug-snap-type', 'on-classic' or 'slot-attributes')'''
+    def __init__(self, value):
+        self.value = value
+        self.attributes = None
+        if isinstance(value, dict):
+            self.attributes = [(k, compile_matcher(value[k])) for k in value]
+
+    def search(self, val, inverted=False):
+        '''Returns True when
+           - the constraint is a bool equal to val
+           - val is in the constraint list
+           - val is a dict with any attributes matching the constraint dict
+           and, when inverted, when the constraint is a bool not equal to val,
+           val isn't in the constraint list or val has any attributes not
+           matching the constraint dict.
+        '''
+        if is_bool(self.value):
+            return (self.value == val) != inverted
+        elif isinstance(self.value, list):
+            return (val in self.value) != inverted
+        elif self.attributes is not None and isinstance(val, dict):
+            checked = 0
+            matches = 0
+            for (attrib, matcher) in self.attributes:
+                if attrib not in val:
+                    continue
+                checked += 1
+                if matcher.matches(val[attrib]):
+                    matches += 1
+            if inverted:
+                # something didn't match
+                return matches != checked
+            return matches > 0
+        return False
+
+
+class Rule(object):
+    '''This class represents a deny-* or allow-* rule of a declaration.
+       'uses' is what the rule is evaluated against: None when it always has
+       the same outcome (flag), otherwise 'snap-type', 'on-classic' or
+       'attributes' for the constraint on subkey.'''
+    def __init__(self, key, decl_type, subkey=None, uses=None,
+                 constraint=None, inverted=False, flag=False):
+        self.key = key
+        self.decl_type = decl_type
+        self.subkey = subkey
+        self.uses = uses
+        self.constraint = constraint
+        self.inverted = inverted
+        self.flag = flag
+
+    def flags(self, snap_type, attribs):
+        '''Return True if the rule flags the plug or slot for manual
+           review'''
+        if self.uses is None:
+            return self.flag
+        elif self.uses == 'snap-type':
+            val = snap_type
+        elif self.uses == 'on-classic':
+            val = (snap_type == 'app')
+        else:
+            val = attribs
+        return self.constraint.search(val, self.inverted)
+
+
+def get_decl(base, snap, side, interface, dtype):
+    '''If the snap declaration has something to say about the declaration
+       override type (dtype), then use it instead of the base declaration.
+    '''
+    if snap is not None and side in snap and interface in snap[side]:
+        for k in snap[side][interface]:
+            if k.endswith(dtype):
+                return (snap, False, "snap")
+
+    return (base, True, "base")
+
+
+def _get_constraints(decl, side, interface):
+    if side in decl and interface in decl[side]:
+        return decl[side][interface]
+    return None
+
+
+class RuleSet(object):
+    '''This class represents the rules of one combination of base and snap
+       declarations for an interface, in groups of deny-* and allow-* rules
+       where only the first rule flagging the plug or slot is used'''
+    def __init__(self, groups):
+        # (needs attributes, rules)
+        self.groups = groups
+
+    @classmethod
+    def compile(cls, base, snap, side, interface):
+        '''Return the RuleSet for side and interface of the base and snap
+           declaration pair'''
+        oside = 'slots' if side == 'plugs' else 'plugs'
+        groups = []
+
+        def rules(dtype, subkey, uses, inverted_for):
+            '''Return the deny-dtype and allow-dtype rules on subkey, the
+               search of the constraint being inverted for inverted_for'''
+            (decl, base_decl, decl_type) = get_decl(base, snap, side,
+                                                    interface, dtype)
+            cstrs = _get_constraints(decl, side, interface)
+            # Since base declaration mostly has slots side, if plugs, look
+            # at the other side for checking plug-attributes
+            ocstrs = None
+            if base_decl and side == 'plugs' and uses == 'attributes':
+                ocstrs = _get_constraints(decl, oside, interface)
+
+            found = []
+            for j in ['deny', 'allow']:
+                key = "%s-%s" % (j, dtype)
+                if cstrs is not None and key in cstrs and \
+                        isinstance(cstrs[key], dict) and subkey in cstrs[key]:
+                    cstr = cstrs[key][subkey]
+                elif ocstrs is not None and key in ocstrs and \
+                        isinstance(ocstrs[key], dict) and \
+                        subkey in ocstrs[key]:
+                    cstr = ocstrs[key][subkey]
+                else:
+                    continue
+                found.append(Rule(key, decl_type, subkey,
+                                  constraint=Constraint(cstr),
+                                  inverted=(j == inverted_for), uses=uses))
+            return found
+
+        # top-level allow/deny-installation/connection: flag if deny-* is
+        # true or allow-* is false
+        # Note: auto-connection is only for snapd, so don't include it here
+        for i in ['installation', 'connection']:
+            (decl, base_decl, decl_type) = get_decl(base, snap, side,
+                                                    interface, i)
+            cstrs = _get_constraints(decl, side, interface)
+            found = []
+            for j in ['deny', 'allow']:
+                key = "%s-%s" % (j, i)
+                if cstrs is not None and key in cstrs and \
+                        not isinstance(cstrs[key], dict):
+                    found.append(Rule(key, decl_type,
+                                      flag=(cstrs[key] == (j == 'deny'))))
+            groups.append((False, found))
+
+        # deny/allow-installation snap-type: flag if deny-*/snap-type matches
+        # or allow-*/snap-type doesn't
+        groups.append((False, rules('installation', '%s-snap-type' % side[:-1],
+                                    uses='snap-type', inverted_for='allow')))
+
+        # deny/allow-connection/installation on-classic: when an app snap,
+        # flag if deny-*/on-classic=false or allow-*/on-classic=true. When
+        # not an app snap, flag if deny-*/on-classic=true or
+        # allow-*/on-classic=false
+        for i in ['installation', 'connection']:
+            groups.append((False, rules(i, 'on-classic', uses='on-classic',
+                                        inverted_for='deny')))
+
+        # deny/allow-connection/installation attributes: flag if any
+        # deny-*/attribs match or any allow-*/attribs don't
+        for i in ['installation', 'connection']:
+            groups.append((True, rules(i, '%s-attributes' % side[:-1],
+                                       uses='attributes', inverted_for='allow')))
+
+        return cls([g for g in groups if g[1]])
+
+    def evaluate(self, snap_type, attribs=None):
+        '''Return if something prompted for manual review, if everything
+           checked was flagged (an exact match denial) and the flagging
+           Rules'''
+        checked = 0
+        flagged = []
+        for (needs_attribs, rules) in self.groups:
+            if needs_attribs and attribs is None:
+                continue
+            for rule in rules:
+                checked += 1
+                if rule.flags(snap_type, attribs):
+                    flagged.append(rule)
+                    # if manual review after 'deny', don't look at allow
+                    break
+
+        return (len(flagged) > 0, checked == len(flagged), flagged)
+
+
+def _sides(d, interface):
+    if d is None:
+        return []
+    return [side for side in ['plugs', 'slots']
+            if side in d and interface in d[side]]
+
+
+def has_alternates(base, snap, interface):
+    '''Return True if the base or snap declaration has alternate constraints
+       (lists of constraints) for interface'''
+    for d in [base, snap]:
+        for side in _sides(d, interface):
+            for cstr in d[side][interface]:
+                if isinstance(d[side][interface][cstr], list):
+                    return True
+    return False
+
+
+def iter_alternates(d, interface):
+    '''Yield each declaration of interface in d with one of each of its
+       alternate constraints. The alternates of the first constraint change
+       the slowest and plugs come before slots.'''
+    sides = _sides(d, interface)
+    if not sides:
+        return
+
+    to_expand = []
+    alternates = []
+    for side in sides:
+        for cstr in d[side][interface]:
+            if isinstance(d[side][interface][cstr], list):
+                to_expand.append((side, cstr))
+                alternates.append(d[side][interface][cstr])
+
+    for choice in itertools.product(*alternates):
+        decl = dict()
+        for side in sides:
+            decl[side] = {interface: dict(d[side][interface])}
+        for ((side, cstr), alt) in zip(to_expand, choice):
+            decl[side][interface][cstr] = alt
+        yield decl
+
+
+def iter_combinations(base, snap, interface):
+    '''Yield each pair of base and snap declarations of interface which
+       represents a particular combination of alternate constraints (see
+       SnapReviewDeclaration._get_all_combinations()). The snap declaration
+       is None when it has nothing for interface.'''
+    has_snap = next(iter_alternates(snap, interface), None) is not None
+    for b in iter_alternates(base, interface):
+        if not has_snap:
+            yield (b, None)
+            continue
+        for s in iter_alternates(snap, interface):
+            yield (b, s)
+
+
+class InterfaceDecision(object):
+    '''This class represents the compiled declarations of a side (plugs or
+       slots) of an interface. The RuleSet of each combination of alternate
+       constraints is only compiled when it is needed.'''
+    def __init__(self, base, snap, side, interface):
+        self.side = side
+        self.interface = interface
+        self.has_alternates = has_alternates(base, snap, interface)
+        # the RuleSets compiled so far, in order
+        self.rulesets = []
+        self._combinations = iter_combinations(base, snap, interface)
+
+    def iter_rulesets(self):
+        '''Yield the RuleSets of all the combinations, in order'''
+        i = 0
+        while True:
+            if i == len(self.rulesets):
+                combination = next(self._combinations, None)
+                if combination is None:
+                    return
+                (b, s) = combination
+                self.rulesets.append(RuleSet.compile(b, s, self.side,
+                                                     self.interface))
+            yield self.rulesets[i]
+            i += 1
+
+    def evaluate(self, snap_type, attribs=None):
+        '''Return if the plug or slot requires manual review and, if it
+           does, the Rules which flagged it, in order.
+
+           To support alternates in the base and snap declaration, each
+           combination of snap alternate constraint and base alternate
+           constraint is tried. If we have alternates and one passes (ie, it
+           isn't an exact denial), then manual review isn't required and the
+           remaining combinations aren't tried.
+        '''
+        require_manual = False
+        flagged = []
+        for ruleset in self.iter_rulesets():
+            (manual, exact, rules) = ruleset.evaluate(snap_type, attribs)
+            if not manual:
+                continue
+            if self.has_alternates and not exact:
+                return (False, [])
+            require_manual = True
+            flagged += rules
+
+        return (require_manual, flagged)
+
+
+def freeze(value):
+    '''Return a hashable equivalent of value, made of dicts, lists and
+       scalars. Values of different types (eg, True and 1) stay different.'''
+    if isinstance(value, dict):
+        return (dict, frozenset((k, freeze(value[k])) for k in value))
+    elif isinstance(value, list):
+        return (list, tuple(freeze(v) for v in value))
+    return (type(value), value)
+
+
+def fingerprint(decl):
+    '''Return a hash of the contents of the declaration decl'''
+    return hashlib.sha256(json.dumps(decl, sort_keys=True,
+                                     default=repr).encode()).hexdigest()
+
+
+def _add_bounded(d, key, value, max_size):
+    '''Add key to d, removing the oldest entries to keep at most max_size'''
+    while len(d) >= max_size:
+        del d[next(iter(d))]
+    d[key] = value
+
+
+class DeclarationEvaluator(object):
+    '''This class represents base and snap declarations compiled for
+       evaluating plugs and slots. Interfaces are compiled when first
+       evaluated and their verdicts are remembered, so plugs, slots and apps
+       using the same interface with the same attributes are only evaluated
+       once.'''
+    def __init__(self, base, snap=None):
+        self.base = base
+        self.snap = snap
+        self._decisions = dict()
+        self._verdicts = dict()
+
+    def decision(self, side, interface):
+        '''Return the InterfaceDecision for side and interface'''
+        key = (side, interface)
+        if key not in self._decisions:
+            self._decisions[key] = InterfaceDecision(self.base, self.snap,
+                                                     side, interface)
+        return self._decisions[key]
+
+    def evaluate(self, side, interface, snap_type, attribs=None):
+        '''Return if the plug or slot requires manual review and the Rules
+           which flagged it (see InterfaceDecision.evaluate())'''
+        try:
+            key = (side, interface, snap_type, freeze(attribs))
+            hash(key)
+        except TypeError:
+            # not hashable, so not remembered
+            return self.decision(side, interface).evaluate(snap_type, attribs)
+
+        if key not in self._verdicts:
+            verdict = self.decision(side, interface).evaluate(snap_type,
+                                                              attribs)
+            _add_bounded(self._verdicts, key, verdict, MAX_VERDICTS)
+        return self._verdicts[key]
+
+
+def get_evaluator(base, snap=None):
+    '''Return a DeclarationEvaluator of the base and snap declarations. It is
+       shared by the reviews of packages with the same declarations (eg, with
+       'click-review --batch' or click-review-daemon).'''
+    try:
+        key = (fingerprint(base), fingerprint(snap))
+    except (TypeError, ValueError):
+        return DeclarationEvaluator(base, snap)
+
+    if key not in _evaluators:
+        # reviews may change their declarations afterwards
+        evaluator = DeclarationEvaluator(copy.deepcopy(base),
+                                         copy.deepcopy(snap))
+        _add_bounded(_evaluators, key, evaluator, MAX_EVALUATORS)
+    return _evaluators[key]
@@ -1,13 +1,45 @@
-import clickreviews
-import imp
-import inspect
+from clickreviews import common
+import importlib
+import multiprocessing
 import os
-import pkgutil
+import sys
+import traceback
 
 IRRELEVANT_MODULES = ['cr_common', 'cr_tests', 'cr_skeleton',
                       'sr_common', 'sr_tests', 'sr_skeleton',
                       'common']
 
+# Package types, as named in the report sections (see module_section())
+CLICK = 'click'
+SNAP_V1 = 'snap.v1'
+SNAP_V2 = 'snap.v2'
+
+# The review modules, with the name of their main class and the package
+# types they review. The cr_* modules only review clicks and 15.04 snaps
+# (v1), the sr_* modules 16.04 snaps (v2). A module is only imported when
+# a package of one of its types is reviewed.
+REVIEW_MODULES = {
+    'cr_bin_path': ('ClickReviewBinPath', [CLICK, SNAP_V1]),
+    'cr_content_hub': ('ClickReviewContentHub', [CLICK, SNAP_V1]),
+    'cr_desktop': ('ClickReviewDesktop', [CLICK, SNAP_V1]),
+    'cr_framework': ('ClickReviewFramework', [CLICK, SNAP_V1]),
+    'cr_functional': ('ClickReviewFunctional', [CLICK, SNAP_V1]),
+    'cr_lint': ('ClickReviewLint', [CLICK, SNAP_V1]),
+    'cr_online_accounts': ('ClickReviewAccounts', [CLICK, SNAP_V1]),
+    'cr_push_helper': ('ClickReviewPushHelper', [CLICK, SNAP_V1]),
+    'cr_scope': ('ClickReviewScope', [CLICK, SNAP_V1]),
+    'cr_security': ('ClickReviewSecurity', [CLICK, SNAP_V1]),
+    'cr_systemd': ('ClickReviewSystemd', [CLICK, SNAP_V1]),
+    'cr_url_dispatcher': ('ClickReviewUrlDispatcher', [CLICK, SNAP_V1]),
+    'sr_declaration': ('SnapReviewDeclaration', [SNAP_V2]),
+    'sr_lint': ('SnapReviewLint', [SNAP_V2]),
+    'sr_security': ('SnapReviewSecurity', [SNAP_V2]),
+}
+
+# Set before forking the worker pool in review_modules() so that the workers
+# use the parent's unpacked package instead of having it pickled to them
+_pool_context = None
+
 
 def narrow_down_modules(modules):
     '''
@@ -26,56 +58,219 @@ def narrow_down_modules(modules):
 
 def get_modules():
     '''
-    Here we have a look at all the modules in the
-    clickreviews package and filter out a few which
-    are not relevant.
+    Return the names of the review modules (see
+    REVIEW_MODULES), where we can later on instantiate
+    a *Review* object and run the necessary checks.
+    '''
+    return sorted(REVIEW_MODULES)
+
 
-    Basically we look at all the ones which are
-    derived from [cs]r_common, where we can later on
-    instantiate a *Review* object and run the
-    necessary checks.
+def package_type(pkgfmt):
+    '''
+    Return the package type (CLICK, SNAP_V1 or SNAP_V2) of
+    the (type, version) of a package as detected by
+    common.detect_package().
     '''
+    (pkgtype, pkgver) = pkgfmt
+    if pkgtype == 'snap':
+        return SNAP_V1 if pkgver < 2 else SNAP_V2
+    return CLICK
 
-    all_modules = [name for _, name, _ in
-                   pkgutil.iter_modules(clickreviews.__path__)]
-    return narrow_down_modules(all_modules)
 
+def reviews_package_type(module_name, pkg_type):
+    '''
+    Return False if the given module doesn't review
+    packages of type pkg_type. Modules which aren't in
+    REVIEW_MODULES are assumed to review all of them.
+    '''
+    if module_name not in REVIEW_MODULES:
+        return True
+    return pkg_type in REVIEW_MODULES[module_name][1]
 
-def find_main_class(module_name):
+
+def empty_report():
+    '''
+    Return the report of a review without results, as
+    given for the modules which don't review the type of
+    the package.
+    '''
+    return {'info': {}, 'warn': {}, 'error': {}}
+
+
+def module_section(module_name):
     '''
-    This function will find the Click*Review class in
-    the specified module.
+    Return the name of the report section for the
+    results of the given module.
     '''
-    module = imp.load_source(module_name,
-                             '%s/%s.py' % (clickreviews.__path__[0],
-                                           module_name))
+    section = module_name.replace('cr_', 'click,snap.v1_')
+    return section.replace('sr_', 'snap.v2_')
 
-    classes = inspect.getmembers(module, inspect.isclass)
 
-    def find_test_class(a):
-        return (a[0].startswith('Click') or a[0].startswith('Snap')) and \
-            not a[0].endswith('Exception') and \
-            a[1].__module__ == module_name
-    test_class = list(filter(find_test_class, classes))
-    if not test_class:
+def find_main_class(module_name):
+    '''
+    This function will import the specified module (only
+    once per process) and return its Click*Review class,
+    as registered in REVIEW_MODULES.
+    '''
+    if module_name not in REVIEW_MODULES:
         return None
-    init_object = getattr(module, test_class[0][0])
-    return init_object
+    module = importlib.import_module('clickreviews.%s' % module_name)
+    return getattr(module, REVIEW_MODULES[module_name][0])
+
+
+def review_selected(init_object, selection=None):
+    '''
+    Return False if the given review class can't run any of
+    the checks selected by the common.CheckSelection (by
+    default common.SELECTION), so that it doesn't even need
+    to be set up.
+    '''
+    if selection is None:
+        selection = common.SELECTION
+    review_type = getattr(init_object, 'review_type', None)
+    if selection is None or review_type is None:
+        return True
+    return selection.review_selected(review_type)
 
 
-def init_main_class(module_name, click_file, overrides=None):
+def select_modules(module_names, selection=None):
+    '''
+    Filter out the modules whose reviews can't run any of the
+    selected checks (see review_selected()).
+    '''
+    if selection is None:
+        selection = common.SELECTION
+    if selection is None:
+        return list(module_names)
+
+    selected = []
+    for module_name in module_names:
+        init_object = find_main_class(module_name)
+        if init_object and not review_selected(init_object, selection):
+            continue
+        selected.append(module_name)
+    return selected
+
+
+def needs_unpack(module_names, pkg_type=None):
+    '''
+    Return True if any of the given modules needs the package
+    to be unpacked, rather than read in place through a
+    common.PackageContext(unpack=False). If given, only the
+    modules reviewing packages of type pkg_type count.
+    '''
+    for module_name in module_names:
+        if pkg_type is not None and \
+                not reviews_package_type(module_name, pkg_type):
+            continue
+        init_object = find_main_class(module_name)
+        if init_object and init_object.needs_unpack:
+            return True
+    return False
+
+
+def init_main_class(module_name, click_file, overrides=None, context=None):
     '''
     This function will instantiate the main Click*Review
     class of a given module and instantiate it with the
-    location of the .click file we want to inspect.
+    location of the .click file we want to inspect. If
+    given, the common.PackageContext is shared with the
+    review instead of unpacking the package again.
     '''
 
     init_object = find_main_class(module_name)
     if not init_object:
         return None
     try:
-        ob = init_object(click_file, overrides)
+        ob = init_object(click_file, overrides, context=context)
     except TypeError as e:
         print('Could not init %s: %s' % (init_object, str(e)))
         raise
     return ob
+
+
+def review_module(module_name, click_file, overrides=None, context=None):
+    '''
+    Instantiate the main Click*Review class of a given module
+    and run all of its checks. Returns the report of the
+    review (None if the module has no review class) and the
+    formatted traceback if the review raised an exception.
+    '''
+    try:
+        review = init_main_class(module_name, click_file,
+                                 overrides=overrides, context=context)
+        if not review:
+            return (None, None)
+        review.do_checks()
+        return (review.click_report, None)
+    except Exception:
+        return (None, traceback.format_exc())
+
+
+def _pool_review_module(args):
+    '''
+    Run review_module() in a pool worker. common.error() exits
+    the process, so hand the exit code back to the parent
+    instead of letting the worker die.
+    '''
+    (module_name, click_file, overrides) = args
+    try:
+        (report, exc) = review_module(module_name, click_file,
+                                      overrides=overrides,
+                                      context=_pool_context)
+        return (report, exc, None)
+    except SystemExit as e:
+        return (None, None, e.code)
+    finally:
+        # workers exit without running atexit handlers
+        common.cleanup_unpack()
+
+
+def review_modules(module_names, click_file, overrides=None, context=None,
+                   jobs=1):
+    '''
+    Run review_module() for each of the given modules, yielding
+    (module_name, report, exception) in the order of module_names.
+    The modules which don't review the type of the package
+    aren't even imported and yield an empty_report(). With
+    jobs > 1 the modules are run in a pool of that many
+    worker processes which all share the unpacked package of
+    the given common.PackageContext.
+    '''
+    if context is not None:
+        pkg_type = package_type(context.pkgfmt)
+    else:
+        pkg_type = package_type(common.detect_package(click_file))
+    reviewed = [m for m in module_names
+                if reviews_package_type(m, pkg_type)]
+
+    if jobs <= 1 or len(reviewed) <= 1:
+        for module_name in module_names:
+            if module_name not in reviewed:
+                yield (module_name, empty_report(), None)
+                continue
+            (report, exc) = review_module(module_name, click_file,
+                                          overrides=overrides,
+                                          context=context)
+            yield (module_name, report, exc)
+        return
+
+    global _pool_context
+    _pool_context = context
+    pool = multiprocessing.get_context('fork').Pool(min(jobs, len(reviewed)))
+    try:
+        args = [(m, click_file, overrides) for m in reviewed]
+        results = pool.imap(_pool_review_module, args)
+        for module_name in module_names:
+            if module_name not in reviewed:
+                yield (module_name, empty_report(), None)
+                continue
+            (report, exc, exit_code) = next(results)
+            if exit_code is not None:
+                sys.exit(exit_code)
+            yield (module_name, report, exc)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _pool_context = None
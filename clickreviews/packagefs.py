@@ -0,0 +1,488 @@
+'''packagefs.py: read-only access to the files of a package'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Reviews read the package through a PackageFS so that they work the same
+# whether the package was unpacked to disk (DirFS) or is read straight from
+# the click/snap 15.04 deb (DebFS) or the squashfs snap (SquashfsFS). All
+# paths are relative to the top of the package.
+
+import fnmatch
+import io
+import os
+import posixpath
+import shutil
+import stat
+import tarfile
+import tempfile
+import threading
+
+from clickreviews import deb
+from clickreviews import squashfs
+
+# symlinks are followed at most this many times when resolving a path
+_MAX_SYMLINKS = 40
+
+
+class PackageFSException(Exception):
+    '''This class represents PackageFS exceptions'''
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class PackageFSStat(object):
+    '''The os.stat() fields we know about for files in archives'''
+    __slots__ = ['st_mode', 'st_size', 'st_uid', 'st_gid', 'st_mtime']
+
+    def __init__(self, st_mode, st_size, st_uid, st_gid, st_mtime):
+        self.st_mode = st_mode
+        self.st_size = st_size
+        self.st_uid = st_uid
+        self.st_gid = st_gid
+        self.st_mtime = st_mtime
+
+
+def normpath(path):
+    '''Return path relative to the top of the package ('' for the top).
+       As in a chroot, '..' at the top stays at the top.'''
+    # normpath() keeps a leading '//'
+    return posixpath.normpath('/' + path).lstrip('/')
+
+
+def _join_inside(top, target):
+    '''Return the relative target of a symlink in directory top, None if it
+       points outside of the package'''
+    if target.startswith('/'):
+        return None
+    parts = top.split('/') if top else []
+    for part in target.split('/'):
+        if part in ['', '.']:
+            continue
+        elif part == '..':
+            if not parts:
+                return None
+            parts.pop()
+        else:
+            parts.append(part)
+    return '/'.join(parts)
+
+
+class PackageFS(object):
+    '''This class represents the files of a package. 'root' is where the
+       files are unpacked for a DirFS and otherwise the package itself, and
+       path() joins it to a relative path, eg for messages.'''
+    root = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Release any resources held'''
+        pass
+
+    def path(self, rel):
+        '''Return rel joined to root'''
+        return os.path.join(self.root, rel)
+
+    def relpath(self, path):
+        '''Return path (as from path()) relative to the top of the
+           package'''
+        return os.path.relpath(path, self.root)
+
+    def lstat(self, rel):
+        '''Like os.lstat(), raising PackageFSException if rel is not in the
+           package'''
+        raise NotImplementedError  # pragma: nocover
+
+    def stat(self, rel):
+        '''Like os.stat()'''
+        raise NotImplementedError  # pragma: nocover
+
+    def readlink(self, rel):
+        '''Like os.readlink()'''
+        raise NotImplementedError  # pragma: nocover
+
+    def listdir(self, rel=''):
+        '''Return the sorted names in directory rel'''
+        raise NotImplementedError  # pragma: nocover
+
+    def open(self, rel):
+        '''Return a binary file object for the file rel'''
+        raise NotImplementedError  # pragma: nocover
+
+    def open_text(self, rel):
+        '''Return a text file object for the UTF-8 file rel, like
+           common.open_file_read()'''
+        return io.TextIOWrapper(self.open(rel), encoding='UTF-8')
+
+    def read(self, rel):
+        '''Return the contents of file rel'''
+        with self.open(rel) as f:
+            return f.read()
+
+    def local_path(self, rel):
+        '''Return a path on disk with the contents of file rel, for parsers
+           which only take filenames'''
+        raise NotImplementedError  # pragma: nocover
+
+    def _try(self, func, rel):
+        try:
+            return func(rel)
+        except (PackageFSException, OSError):
+            return None
+
+    def exists(self, rel):
+        '''Like os.path.exists()'''
+        return self._try(self.stat, rel) is not None
+
+    def isfile(self, rel):
+        '''Like os.path.isfile()'''
+        st = self._try(self.stat, rel)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def isdir(self, rel):
+        '''Like os.path.isdir()'''
+        st = self._try(self.stat, rel)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def islink(self, rel):
+        '''Like os.path.islink()'''
+        st = self._try(self.lstat, rel)
+        return st is not None and stat.S_ISLNK(st.st_mode)
+
+    def access_x(self, rel):
+        '''Return true if rel is executable by someone, the closest we can
+           get to os.access(X_OK) for files which aren't on disk'''
+        st = self._try(self.stat, rel)
+        return st is not None and bool(st.st_mode & 0o111)
+
+    def walk(self, top=''):
+        '''Like os.walk() (top-down, symlinked directories are listed but
+           not walked), with paths relative to the top of the package'''
+        dirnames = []
+        filenames = []
+        for name in self.listdir(top):
+            rel = posixpath.join(top, name)
+            st = self._try(self.stat, rel)
+            if st is not None and stat.S_ISDIR(st.st_mode):
+                dirnames.append(name)
+            else:
+                filenames.append(name)
+        yield (top, dirnames, filenames)
+        for name in dirnames:
+            rel = posixpath.join(top, name)
+            if not self.islink(rel):
+                for result in self.walk(rel):
+                    yield result
+
+    def glob(self, pattern):
+        '''Return the sorted paths matching the glob pattern, like
+           glob.glob() (without '**')'''
+        matches = ['']
+        for part in normpath(pattern).split('/'):
+            found = []
+            for d in matches:
+                if not any(c in part for c in '*?['):
+                    rel = posixpath.join(d, part)
+                    if self._try(self.lstat, rel) is not None:
+                        found.append(rel)
+                    continue
+                if not self.isdir(d):
+                    continue
+                for name in fnmatch.filter(self.listdir(d), part):
+                    # as with glob.glob(), wildcards don't match hidden files
+                    if name.startswith('.') and not part.startswith('.'):
+                        continue
+                    found.append(posixpath.join(d, name))
+            matches = found
+        return sorted(matches)
+
+
+class DirFS(PackageFS):
+    '''The files of a package unpacked to the directory root'''
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, rel):
+        rel = normpath(rel)
+        return os.path.join(self.root, rel) if rel else self.root
+
+    def lstat(self, rel):
+        return os.lstat(self._path(rel))
+
+    def stat(self, rel):
+        return os.stat(self._path(rel))
+
+    def readlink(self, rel):
+        return os.readlink(self._path(rel))
+
+    def listdir(self, rel=''):
+        return sorted(os.listdir(self._path(rel)))
+
+    def open(self, rel):
+        return open(self._path(rel), 'rb')
+
+    def local_path(self, rel):
+        return self._path(rel)
+
+    def access_x(self, rel):
+        return os.access(self._path(rel), os.X_OK)
+
+
+class _Node(object):
+    '''A file in an IndexedFS'''
+    __slots__ = ['st', 'target', 'children', 'key']
+
+    def __init__(self, st, target=None, key=None):
+        self.st = st
+        self.target = target
+        self.children = dict() if stat.S_ISDIR(st.st_mode) else None
+        self.key = key
+
+
+class IndexedFS(PackageFS):
+    '''The files of a package read from an archive. The archive's metadata
+       is indexed once, subclasses implement _read() to get file
+       contents.'''
+    def __init__(self, root):
+        self.root = root
+        self._nodes = {'': _Node(PackageFSStat(stat.S_IFDIR | 0o755, 0, 0,
+                                               0, 0))}
+        # local_path() copies, removed by close()
+        self._local_dir = None
+        self._local_paths = dict()
+
+    def close(self):
+        if self._local_dir is not None:
+            shutil.rmtree(self._local_dir, ignore_errors=True)
+            self._local_dir = None
+            self._local_paths = dict()
+
+    def _add(self, rel, st, target=None, key=None):
+        '''Add rel to the index, creating any missing parent directories'''
+        rel = normpath(rel)
+        if rel == '':
+            self._nodes[''].st = st
+            return
+        parent = posixpath.dirname(rel)
+        if parent not in self._nodes:
+            self._add(parent, PackageFSStat(stat.S_IFDIR | 0o755, 0, 0, 0,
+                                            0))
+        node = _Node(st, target, key)
+        old = self._nodes.get(rel)
+        if old is not None and old.children is not None and \
+                node.children is not None:
+            node.children = old.children
+        self._nodes[rel] = node
+        self._nodes[parent].children[posixpath.basename(rel)] = node
+
+    def _resolve(self, rel, follow=True, depth=0):
+        '''Return (the path, the _Node) for rel, following symlinks in the
+           package (and the last component if 'follow')'''
+        rel = normpath(rel)
+        if depth > _MAX_SYMLINKS:
+            raise PackageFSException("too many symlinks for '%s'" % rel)
+        resolved = ''
+        parts = rel.split('/') if rel else []
+        for (i, part) in enumerate(parts):
+            resolved = posixpath.join(resolved, part)
+            node = self._nodes.get(resolved)
+            if node is None:
+                raise PackageFSException("'%s' not found" % rel)
+            last = (i == len(parts) - 1)
+            if stat.S_ISLNK(node.st.st_mode) and (follow or not last):
+                target = _join_inside(posixpath.dirname(resolved),
+                                      node.target)
+                if target is None:
+                    # files outside of the package can't be read
+                    raise PackageFSException("'%s' not found" % rel)
+                (resolved, node) = self._resolve(target, True, depth + 1)
+        return (resolved, self._nodes[resolved])
+
+    def lstat(self, rel):
+        return self._resolve(rel, follow=False)[1].st
+
+    def stat(self, rel):
+        return self._resolve(rel)[1].st
+
+    def readlink(self, rel):
+        node = self._resolve(rel, follow=False)[1]
+        if node.target is None:
+            raise PackageFSException("'%s' is not a symlink" % rel)
+        return node.target
+
+    def listdir(self, rel=''):
+        node = self._resolve(rel)[1]
+        if node.children is None:
+            raise PackageFSException("'%s' is not a directory" % rel)
+        return sorted(node.children)
+
+    def open(self, rel):
+        (resolved, node) = self._resolve(rel)
+        if not stat.S_ISREG(node.st.st_mode):
+            raise PackageFSException("'%s' is not a regular file" % rel)
+        return io.BytesIO(self._read(resolved, node))
+
+    def local_path(self, rel):
+        (resolved, node) = self._resolve(rel)
+        if resolved not in self._local_paths:
+            if self._local_dir is None:
+                self._local_dir = tempfile.mkdtemp(prefix='review-fs-')
+            # keep the name, some parsers look at the extension
+            d = tempfile.mkdtemp(dir=self._local_dir)
+            fn = os.path.join(d, posixpath.basename(resolved) or 'file')
+            with open(fn, 'wb') as f:
+                f.write(self.read(resolved))
+            self._local_paths[resolved] = fn
+        return self._local_paths[resolved]
+
+    def _read(self, rel, node):
+        raise NotImplementedError  # pragma: nocover
+
+
+def _tarinfo_stat(info):
+    '''Return the PackageFSStat of a tar member'''
+    if info.isdir():
+        fmt = stat.S_IFDIR
+    elif info.issym():
+        fmt = stat.S_IFLNK
+    elif info.ischr():
+        fmt = stat.S_IFCHR
+    elif info.isblk():
+        fmt = stat.S_IFBLK
+    elif info.isfifo():
+        fmt = stat.S_IFIFO
+    else:
+        fmt = stat.S_IFREG
+    size = len(info.linkname) if info.issym() else info.size
+    return PackageFSStat(fmt | info.mode, size, info.uid, info.gid,
+                         info.mtime)
+
+
+class DebFS(IndexedFS):
+    '''The files of a click or snap 15.04 package read straight from the
+       deb, with the control files in DEBIAN/ as with 'dpkg-deb -R'. The
+       members are compressed streams which can't be seeked, so files are
+       read by uncompressing their member again up to the offset found
+       while indexing. The stream is kept where the last read stopped, so
+       reading files in the order of the package uncompresses each member
+       at most once more.'''
+    def __init__(self, fn):
+        IndexedFS.__init__(self, fn)
+        self._deb = deb.DebFile(fn)
+        # (uncompressed tar, position) of each member being read
+        self._streams = dict()
+        self._streams_lock = threading.Lock()
+        self._hardlinks = dict()
+        try:
+            for (prefix, member) in self._tar_members():
+                self._index(prefix, member)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        IndexedFS.close(self)
+        for (f, pos) in self._streams.values():
+            f.close()
+        self._streams = dict()
+        self._deb.close()
+
+    def _tar_members(self):
+        return [('DEBIAN', self._deb.find_tar('control.tar').name),
+                ('', self._deb.find_tar('data.tar').name)]
+
+    def _index(self, prefix, member):
+        with self._deb.open_tar(member) as f:
+            with tarfile.open(fileobj=f, mode='r|') as tar:
+                for info in tar:
+                    rel = normpath(posixpath.join(prefix, info.name))
+                    if info.islnk():
+                        # hardlinks are regular files in the package
+                        target = posixpath.join(prefix,
+                                                normpath(info.linkname)) \
+                            if prefix else normpath(info.linkname)
+                        if target in self._nodes:
+                            self._hardlinks[rel] = target
+                            self._add(rel, self._nodes[target].st,
+                                      key=self._nodes[target].key)
+                        continue
+                    target = info.linkname if info.issym() else None
+                    self._add(rel, _tarinfo_stat(info), target,
+                              key=(member, info.offset_data, info.size))
+        if prefix:
+            # dpkg-deb -R creates DEBIAN with these permissions
+            self._nodes[prefix].st.st_mode = stat.S_IFDIR | 0o755
+
+    def _read(self, rel, node):
+        (member, offset, size) = node.key
+        # reviews may read files from several threads
+        with self._streams_lock:
+            (f, pos) = self._streams.pop(member, (None, 0))
+            if f is None or pos > offset:
+                if f is not None:
+                    f.close()
+                (f, pos) = (self._deb.open_tar(member), 0)
+            try:
+                while pos < offset:
+                    skipped = len(f.read(min(offset - pos, deb.READ_SIZE)))
+                    if not skipped:
+                        break
+                    pos += skipped
+                data = f.read(size)
+                pos += len(data)
+            except Exception:
+                f.close()
+                raise
+            self._streams[member] = (f, pos)
+        if len(data) != size:
+            raise PackageFSException("'%s' is truncated" % rel)
+        return data
+
+
+class SquashfsFS(IndexedFS):
+    '''The files of a squashfs snap read straight from the image'''
+    def __init__(self, fn):
+        IndexedFS.__init__(self, fn)
+        self._image = squashfs.SquashfsImage(fn)
+        try:
+            for entry in self._image.entries():
+                st = PackageFSStat(entry.mode, entry.size, entry.uid,
+                                   entry.gid, entry.mtime)
+                self._add(entry.path, st, entry.target, key=entry.path)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        IndexedFS.close(self)
+        self._image.close()
+
+    def _read(self, rel, node):
+        return self._image.read(node.key)
+
+
+def open_package_fs(fn):
+    '''Return the PackageFS for reading the package fn without unpacking
+       it'''
+    if squashfs.is_squashfs(fn):
+        return SquashfsFS(fn)
+    return DebFS(fn)
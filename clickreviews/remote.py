@@ -13,18 +13,51 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# urllib.request, http.client and yaml are slow to import and only needed
+# when downloading or parsing the yaml data files, so they are imported by
+# the functions which use them (the compiled yaml files are json).
+import copy
+import hashlib
 import json
 import os
 import re
 from socket import timeout
 import sys
+import tempfile
+import threading
 import time
-from urllib import request, parse
+from urllib import parse
 from urllib.error import HTTPError, URLError
-import yaml
 
 DATA_DIR = os.path.join(os.path.expanduser('~/.cache/click-reviewers-tools/'))
 UPDATE_INTERVAL = 60 * 60 * 24 * 7
+# Seconds to wait for the server when downloading data files
+FETCH_TIMEOUT = 30
+
+# Downloaded data files are refreshed with conditional GETs, using the ETag
+# and Last-Modified of the last download which are kept in <file>.meta.
+# Long running users (click-review-daemon and 'click-review --batch') call
+# set_background_refresh() so that stale files are refreshed by a thread
+# while the reviews use the copy they have.
+_background_refresh = False
+# The refresh threads by file, and the pid they were started in (a forked
+# process has none of them)
+_refresh_threads = dict()
+_refresh_lock = threading.Lock()
+_refresh_pid = os.getpid()
+
+# Compiled forms of the data files: the parsed data and the indexes built
+# from it, as json named after the sha256 of the data file, so that the
+# (slow) yaml files are only parsed once per content
+COMPILED_DIR = os.path.join(DATA_DIR, 'compiled')
+# Bump whenever the compiled form or an indexer changes
+COMPILED_FORMAT = 1
+
+# Parsed data files and their indexes by (filename, indexer name), along
+# with the (mtime, size) of the file when it was parsed. Long running
+# processes (eg, click-review-daemon) pick up changed files since the cached
+# copy is only used while these match.
+_data_file_cache = {}
 
 
 def _update_is_necessary(fn):
@@ -32,17 +65,6 @@ def _update_is_necessary(fn):
         (time.time() - os.path.getmtime(fn) >= UPDATE_INTERVAL)
 
 
-def _update_is_possible(url):
-    update = True
-    try:
-        request.urlopen(url)
-    except (HTTPError, URLError):
-        update = False
-    except timeout:
-        update = False
-    return update
-
-
 def abort(msg=None):
     if msg:
         print(msg, file=sys.stderr)
@@ -53,16 +75,19 @@ def abort(msg=None):
 #
 # Public
 #
-def get_remote_data(url):
+def get_remote_data(url, timeout_secs=FETCH_TIMEOUT):
+    import http.client
+    from urllib import request
     try:
-        f = request.urlopen(url)
+        f = request.urlopen(url, timeout=timeout_secs)
+        data = f.read()
     except (HTTPError, URLError) as error:
         abort('Data not retrieved because %s.' % error)
     except timeout:
         abort('Socket timed out.')
-    if not f:
-        abort()
-    return f.read()
+    except http.client.HTTPException as error:
+        abort('Data not retrieved because %s.' % error)
+    return data
 
 
 def get_remote_file_url(url):
@@ -78,14 +103,258 @@ def get_remote_file_url(url):
     return download_link
 
 
+def write_file_atomic(fn, data):
+    '''Replace fn with data, so that readers see either the old or the new
+       contents'''
+    d = os.path.dirname(os.path.abspath(fn))
+    os.makedirs(d, exist_ok=True)
+    (fd, tmp) = tempfile.mkstemp(dir=d, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, fn)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
 def get_remote_file(fn, url, data_dir=DATA_DIR):
-    data = get_remote_data(url)
+    import http.client
+    try:
+        refresh_file(fn, url, force=True)
+    except (HTTPError, URLError) as error:
+        abort('Data not retrieved because %s.' % error)
+    except timeout:
+        abort('Socket timed out.')
+    except (OSError, http.client.HTTPException) as error:
+        abort('Data not retrieved because %s.' % error)
+
+
+def _meta_fn(fn):
+    return '%s.meta' % fn
+
+
+def _load_meta(fn, url):
+    '''Return the response headers of the download of fn from url'''
+    try:
+        with open(_meta_fn(fn), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    if not isinstance(meta, dict) or meta.get('url') != url or \
+            not os.path.exists(fn):
+        return dict()
+    return meta
+
+
+def _save_meta(fn, meta):
+    '''Store the response headers of the download of fn. They are only an
+       optimization, so failures are ignored.'''
+    try:
+        write_file_atomic(_meta_fn(fn),
+                          json.dumps(meta, sort_keys=True).encode())
+    except OSError:
+        pass
+
+
+def refresh_file(fn, url, timeout_secs=FETCH_TIMEOUT, force=False):
+    '''Download url to fn unless fn is the same as what the server has
+       (or force), using a conditional GET with the ETag and Last-Modified
+       of the last download. fn is replaced atomically and is marked as
+       fresh (see _update_is_necessary()) either way. Returns True if fn was
+       downloaded, False if it was unchanged. Raises OSError (which
+       urllib.error.URLError and socket.timeout are) or
+       http.client.HTTPException on failures.'''
+    from urllib import request
+    meta = dict() if force else _load_meta(fn, url)
+    req = request.Request(url)
+    if 'etag' in meta:
+        req.add_header('If-None-Match', meta['etag'])
+    if 'last-modified' in meta:
+        req.add_header('If-Modified-Since', meta['last-modified'])
+
+    try:
+        with request.urlopen(req, timeout=timeout_secs) as f:
+            data = f.read()
+            headers = f.headers
+    except HTTPError as e:
+        if e.code != 304:
+            raise
+        e.close()
+        os.utime(fn)
+        return False
+
+    write_file_atomic(fn, data)
+    meta = {'url': url}
+    for name in ['etag', 'last-modified']:
+        if headers.get(name) is not None:
+            meta[name] = headers.get(name)
+    _save_meta(fn, meta)
+    return True
+
+
+def _refresh(fn, url):
+    '''Refresh fn from url, returning False if it failed. Failures are
+       only reported when there is no local copy of fn to fall back to.'''
+    import http.client
+    try:
+        refresh_file(fn, url)
+    except (OSError, http.client.HTTPException) as e:
+        if not os.path.exists(fn):
+            print("Could not refresh '%s': %s" % (fn, e), file=sys.stderr)
+        return False
+    return True
+
+
+def set_background_refresh(enabled=True):
+    '''Refresh stale data files that exist in a thread instead of before
+       reading them'''
+    global _background_refresh
+    _background_refresh = enabled
+
+
+def refresh_in_background(fn, url):
+    '''Refresh fn from url in a thread, unless it is already refreshing.
+       Returns the thread.'''
+    global _refresh_threads, _refresh_lock, _refresh_pid
+    if _refresh_pid != os.getpid():
+        # forked while refreshing, the threads (and lock holders) are gone
+        _refresh_threads = dict()
+        _refresh_lock = threading.Lock()
+        _refresh_pid = os.getpid()
+
+    with _refresh_lock:
+        thread = _refresh_threads.get(fn)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=_refresh, args=(fn, url),
+                                      name='refresh %s' % fn)
+            _refresh_threads[fn] = thread
+            thread.start()
+    return thread
+
+
+def wait_for_refreshes():
+    '''Wait for the refresh threads of this process to finish'''
+    if _refresh_pid != os.getpid():
+        return
+    with _refresh_lock:
+        threads = list(_refresh_threads.values())
+    for thread in threads:
+        thread.join()
+
+
+def _indexer_name(indexer):
+    if indexer is None:
+        return None
+    return '%s.%s' % (indexer.__module__, indexer.__qualname__)
+
+
+def _load_compiled(sha256, indexer):
+    '''Return the (data, indexes) compiled from the data file with the
+       given sha256, None if they aren't (validly) compiled yet'''
+    fn = os.path.join(COMPILED_DIR, '%s.json' % sha256)
+    try:
+        with open(fn, 'r') as f:
+            compiled = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(compiled, dict) or \
+            compiled.get('format') != COMPILED_FORMAT or \
+            compiled.get('sha256') != sha256 or \
+            compiled.get('indexer') != _indexer_name(indexer):
+        return None
+    return (compiled['data'], compiled['indexes'])
+
+
+def _save_compiled(sha256, indexer, d, indexes):
+    '''Store the compiled form of the data file with the given sha256. It
+       is only an optimization, so failures are ignored.'''
+    compiled = {'format': COMPILED_FORMAT,
+                'sha256': sha256,
+                'indexer': _indexer_name(indexer),
+                'data': d,
+                'indexes': indexes,
+                }
+    try:
+        # yaml has types json doesn't (eg, non-string keys), so only keep
+        # what round-trips
+        s = json.dumps(compiled, sort_keys=True)
+        if json.loads(s) != compiled:
+            return
+        os.makedirs(COMPILED_DIR, exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(dir=COMPILED_DIR, prefix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(s)
+        os.replace(tmp, os.path.join(COMPILED_DIR, '%s.json' % sha256))
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def _load_yaml(raw):
+    '''Parse the yaml raw, raising ValueError if it is malformed'''
+    import yaml
+    # libyaml is much faster than the pure python loader
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    try:
+        return yaml.load(raw, Loader=loader)
+    except yaml.YAMLError as e:
+        raise ValueError(str(e))
+
+
+def _read_data_file(fn, as_yaml=False, indexer=None):
+    '''parse the json or yaml file fn and build its indexes with
+       indexer(data), reusing the result of the last parse if the file is
+       unchanged and the compiled form of the same contents if there is
+       one. Returns (data, indexes).'''
+    st = os.stat(fn)
+    key = (st.st_mtime_ns, st.st_size)
+    cache_key = (fn, _indexer_name(indexer))
+    if cache_key in _data_file_cache and \
+            _data_file_cache[cache_key][0] == key:
+        return copy.deepcopy(_data_file_cache[cache_key][1])
+
+    with open(fn, 'rb') as f:
+        raw = f.read()
+    # json is parsed about as fast as the compiled form is read
+    compile = as_yaml or indexer is not None
+    sha256 = hashlib.sha256(raw).hexdigest()
+    compiled = _load_compiled(sha256, indexer) if compile else None
+    if compiled is None:
+        try:
+            if as_yaml:
+                d = _load_yaml(raw)
+            else:
+                d = json.loads(raw.decode('utf-8'))
+        except ValueError:
+            raise ValueError("Could not parse '%s'" % fn)
+        indexes = indexer(d) if indexer is not None else None
+        if compile:
+            _save_compiled(sha256, indexer, d, indexes)
+        compiled = (d, indexes)
+
+    _data_file_cache[cache_key] = (key, compiled)
+    # callers may modify what they are given
+    return copy.deepcopy(compiled)
+
+
+def read_cr_data(fn, url, local_copy_fn=None, as_yaml=False, indexer=None):
+    '''read click reviews file from remote or local copy, as
+       read_cr_file(), along with the indexes built from it by indexer(data)
+       (None without an indexer). Returns (data, indexes).'''
+    if local_copy_fn and os.path.exists(local_copy_fn):
+        return _read_data_file(local_copy_fn, as_yaml, indexer)
+
+    if _update_is_necessary(fn):
+        if _background_refresh and os.path.exists(fn):
+            refresh_in_background(fn, url)
+        else:
+            _refresh(fn, url)
     if os.path.exists(fn):
-        os.remove(fn)
-    if not os.path.exists(os.path.dirname(fn)):
-        os.makedirs(os.path.dirname(fn))
-    with open(fn, 'bw') as local_file:
-        local_file.write(data)
+        return _read_data_file(fn, as_yaml, indexer)
+    return ({}, indexer({}) if indexer is not None else None)
 
 
 def read_cr_file(fn, url, local_copy_fn=None, as_yaml=False):
@@ -94,24 +363,4 @@ def read_cr_file(fn, url, local_copy_fn=None, as_yaml=False):
        - url: url to fetch
        - local_copy_fn: force use of local copy
     '''
-    d = {}
-    if local_copy_fn and os.path.exists(local_copy_fn):
-        try:
-            if as_yaml:
-                d = yaml.safe_load(open(local_copy_fn, 'r').read())
-            else:
-                d = json.loads(open(local_copy_fn, 'r').read())
-        except ValueError:
-            raise ValueError("Could not parse '%s'" % local_copy_fn)
-    else:
-        if _update_is_necessary(fn) and _update_is_possible(url):
-            get_remote_file(fn, url)
-        if os.path.exists(fn):
-            try:
-                if as_yaml:
-                    d = yaml.safe_load(open(fn, 'r').read())
-                else:
-                    d = json.loads(open(fn, 'r').read())
-            except ValueError:
-                raise ValueError("Could not parse '%s'" % fn)
-    return d
+    return read_cr_data(fn, url, local_copy_fn, as_yaml)[0]
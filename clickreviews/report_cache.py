@@ -0,0 +1,239 @@
+'''report_cache.py: cache review results by package contents'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The results of reviewing a package only depend on the package, the
+# clickreviews code, the data files the reviews use, the installed click
+# frameworks, the overrides and the selected checks, so they are cached by
+# a hash of all of these. The code is
+# hashed along with the version, so that changes to the checks which don't
+# bump the version don't return stale results. Cached reports are json
+# files named after their key. Their mtime is updated on every hit and the
+# least recently used ones are removed when the cache grows over its size
+# limit.
+# The common.PackageBaseline of reviewed packages is kept alongside, by
+# package sha512, for reviewing their next revision with --baseline.
+
+import codecs
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from clickreviews import common
+from clickreviews import remote
+
+CACHE_DIR = os.path.join(remote.DATA_DIR, 'reports')
+# Least recently used reports are removed above this many bytes
+MAX_CACHE_SIZE = 64 * 1024 * 1024
+# Where the reviews find their data files (see remote.read_cr_file())
+DATA_DIRS = [os.path.join(os.path.dirname(__file__), '../data'),
+             remote.DATA_DIR]
+
+# Where the installed click frameworks are listed from (see
+# cr_common.ClickReview._extract_click_frameworks())
+FRAMEWORKS_DIR = '/usr/share/click/frameworks'
+# The clickreviews sources, which are hashed into the cache keys
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_version = None
+# code_hash() results by directory
+_code_hashes = dict()
+# package sha512s by path, along with the (st_mtime_ns, st_size) of the
+# package when they were computed
+_package_hashes = dict()
+
+
+def get_version():
+    '''Return the version of clickreviews, from debian/changelog in a
+       source tree'''
+    global _version
+    if _version is not None:
+        return _version
+
+    _version = 'unknown'
+    changelog = os.path.join(os.path.dirname(__file__), '../debian/changelog')
+    if os.path.exists(changelog):
+        head = codecs.open(changelog, encoding='utf-8').readline()
+        match = re.compile(r'.*\((.*)\).*').match(head)
+        if match:
+            _version = match.group(1)
+    else:
+        try:
+            import pkg_resources
+            _version = pkg_resources.get_distribution(
+                'click-reviewers-tools').version
+        except Exception:
+            pass
+    return _version
+
+
+def code_hash(code_dir=CODE_DIR):
+    '''Return a hash of the python sources in code_dir, computed once per
+       process'''
+    if code_dir not in _code_hashes:
+        fns = sorted(glob.glob(os.path.join(code_dir, '*.py')))
+        hashes = common.hash_files(fns, 'sha512')
+        h = hashlib.sha512()
+        for fn in fns:
+            line = '%s %s\n' % (os.path.basename(fn), hashes[fn])
+            h.update(line.encode())
+        _code_hashes[code_dir] = h.hexdigest()
+    return _code_hashes[code_dir]
+
+
+def package_sha512(fn):
+    '''Return the sha512 of the package fn, hashing it only once while it
+       is unchanged'''
+    st = os.stat(fn)
+    file_key = (st.st_mtime_ns, st.st_size)
+    path = os.path.abspath(fn)
+    if path not in _package_hashes or _package_hashes[path][0] != file_key:
+        _package_hashes[path] = (file_key, common.hash_file(fn, 'sha512'))
+    return _package_hashes[path][1]
+
+
+def data_hashes(data_dirs=None):
+    '''Return the sha512 of the json and yaml data files by path'''
+    if data_dirs is None:
+        data_dirs = DATA_DIRS
+    fns = []
+    for d in data_dirs:
+        for ext in ['json', 'yaml']:
+            fns += glob.glob(os.path.join(d, '*.%s' % ext))
+    return common.hash_files(sorted(fns), 'sha512')
+
+
+def installed_frameworks(frameworks_dir=None):
+    '''Return the names and mtimes of the installed click frameworks'''
+    if frameworks_dir is None:
+        frameworks_dir = FRAMEWORKS_DIR
+    frameworks = []
+    for fn in sorted(glob.glob(os.path.join(frameworks_dir,
+                                            '*.framework'))):
+        try:
+            frameworks.append([os.path.basename(fn),
+                               os.stat(fn).st_mtime_ns])
+        except OSError:
+            pass
+    return frameworks
+
+
+def normalize_overrides(overrides):
+    '''Return overrides as canonical json (None and {} are the same)'''
+    return json.dumps(overrides or {}, sort_keys=True, separators=(',', ':'))
+
+
+def cache_key(fn, overrides=None, data_dirs=None, selection=None):
+    '''Return the cache key for reviewing fn with overrides and the checks
+       of the common.CheckSelection selection'''
+    d = {'package': package_sha512(fn),
+         'version': get_version(),
+         'code': code_hash(),
+         'data': data_hashes(data_dirs),
+         'frameworks': installed_frameworks(),
+         'overrides': normalize_overrides(overrides),
+         }
+    if selection is not None:
+        d['selection'] = selection.to_json()
+    return hashlib.sha256(json.dumps(d, sort_keys=True).encode()).hexdigest()
+
+
+class ReportCache(object):
+    '''This class represents the on-disk cache of review results'''
+    def __init__(self, cache_dir=CACHE_DIR, max_size=MAX_CACHE_SIZE,
+                 data_dirs=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.data_dirs = data_dirs
+
+    def key(self, fn, overrides=None, selection=None):
+        '''Return the cache key for reviewing fn with overrides and the
+           selected checks'''
+        return cache_key(fn, overrides, self.data_dirs, selection)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, '%s.json' % key)
+
+    def get(self, key):
+        '''Return the cached results for key, None if there are none'''
+        fn = self._path(key)
+        try:
+            with open(fn, 'r') as f:
+                results = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # mark as recently used
+            os.utime(fn)
+        except OSError:
+            pass
+        return results
+
+    def _baseline_key(self, fn):
+        return 'baseline-%s' % package_sha512(fn)
+
+    def get_baseline(self, fn):
+        '''Return the cached common.PackageBaseline of the package fn, None
+           if there is none'''
+        data = self.get(self._baseline_key(fn))
+        if data is None:
+            return None
+        try:
+            return common.PackageBaseline.from_json(data)
+        except ValueError:
+            return None
+
+    def put_baseline(self, fn, baseline):
+        '''Store the common.PackageBaseline of the package fn'''
+        self.put(self._baseline_key(fn), baseline.to_json())
+
+    def put(self, key, results):
+        '''Store the results for key, evicting old entries as needed'''
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(results, f, sort_keys=True)
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            # the cache is only an optimization
+            common.warn("Could not cache results: %s" % e)
+            return
+        self.evict()
+
+    def evict(self):
+        '''Remove the least recently used entries until the cache is no
+           bigger than max_size'''
+        entries = []
+        total = 0
+        for fn in glob.glob(os.path.join(self.cache_dir, '*.json')):
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, fn, st.st_size))
+            total += st.st_size
+
+        for (mtime, fn, size) in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(fn)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,391 @@
+'''squashfs.py: read squashfs metadata without unsquashfs'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Only the squashfs 4.0 superblock, id table, inode table and directory
+# table are read to list the files in the image along with their metadata.
+# File contents are read from the data blocks and the fragment table on
+# demand. See squashfs_fs.h in squashfs-tools for the on-disk format.
+
+from collections import namedtuple
+import lzma
+import mmap
+import os
+import stat
+import struct
+import zlib
+
+SQUASHFS_MAGIC = 0x73717368
+METADATA_SIZE = 8192
+# set in data block and fragment sizes when they are stored uncompressed
+_UNCOMPRESSED_BIT = 1 << 24
+_NO_FRAGMENT = 0xffffffff
+
+# superblock fields we need, in on-disk order
+_SUPERBLOCK = struct.Struct('<IIIIIHHHHHHQQQQQQQQ')
+_SUPERBLOCK_FIELDS = ['magic', 'inode_count', 'mkfs_time', 'block_size',
+                      'fragments', 'compression', 'block_log', 'flags',
+                      'no_ids', 's_major', 's_minor', 'root_inode',
+                      'bytes_used', 'id_table_start', 'xattr_id_table_start',
+                      'inode_table_start', 'directory_table_start',
+                      'fragment_table_start', 'lookup_table_start']
+
+_INODE_HEADER = struct.Struct('<HHHHII')
+_FRAGMENT_ENTRY = struct.Struct('<QII')
+_DIR_HEADER = struct.Struct('<III')
+_DIR_ENTRY = struct.Struct('<HhHH')
+
+# inode types, basic and extended, and the file type they correspond to
+_DIR, _REG, _SYMLINK, _BLKDEV, _CHRDEV, _FIFO, _SOCKET = range(1, 8)
+_LDIR, _LREG, _LSYMLINK, _LBLKDEV, _LCHRDEV, _LFIFO, _LSOCKET = range(8, 15)
+_S_IFMT = {
+    _DIR: stat.S_IFDIR,
+    _REG: stat.S_IFREG,
+    _SYMLINK: stat.S_IFLNK,
+    _BLKDEV: stat.S_IFBLK,
+    _CHRDEV: stat.S_IFCHR,
+    _FIFO: stat.S_IFIFO,
+    _SOCKET: stat.S_IFSOCK,
+}
+
+# compression ids, see squashfs_fs.h
+_DECOMPRESSORS = {
+    1: ('gzip', zlib.decompress),
+    2: ('lzma', lambda data: lzma.decompress(data, format=lzma.FORMAT_ALONE)),
+    4: ('xz', lambda data: lzma.decompress(data, format=lzma.FORMAT_XZ)),
+}
+
+# One entry of the image as listed by 'unsquashfs -lls'. 'path' starts with
+# './' ('.' for the root directory), 'type' is the 'ls -l' file type
+# character, 'mode' includes the file type bits (as with os.stat()), 'rdev'
+# is (major, minor) for devices and None otherwise and 'target' is the
+# target of symlinks and None otherwise.
+SquashfsEntry = namedtuple('SquashfsEntry', ['path', 'type', 'mode', 'uid',
+                                             'gid', 'size', 'mtime', 'rdev',
+                                             'target'])
+SquashfsEntry.__new__.__defaults__ = (None, )
+
+# Where the contents of a regular file are stored: its data blocks start at
+# 'start' with the given (on-disk) 'block_sizes' and the rest of the file
+# is at 'offset' in fragment 'fragment' (if not _NO_FRAGMENT).
+_FileData = namedtuple('_FileData', ['start', 'size', 'block_sizes',
+                                     'fragment', 'offset'])
+
+
+class SquashfsException(Exception):
+    '''This class represents squashfs exceptions'''
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class SquashfsImage(object):
+    '''This class represents a squashfs image opened for reading its
+       metadata. The image is mmap()ed and metadata blocks are decompressed
+       on demand.'''
+    def __init__(self, fn):
+        self.filename = fn
+        with open(fn, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise SquashfsException("'%s' is not a squashfs image" % fn)
+
+        try:
+            self._read_superblock()
+        except Exception:
+            self.close()
+            raise
+        self._blocks = dict()
+        self._ids = None
+        self._fragments = None
+        self._refs = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Unmap the image'''
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _read_superblock(self):
+        if len(self._mmap) < _SUPERBLOCK.size:
+            raise SquashfsException("'%s' is too short" % self.filename)
+        fields = _SUPERBLOCK.unpack_from(self._mmap, 0)
+        for (name, value) in zip(_SUPERBLOCK_FIELDS, fields):
+            setattr(self, name, value)
+
+        if self.magic != SQUASHFS_MAGIC:
+            raise SquashfsException("'%s' is not a squashfs image" %
+                                    self.filename)
+        if (self.s_major, self.s_minor) != (4, 0):
+            raise SquashfsException("unsupported squashfs version %d.%d" %
+                                    (self.s_major, self.s_minor))
+        if self.compression not in _DECOMPRESSORS:
+            raise SquashfsException("unsupported squashfs compression %d" %
+                                    self.compression)
+        self.compression_name = _DECOMPRESSORS[self.compression][0]
+        if self.bytes_used > len(self._mmap):
+            raise SquashfsException("'%s' is truncated" % self.filename)
+
+    def _read_block(self, pos):
+        '''Return the uncompressed metadata block at pos along with the
+           position of the next block'''
+        if pos not in self._blocks:
+            (header, ) = struct.unpack_from('<H', self._mmap, pos)
+            size = header & 0x7fff
+            data = self._mmap[pos + 2:pos + 2 + size]
+            if len(data) != size:
+                raise SquashfsException("metadata block at %d is truncated" %
+                                        pos)
+            if not header & 0x8000:
+                try:
+                    data = _DECOMPRESSORS[self.compression][1](data)
+                except (zlib.error, lzma.LZMAError) as e:
+                    raise SquashfsException("could not decompress metadata "
+                                            "block at %d: %s" % (pos, e))
+            self._blocks[pos] = (data, pos + 2 + size)
+        return self._blocks[pos]
+
+    def _read(self, pos, offset, length):
+        '''Read length bytes from the metadata starting at offset in the
+           block at pos. Returns the data along with the block and offset
+           following it.'''
+        chunks = []
+        while length > 0:
+            (data, next_pos) = self._read_block(pos)
+            chunk = data[offset:offset + length]
+            chunks.append(chunk)
+            length -= len(chunk)
+            offset += len(chunk)
+            if offset >= len(data):
+                if length > 0 and next_pos >= self.bytes_used:
+                    raise SquashfsException("metadata ends early")
+                (pos, offset) = (next_pos, 0)
+        return (b''.join(chunks), pos, offset)
+
+    def _unpack(self, fmt, pos, offset):
+        '''struct.unpack() fmt from the metadata at pos and offset'''
+        (data, pos, offset) = self._read(pos, offset, fmt.size)
+        return (fmt.unpack(data), pos, offset)
+
+    def _get_id(self, idx):
+        '''Return the uid or gid at idx in the id table'''
+        if self._ids is None:
+            nblocks = (self.no_ids * 4 + METADATA_SIZE - 1) // METADATA_SIZE
+            block_ptrs = struct.unpack_from('<%dQ' % nblocks, self._mmap,
+                                            self.id_table_start)
+            data = b''
+            for ptr in block_ptrs:
+                data += self._read_block(ptr)[0]
+            self._ids = struct.unpack_from('<%dI' % self.no_ids, data)
+        if idx >= len(self._ids):
+            raise SquashfsException("invalid id index %d" % idx)
+        return self._ids[idx]
+
+    def _read_inode(self, block, offset):
+        '''Read the inode at offset in the inode table block (relative to the
+           start of the inode table). Returns (inode type, mode, uid, gid,
+           mtime, size, rdev, directory listing location, symlink target,
+           _FileData).'''
+        pos = self.inode_table_start + block
+        ((itype, perms, uid_idx, gid_idx, mtime, inode_number), pos, offset) \
+            = self._unpack(_INODE_HEADER, pos, offset)
+
+        size = 0
+        rdev = None
+        listing = None
+        target = None
+        data = None
+        if itype == _DIR:
+            ((dir_block, nlink, size, dir_offset, parent), pos, offset) = \
+                self._unpack(struct.Struct('<IIHHI'), pos, offset)
+            listing = (dir_block, dir_offset, size - 3)
+        elif itype == _LDIR:
+            ((nlink, size, dir_block, parent, i_count, dir_offset, xattr),
+             pos, offset) = self._unpack(struct.Struct('<IIIIHHI'), pos,
+                                         offset)
+            listing = (dir_block, dir_offset, size - 3)
+        elif itype == _REG:
+            ((start, fragment, frag_offset, size), pos, offset) = \
+                self._unpack(struct.Struct('<IIII'), pos, offset)
+            data = self._read_file_data(pos, offset, start, size, fragment,
+                                        frag_offset)
+        elif itype == _LREG:
+            ((start, size, sparse, nlink, fragment, frag_offset, xattr), pos,
+             offset) = self._unpack(struct.Struct('<QQQIIII'), pos, offset)
+            data = self._read_file_data(pos, offset, start, size, fragment,
+                                        frag_offset)
+        elif itype in [_SYMLINK, _LSYMLINK]:
+            ((nlink, size), pos, offset) = \
+                self._unpack(struct.Struct('<II'), pos, offset)
+            target = os.fsdecode(self._read(pos, offset, size)[0])
+        elif itype in [_BLKDEV, _CHRDEV, _LBLKDEV, _LCHRDEV]:
+            ((nlink, dev), pos, offset) = \
+                self._unpack(struct.Struct('<II'), pos, offset)
+            # the kernel's new_encode_dev()
+            rdev = ((dev & 0xfff00) >> 8, (dev & 0xff) | ((dev >> 12) &
+                                                          0xfff00))
+        elif itype not in [_FIFO, _SOCKET, _LFIFO, _LSOCKET]:
+            raise SquashfsException("unknown inode type %d" % itype)
+
+        if itype > _SOCKET:
+            itype -= 7
+        mode = _S_IFMT[itype] | perms
+        return (itype, mode, self._get_id(uid_idx), self._get_id(gid_idx),
+                mtime, size, rdev, listing, target, data)
+
+    def _read_file_data(self, pos, offset, start, size, fragment,
+                        frag_offset):
+        '''Read the block list following a regular file inode'''
+        if fragment == _NO_FRAGMENT:
+            nblocks = (size + self.block_size - 1) // self.block_size
+        else:
+            nblocks = size // self.block_size
+        fmt = struct.Struct('<%dI' % nblocks)
+        (block_sizes, pos, offset) = self._unpack(fmt, pos, offset)
+        return _FileData(start, size, block_sizes, fragment, frag_offset)
+
+    def _decompress(self, pos, disk_size, what):
+        '''Return the data block or fragment block of disk_size at pos'''
+        size = disk_size & ~_UNCOMPRESSED_BIT
+        data = self._mmap[pos:pos + size]
+        if len(data) != size:
+            raise SquashfsException("%s at %d is truncated" % (what, pos))
+        if not disk_size & _UNCOMPRESSED_BIT:
+            try:
+                data = _DECOMPRESSORS[self.compression][1](data)
+            except (zlib.error, lzma.LZMAError) as e:
+                raise SquashfsException("could not decompress %s at %d: %s" %
+                                        (what, pos, e))
+        return data
+
+    def _get_fragment(self, idx):
+        '''Return the (start, on-disk size) of fragment block idx'''
+        if self._fragments is None:
+            nblocks = (self.fragments * _FRAGMENT_ENTRY.size +
+                       METADATA_SIZE - 1) // METADATA_SIZE
+            block_ptrs = struct.unpack_from('<%dQ' % nblocks, self._mmap,
+                                            self.fragment_table_start)
+            data = b''
+            for ptr in block_ptrs:
+                data += self._read_block(ptr)[0]
+            self._fragments = [_FRAGMENT_ENTRY.unpack_from(data, i)[:2] for
+                               i in range(0, self.fragments *
+                                          _FRAGMENT_ENTRY.size,
+                                          _FRAGMENT_ENTRY.size)]
+        if idx >= len(self._fragments):
+            raise SquashfsException("invalid fragment index %d" % idx)
+        return self._fragments[idx]
+
+    def _read_data(self, data):
+        '''Return the contents of the regular file with _FileData data'''
+        chunks = []
+        pos = data.start
+        remaining = data.size
+        for disk_size in data.block_sizes:
+            if disk_size == 0:  # sparse block
+                chunk = b'\0' * min(self.block_size, remaining)
+            else:
+                chunk = self._decompress(pos, disk_size, "data block")
+                pos += disk_size & ~_UNCOMPRESSED_BIT
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        if data.fragment != _NO_FRAGMENT and remaining > 0:
+            (frag_start, frag_size) = self._get_fragment(data.fragment)
+            block = self._decompress(frag_start, frag_size, "fragment")
+            chunks.append(block[data.offset:data.offset + remaining])
+        contents = b''.join(chunks)
+        if len(contents) != data.size:
+            raise SquashfsException("could not read %d bytes of data at %d" %
+                                    (data.size, data.start))
+        return contents
+
+    def _read_directory(self, dir_block, dir_offset, length):
+        '''Yield (name, inode block, inode offset) for the entries of the
+           directory listing'''
+        pos = self.directory_table_start + dir_block
+        offset = dir_offset
+        while length > 0:
+            ((count, start, inode_number), pos, offset) = \
+                self._unpack(_DIR_HEADER, pos, offset)
+            length -= _DIR_HEADER.size
+            for i in range(count + 1):
+                ((inode_offset, inode_delta, itype, name_size), pos,
+                 offset) = self._unpack(_DIR_ENTRY, pos, offset)
+                (name, pos, offset) = self._read(pos, offset, name_size + 1)
+                length -= _DIR_ENTRY.size + name_size + 1
+                yield (os.fsdecode(name), start, inode_offset)
+
+    def _walk(self):
+        '''Yield (SquashfsEntry, inode location) for every file in the
+           image'''
+        root = (self.root_inode >> 16, self.root_inode & 0xffff)
+        stack = [('.', root)]
+        while stack:
+            (path, ref) = stack.pop()
+            (itype, mode, uid, gid, mtime, size, rdev, listing, target,
+             data) = self._read_inode(*ref)
+            yield (SquashfsEntry(path, stat.filemode(mode)[0], mode, uid,
+                                 gid, size, mtime, rdev, target), ref)
+            if listing is not None and listing[2] > 0:
+                children = [(os.path.join(path, name), (b, o)) for
+                            (name, b, o) in self._read_directory(*listing)]
+                # pop()ed in order
+                stack.extend(reversed(children))
+
+    def entries(self):
+        '''Yield a SquashfsEntry for every file in the image, parents before
+           their children and directories sorted by name (as with
+           'unsquashfs -lls')'''
+        for (entry, ref) in self._walk():
+            yield entry
+
+    def read(self, path):
+        '''Return the contents of the regular file at path (as in
+           SquashfsEntry.path)'''
+        if self._refs is None:
+            self._refs = dict((entry.path, ref) for (entry, ref) in
+                              self._walk())
+        if path not in self._refs:
+            raise SquashfsException("'%s' not found" % path)
+        data = self._read_inode(*self._refs[path])[9]
+        if data is None:
+            raise SquashfsException("'%s' is not a regular file" % path)
+        return self._read_data(data)
+
+
+def is_squashfs(fn):
+    '''Return true if fn is a squashfs image'''
+    try:
+        with open(fn, 'rb') as f:
+            header = f.read(4)
+    except (IOError, OSError):
+        return False
+    return len(header) == 4 and \
+        struct.unpack('<I', header)[0] == SQUASHFS_MAGIC
+
+
+def list_entries(fn):
+    '''Return the SquashfsEntry list of all files in the squashfs image fn'''
+    with SquashfsImage(fn) as image:
+        return list(image.entries())
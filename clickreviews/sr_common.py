@@ -17,14 +17,12 @@
 from __future__ import print_function
 import os
 import re
-import yaml
 
 
 from clickreviews.common import (
     Review,
     ReviewException,
     error,
-    open_file_read,
 )
 
 import clickreviews.snapd_base_declaration as snapd_base_declaration
@@ -178,17 +176,14 @@ class SnapReview(Review):
         }
     }
 
-    def __init__(self, fn, review_type, overrides=None):
-        Review.__init__(self, fn, review_type, overrides=overrides)
+    def __init__(self, fn, review_type, overrides=None, context=None):
+        Review.__init__(self, fn, review_type, overrides=overrides,
+                        context=context)
 
         if not self.is_snap2:
             return
 
-        snap_yaml = self._extract_snap_yaml()
-        try:
-            self.snap_yaml = yaml.safe_load(snap_yaml)
-        except Exception:  # pragma: nocover
-            error("Could not load snap.yaml. Is it properly formatted?")
+        self.snap_yaml = self._get_cached('snap_yaml', self._load_snap_yaml)
 
         # If local_copy is None, then this will check the server to see if
         # we are up to date. However, if we are working within the development
@@ -259,21 +254,25 @@ class SnapReview(Review):
                 if self.snap_yaml[k][iface] is None:
                     self.snap_yaml[k][iface] = {}
 
+    def _load_snap_yaml(self):
+        '''Load the snappy 16.04 snap.yaml'''
+        import yaml
+        snap_yaml = self._extract_snap_yaml()
+        try:
+            return yaml.safe_load(snap_yaml)
+        except Exception:  # pragma: nocover
+            error("Could not load snap.yaml. Is it properly formatted?")
+
     # Since coverage is looked at via the testsuite and the testsuite mocks
     # this out, don't cover this
     def _extract_snap_yaml(self):  # pragma: nocover
         '''Extract and read the snappy 16.04 snap.yaml'''
-        y = os.path.join(self.unpack_dir, "meta/snap.yaml")
-        if not os.path.isfile(y):
+        if not self.fs.isfile("meta/snap.yaml"):
             error("Could not find snap.yaml.")
-        return open_file_read(y)
+        return self.fs.open_text("meta/snap.yaml")
 
     # Since coverage is looked at via the testsuite and the testsuite mocks
     # this out, don't cover this
-    def _get_unpack_dir(self):  # pragma: nocover
-        '''Get unpack directory'''
-        return self.unpack_dir
-
     def _verify_pkgname(self, n):
         '''Verify package name'''
         # From validSnapName in snapd/snap/validate.go:
@@ -15,30 +15,36 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
-from clickreviews.sr_common import SnapReview, SnapReviewException
-from clickreviews.overrides import iface_attributes_noflag
+from clickreviews.sr_common import SnapReview
+from clickreviews.declaration import (
+    SnapDeclarationException,
+    get_evaluator,
+    has_alternates,
+    iter_alternates,
+)
 import re
 
 # Specification:
 # https://docs.google.com/document/d/1QkglVjSzHC65lPthXV3ZlQcqPpKxuGEBL-FMuGP6ogs/edit#
 
 
-class SnapDeclarationException(SnapReviewException):
-    '''This class represents SnapDeclaration exceptions'''
-
-
 class SnapReviewDeclaration(SnapReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "declaration-snap-v2",
-                            overrides=overrides)
+    review_type = "declaration-snap-v2"
+    needs_unpack = False
+
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(self, fn, self.review_type,
+                            overrides=overrides, context=context)
 
+        self._evaluator = None
+        self._evaluator_decls = None
+        self.snap_declaration = None
         if not self.is_snap2:
             return
 
         self._verify_declaration(self.base_declaration, base=True)
 
-        self.snap_declaration = None
         if overrides is not None and ('snap_decl_plugs' in overrides or
                                       'snap_decl_slots' in overrides):
             self.snap_declaration = {}
@@ -328,94 +334,6 @@ class SnapReviewDeclaration(SnapReview):
                     if not base and not found_errors:
                         self._add_result(t, n, s)
 
-    def _match(self, against, val):
-        '''Ordering matters since 'against' is treated as a regex if str'''
-        if type(against) != type(val):
-            return False
-
-        if type(val) not in [str, list, dict, bool]:
-            raise SnapDeclarationException("unknown type '%s'" % val)
-
-        matched = False
-
-        if isinstance(val, str):
-            if re.search(r'^(%s)$' % against, val):
-                matched = True
-        elif isinstance(val, list):
-            matched = (sorted(against) == sorted(val))
-        else:  # bools and dicts (TODO: nested matches for dicts)
-            matched = (against == val)
-
-        return matched
-
-    def _search(self, d, key, val=None, subkey=None, subval=None, subval_inverted=False):
-        '''Search dictionary 'd' for matching values. Returns true when
-           - val == d[key]
-           - subval in d[key][subkey]
-           - subval dictionary has any matches in d[key][subkey] dict
-           - subval_inverted == True and subval has any non-matches in
-             d[key][subkey] dict
-
-           When 'key' must be in 'd' and when 'subkey' is not None, it must be
-           in d[key] (we want to raise an Exception here for when _search() is
-           used with only exact matches).
-        '''
-        found = False
-
-        if val is not None and val == d[key]:
-            found = True
-        elif isinstance(d[key], dict) and subkey is not None and \
-                subval is not None:
-            if self.is_bool(d[key][subkey]):
-                found = d[key][subkey] == subval
-                if subval_inverted:
-                    found = not found
-            elif isinstance(d[key][subkey], list):
-                if subval_inverted:
-                    if subval not in d[key][subkey]:
-                        found = True
-                elif subval in d[key][subkey]:
-                    found = True
-            elif isinstance(d[key][subkey], dict) and isinstance(subval, dict):
-                d_keys = set(d[key][subkey].keys())
-                subval_keys = set(subval.keys())
-                int_keys = d_keys.intersection(subval_keys)
-                matches = 0
-                for subsubkey in int_keys:
-                    if self._match(d[key][subkey][subsubkey],
-                                   subval[subsubkey]) or \
-                            d[key][subkey][subsubkey] in \
-                            iface_attributes_noflag:
-                        found = True
-                        matches += 1
-
-                if subval_inverted:
-                    # return true when something didn't match
-                    if matches != len(int_keys):
-                        found = True
-                    else:
-                        found = False
-
-        return found
-
-    def _get_decl(self, base, snap, side, interface, dtype):
-        '''If the snap declaration has something to say about the declaration
-           override type (dtype), then use it instead of the base declaration.
-        '''
-        decl = base
-        base_decl = True
-        decl_type = "base"
-
-        if snap is not None and side in snap and interface in snap[side]:
-            for k in snap[side][interface]:
-                if k.endswith(dtype):
-                    decl = snap
-                    base_decl = False
-                    decl_type = "snap"
-                    break
-
-        return (decl, base_decl, decl_type)
-
     def _get_all_combinations(self, interface):
         '''Return list of all base and snap declaration combinations where
            each base/snap declaration pair represents a particular combination
@@ -506,258 +424,46 @@ class SnapReviewDeclaration(SnapReview):
             In this manner, each one of the base declarations can be evaluated
             and compared to any defined snap declarations.
         '''
-        def expand(d, side, interface, keys, templates):
-            if len(keys) == 0:
-                return templates
-
-            updated = []
-            key = keys[-1]
-            for i in d[side][interface][key]:
-                for t in templates:
-                    tmp = {side: {interface: {}}}
-                    # copy existing keys
-                    for template_key in t[side][interface]:
-                        tmp[side][interface][template_key] = \
-                            t[side][interface][template_key]
-                    tmp[side][interface][key] = i
-                    updated.append(tmp)
-
-            return expand(d, side, interface, keys[:-1], updated)
-
-        decls = {'base': [], 'snap': []}
-
-        has_alternates = False
-        for dtype in ["base", "snap"]:
-            if dtype == "base":
-                d = self.base_declaration
-            else:
-                d = self.snap_declaration
-
-            tmp = {}
-            for side in ["plugs", "slots"]:
-                if dtype == "snap" and d is None:
-                    continue
-                if side not in d or interface not in d[side]:
-                    continue
-
-                to_expand = []
-                template = {side: {interface: {}}}
-                for cstr in d[side][interface]:
-                    if isinstance(d[side][interface][cstr], list):
-                        to_expand.append(cstr)
-                    else:
-                        template[side][interface][cstr] = \
-                            d[side][interface][cstr]
-
-                tmp[side] = []
-                tmp[side] += expand(d, side, interface, to_expand, [template])
-
-                if len(to_expand) > 0:
-                    has_alternates = True
-
-            # Now that we have all the slots combinations and all the plugs
-            # combinations, create combinations of those
-            if "plugs" in tmp and "slots" in tmp:
-                for p in tmp["plugs"]:
-                    for s in tmp["slots"]:
-                        decls[dtype].append({'plugs': p['plugs'],
-                                             'slots': s['slots']})
-            elif "plugs" in tmp:
-                decls[dtype] = tmp["plugs"]
-            elif "slots" in tmp:
-                decls[dtype] = tmp["slots"]
+        decls = {'base': list(iter_alternates(self.base_declaration,
+                                              interface)),
+                 'snap': list(iter_alternates(self.snap_declaration,
+                                              interface))}
 
         # We need at least one declaration per list, even if it is None
         if len(decls['snap']) == 0:
             decls['snap'].append(None)
 
-        return (decls, has_alternates)
-
-    def _verify_iface_by_declaration(self, base, snap, name, iface, interface, attribs, side, oside):
-        # 'checked' is used to see if a particular check is made (eg, if
-        # 'deny-connection' for this interface was performed).
-        #
-        # 'denied' is used to track if something checked prompted manual review
-        #
-        # _verify_iface_by_declaration() will return if something prompted
-        # manual review (denied > 0) and if this is an exact match (ie, if
-        # checked == denied).
-        checked = 0
-        denied = 0
-
-        def err(key, subkey=None, dtype="base", attrs=None):
-            s = "human review required due to '%s' constraint " % key
-            if subkey is not None:
-                s += "for '%s' " % subkey
-            s += "from %s declaration" % dtype
-
-            if attrs is not None:
-                if 'allow-sandbox' in attrs and attrs['allow-sandbox']:
-                    s += ". If using a chromium webview, you can disable " + \
-                         "the internal sandbox (eg, use --no-sandbox) and " + \
-                         "remove the 'allow-sandbox' attribute instead. " + \
-                         "For Oxide webviews, export OXIDE_NO_SANDBOX=1 " + \
-                         "to disable its internal sandbox."
-
-            return s
-
-        # top-level allow/deny-installation/connection
-        # Note: auto-connection is only for snapd, so don't include it here
-        for i in ['installation', 'connection']:
-            for j in ['deny', 'allow']:
-                decl_key = "%s-%s" % (j, i)
-                # flag if deny-* is true or allow-* is false
-                (decl, base_decl, decl_type) = self._get_decl(base, snap, side,
-                                                              interface, i)
-                if side in decl and interface in decl[side] and \
-                        decl_key in decl[side][interface] and \
-                        not isinstance(decl[side][interface][decl_key], dict):
-                    checked += 1
-                    if self._search(decl[side][interface], decl_key,
-                                    j == 'deny'):
-                        self._add_result('error',
-                                         self._get_check_name("%s_%s" %
-                                                              (side, decl_key),
-                                                              app=iface,
-                                                              extra=interface),
-                                         err(decl_key, dtype=decl_type),
-                                         manual_review=True,
-                                         stage=True)
-                        denied += 1
-
-                        # if manual review after 'deny', don't look at allow
-                        break
-
-        # deny/allow-installation snap-type
-        snap_type = 'app'
-        if 'type' in self.snap_yaml:
-            snap_type = self.snap_yaml['type']
-            if snap_type == 'os':
-                snap_type = 'core'
-        decl_subkey = '%s-snap-type' % side[:-1]
-        for j in ['deny', 'allow']:
-            (decl, base_decl, decl_type) = self._get_decl(base, snap, side,
-                                                          interface,
-                                                          'installation')
-            decl_key = "%s-installation" % j
-            # flag if deny-*/snap-type matches or allow-*/snap-type doesn't
-            if side in decl and interface in decl[side] and \
-                    decl_key in decl[side][interface] and \
-                    isinstance(decl[side][interface][decl_key], dict) and \
-                    decl_subkey in decl[side][interface][decl_key]:
-                checked += 1
-                if self._search(decl[side][interface], decl_key,
-                                subkey=decl_subkey, subval=snap_type,
-                                subval_inverted=(j == 'allow')):
-                    self._add_result('error',
-                                     self._get_check_name("%s_%s" %
-                                                          (side, decl_key),
-                                                          app=iface,
-                                                          extra=interface),
-                                     err(decl_key, decl_subkey, decl_type),
-                                     manual_review=True,
-                                     stage=True)
-                    denied += 1
-
-                    # if manual review after 'deny', don't look at allow
-                    break
-
-        # deny/allow-connection/installation on-classic with app snaps
-        # Note: auto-connection is only for snapd, so don't include it here
-        snap_type = 'app'
-        if 'type' in self.snap_yaml:
-            snap_type = self.snap_yaml['type']
-            if snap_type == 'os':
-                snap_type = 'core'
-        decl_subkey = 'on-classic'
-        for i in ['installation', 'connection']:
-            for j in ['deny', 'allow']:
-                (decl, base_decl, decl_type) = self._get_decl(base, snap, side,
-                                                              interface, i)
-                decl_key = "%s-%s" % (j, i)
-                # when an app snap, flag if deny-*/on-classic=false or
-                # allow-*/on-classic=true
-                # when not an app snap, flag if deny-*/on-classic=true or
-                # allow-*/on-classic=false
-                if side in decl and interface in decl[side] and \
-                        decl_key in decl[side][interface] and \
-                        isinstance(decl[side][interface][decl_key], dict) and \
-                        decl_subkey in decl[side][interface][decl_key]:
-                    checked += 1
-                    if self._search(decl[side][interface], decl_key,
-                                    subkey=decl_subkey,
-                                    subval=(snap_type == 'app'),
-                                    subval_inverted=(j == 'deny')):
-                        self._add_result('error',
-                                         self._get_check_name("%s_%s" %
-                                                              (side, decl_key),
-                                                              app=iface,
-                                                              extra=interface),
-                                         err(decl_key, decl_subkey, decl_type),
-                                         manual_review=True,
-                                         stage=True)
-                        denied += 1
-
-                        # if manual review after 'deny', don't look at allow
-                        break
-
-        # deny/allow-connection/installation attributes
-        # Note: auto-connection is only for snapd, so don't include it here
-        decl_subkey = '%s-attributes' % side[:-1]
-        for i in ['installation', 'connection']:
-            if attribs is None:
-                continue
-            for j in ['deny', 'allow']:
-                (decl, base_decl, decl_type) = self._get_decl(base, snap, side,
-                                                              interface, i)
-                decl_key = "%s-%s" % (j, i)
-                # flag if any deny-*/attribs match or any allow-*/attribs don't
-                if side in decl and interface in decl[side] and \
-                        decl_key in decl[side][interface] and \
-                        isinstance(decl[side][interface][decl_key], dict) and \
-                        decl_subkey in decl[side][interface][decl_key]:
-                    checked += 1
-                    if self._search(decl[side][interface], decl_key,
-                                    subkey=decl_subkey, subval=attribs,
-                                    subval_inverted=(j == 'allow')):
-                        self._add_result('error',
-                                         self._get_check_name("%s_%s" %
-                                                              (side, decl_key),
-                                                              app=iface,
-                                                              extra=interface),
-                                         err(decl_key, decl_subkey, decl_type, attribs),
-                                         manual_review=True,
-                                         stage=True)
-                        denied += 1
-
-                        # if manual review after 'deny', don't look at allow
-                        break
-                # Since base declaration mostly has slots side, if plugs, look
-                # at the other side for checking plug-attributes
-                elif base_decl and side == 'plugs' and oside in decl and \
-                        interface in decl[oside] and \
-                        decl_key in decl[oside][interface] and \
-                        decl_subkey in decl[oside][interface][decl_key]:
-                    checked += 1
-                    if self._search(decl[oside][interface], decl_key,
-                                    subkey=decl_subkey, subval=attribs,
-                                    subval_inverted=(j == 'allow')):
-                        self._add_result('error',
-                                         self._get_check_name("%s_%s" %
-                                                              (side, decl_key),
-                                                              app=iface,
-                                                              extra=interface),
-                                         err(decl_key, decl_subkey, decl_type, attribs),
-                                         manual_review=True,
-                                         stage=True)
-                        denied += 1
-
-                        # if manual review after 'deny', don't look at allow
-                        break
+        return (decls, has_alternates(self.base_declaration,
+                                      self.snap_declaration, interface))
+
+    def _get_evaluator(self):
+        '''Return the DeclarationEvaluator of the base and snap declarations
+           (looked up again if they were replaced)'''
+        if self._evaluator is None or \
+                self._evaluator_decls[0] is not self.base_declaration or \
+                self._evaluator_decls[1] is not self.snap_declaration:
+            self._evaluator_decls = (self.base_declaration,
+                                     self.snap_declaration)
+            self._evaluator = get_evaluator(self.base_declaration,
+                                            self.snap_declaration)
+        return self._evaluator
+
+    def _flagged_msg(self, rule, attribs=None):
+        '''Return the result message for a plug or slot flagged by rule'''
+        s = "human review required due to '%s' constraint " % rule.key
+        if rule.subkey is not None:
+            s += "for '%s' " % rule.subkey
+        s += "from %s declaration" % rule.decl_type
+
+        if rule.uses == 'attributes':
+            if 'allow-sandbox' in attribs and attribs['allow-sandbox']:
+                s += ". If using a chromium webview, you can disable " + \
+                     "the internal sandbox (eg, use --no-sandbox) and " + \
+                     "remove the 'allow-sandbox' attribute instead. " + \
+                     "For Oxide webviews, export OXIDE_NO_SANDBOX=1 " + \
+                     "to disable its internal sandbox."
 
-        # Return if something prompted for manual review and if everything
-        # checked was denied (an exact match denial)
-        return (denied > 0, checked == denied)
+        return s
 
     def _verify_iface(self, name, iface, interface, attribs=None):
         if name.endswith('slot'):
@@ -784,28 +490,25 @@ class SnapReviewDeclaration(SnapReview):
             self._add_result(t, n, s)
             return
 
-        # To support alternates in the base and snap declaration, we need to
-        # try each combination of snap alternate constraint and base alternate
-        # constraint. If we have alternates and one passes and there are no
-        # exact denials, then don't report. Otherwise report if require manual
-        # review.
-        (decls, has_alternates) = self._get_all_combinations(interface)
-        require_manual = False
-
-        exact_deny = True
-        for b in decls['base']:
-            for s in decls['snap']:
-                (manual, exact) = \
-                    self._verify_iface_by_declaration(b, s, name, iface,
-                                                      interface, attribs, side,
-                                                      oside)
-                if manual:
-                    require_manual = True
-                    if has_alternates and not exact:
-                        exact_deny = False
-
-        if has_alternates and not exact_deny:
-            require_manual = False
+        snap_type = 'app'
+        if 'type' in self.snap_yaml:
+            snap_type = self.snap_yaml['type']
+            if snap_type == 'os':
+                snap_type = 'core'
+
+        # If we have alternates and one passes, then don't report. Otherwise
+        # report if require manual review. The verdict may be shared with
+        # other plugs, slots and apps using the interface, so the results are
+        # named after this one.
+        (require_manual, flagged) = \
+            self._get_evaluator().evaluate(side, interface, snap_type, attribs)
+        for rule in flagged:
+            self._add_result('error',
+                             self._get_check_name("%s_%s" % (side, rule.key),
+                                                  app=iface, extra=interface),
+                             self._flagged_msg(rule, attribs),
+                             manual_review=True,
+                             stage=True)
 
         # Apply our staged results if required, otherwise report all is ok
         if require_manual:
@@ -20,6 +20,8 @@ from clickreviews.sr_common import (
 )
 from clickreviews.common import (
     find_external_symlinks,
+    reports,
+    requires,
     STORE_PKGNAME_SNAPV2_MAXLEN,
 )
 from clickreviews.overrides import (
@@ -33,10 +35,12 @@ import re
 
 class SnapReviewLint(SnapReview):
     '''This class represents snap lint reviews'''
+    review_type = "lint-snap-v2"
 
-    def __init__(self, fn, overrides=None):
+    def __init__(self, fn, overrides=None, context=None):
         '''Set up the class.'''
-        SnapReview.__init__(self, fn, "lint-snap-v2", overrides=overrides)
+        SnapReview.__init__(self, fn, self.review_type, overrides=overrides,
+                            context=context)
         if not self.is_snap2:
             return
 
@@ -62,8 +66,6 @@ class SnapReviewLint(SnapReview):
         self.iffy_files = ['^\..+\.swp$',  # vim
                            ]
 
-        self._list_all_compiled_binaries()
-
         self.redflagged_snap_types = ['kernel',
                                       'gadget',
                                       'os',
@@ -282,7 +284,7 @@ class SnapReviewLint(SnapReview):
             return
 
         fn = os.path.join(self._get_unpack_dir(), 'meta/hooks/config')
-        if fn not in self.pkg_files:
+        if fn not in self.pkg_inventory:
             return
 
         t = 'info'
@@ -335,7 +337,7 @@ class SnapReviewLint(SnapReview):
         n = self._get_check_name('icon_exists')
         s = 'OK'
         fn = self._path_join(self._get_unpack_dir(), self.snap_yaml['icon'])
-        if fn not in self.pkg_files:
+        if fn not in self.pkg_inventory:
             t = 'error'
             s = "icon entry '%s' does not exist" % self.snap_yaml['icon']
         self._add_result(t, n, s)
@@ -472,7 +474,7 @@ class SnapReviewLint(SnapReview):
                 fn = self._path_join(self._get_unpack_dir(),
                                      os.path.normpath(
                                          self.snap_yaml['apps'][app][key]))
-                if fn not in self.pkg_files:
+                if fn not in self.pkg_inventory:
                     t = 'error'
                     s = "%s does not exist" % (
                         self.snap_yaml['apps'][app][key])
@@ -1129,13 +1131,15 @@ class SnapReviewLint(SnapReview):
         t = 'info'
         n = self._get_check_name('external_symlinks')
         s = 'OK'
-        links = find_external_symlinks(self._get_unpack_dir(), self.pkg_files,
+        links = find_external_symlinks(self.pkg_inventory,
                                        self.snap_yaml['name'])
         if len(links) > 0:
             t = 'error'
             s = 'package contains external symlinks: %s' % ', '.join(links)
         self._add_result(t, n, s)
 
+    @reports('valid_contents_for_architecture')
+    @requires('_list_all_compiled_binaries')
     def check_architecture_all(self):
         '''Check if actually architecture all'''
         if not self.is_snap2:
@@ -1168,6 +1172,8 @@ class SnapReviewLint(SnapReview):
                 (", ".join(x_binaries), ok_text)
         self._add_result(t, n, s)
 
+    @reports('architecture_specified_needed')
+    @requires('_list_all_compiled_binaries')
     def check_architecture_specified_needed(self):
         '''Check if the specified architecture is actually needed'''
         if not self.is_snap2 or 'architectures' not in self.snap_yaml:
@@ -1217,11 +1223,14 @@ class SnapReviewLint(SnapReview):
         s = 'OK'
         found = []
 
-        for f in self.pkg_files:
-            fn = os.path.basename(f)
-            for d in self.iffy_files:
-                if re.search(r'%s' % d, fn):
-                    found.append(os.path.relpath(f, self.unpack_dir))
+        pats = [re.compile(r'%s' % d) for d in self.iffy_files]
+        # many files share a basename, so only match each basename once
+        matches = dict()
+        for f in self.pkg_inventory:
+            if f.basename not in matches:
+                matches[f.basename] = len([p for p in pats
+                                           if p.search(f.basename)])
+            found += [f.relpath] * matches[f.basename]
 
         if len(found) > 0:
             t = 'warn'
@@ -1526,10 +1535,9 @@ class SnapReviewLint(SnapReview):
             return
 
         has_desktop_files = False
-        for f in self.pkg_files:
-            fn = os.path.relpath(f, self._get_unpack_dir())
-            if fn.startswith("meta/gui/") and fn.endswith(".desktop"):
-                self._verify_desktop_file(f)
+        for f in self.pkg_inventory.with_extension(".desktop"):
+            if f.relpath.startswith("meta/gui/"):
+                self._verify_desktop_file(f.path)
                 has_desktop_files = True
                 break
 
@@ -22,7 +22,6 @@ from clickreviews.sr_common import (
 from clickreviews.common import (
     cmd,
     create_tempdir,
-    ReviewException,
     AA_PROFILE_NAME_MAXLEN,
     AA_PROFILE_NAME_ADVLEN,
     MKSQUASHFS_OPTS,
@@ -31,14 +30,25 @@ from clickreviews.overrides import (
     sec_mode_overrides,
     sec_browser_support_overrides,
 )
+from clickreviews import squashfs
+import grp
 import os
+import pwd
 import re
+import stat
+import time
+
+SQUASHFS_DATE_PAT = re.compile(r'^\d\d\d\d-\d\d-\d\d$')
+SQUASHFS_TIME_PAT = re.compile(r'^\d\d:\d\d$')
 
 
 class SnapReviewSecurity(SnapReview):
     '''This class represents snap security reviews'''
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "security-snap-v2", overrides=overrides)
+    review_type = "security-snap-v2"
+
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(self, fn, self.review_type, overrides=overrides,
+                            context=context)
 
         if not self.is_snap2:
             return
@@ -51,6 +61,17 @@ class SnapReviewSecurity(SnapReview):
         '''Run unsquashfs -lls on a snap package'''
         return cmd(['unsquashfs', '-lls', snap_pkg])
 
+    def _unsquashfs_fstime(self, snap_pkg):
+        '''Run unsquashfs -fstime on a snap package'''
+        return cmd(['unsquashfs', '-fstime', snap_pkg])
+
+    def _get_squashfs_metadata(self, name):
+        '''Return the (rc, out) of unsquashfs -<name> on the snap. With a
+           PackageContext, unsquashfs is only run once per package.'''
+        fn = os.path.abspath(self.pkg_filename)
+        loader = getattr(self, '_unsquashfs_%s' % name)
+        return self._get_cached('unsquashfs_%s' % name, lambda: loader(fn))
+
     def check_security_plugs_browser_support_with_daemon(self):
         '''Check security plugs - browser-support not used with daemon'''
         def _plugref_is_interface(ref, iface):
@@ -136,7 +157,7 @@ class SnapReviewSecurity(SnapReview):
 
         # Verify squashfs supports the -fstime option, if not, warn (which
         # blocks in store)
-        (rc, out) = cmd(['unsquashfs', '-fstime', fn])
+        (rc, out) = self._get_squashfs_metadata('fstime')
         if rc != 0:
             t = 'warn'
             n = self._get_check_name('squashfs_supports_fstime')
@@ -146,14 +167,20 @@ class SnapReviewSecurity(SnapReview):
         fstime = out.strip()
 
         # For now, skip the checks on if have symlinks due to LP: #1555305
-        (rc, out) = cmd(['unsquashfs', '-lls', fn])
-        if rc != 0:
-            t = 'error'
-            n = self._get_check_name('squashfs_lls')
-            s = 'could not list contents of squashfs'
-            self._add_result(t, n, s)
-            return
-        elif 'lrwxrwxrwx' in out:
+        entries = self._get_squashfs_entries()
+        if entries is not None:
+            has_symlinks = any(e.type == 'l' for e in entries)
+        else:
+            (rc, out) = self._get_squashfs_metadata('lls')
+            if rc != 0:
+                t = 'error'
+                n = self._get_check_name('squashfs_lls')
+                s = 'could not list contents of squashfs'
+                self._add_result(t, n, s)
+                return
+            has_symlinks = any(line.startswith('l')
+                               for line in out.splitlines())
+        if has_symlinks:
             t = 'info'
             n = self._get_check_name('squashfs_resquash_1555305')
             s = 'cannot reproduce squashfs'
@@ -163,33 +190,18 @@ class SnapReviewSecurity(SnapReview):
         # end LP: #1555305 workaround
 
         tmpdir = create_tempdir()  # this is autocleaned
-        tmp_unpack = os.path.join(tmpdir, 'squashfs-root')
         tmp_repack = os.path.join(tmpdir, 'repack.snap')
 
-        curdir = os.getcwd()
-        os.chdir(tmpdir)
-        # ensure we don't alter the permissions from the unsquashfs
-        old_umask = os.umask(000)
-
-        try:
-            (rc, out) = cmd(['unsquashfs', '-d', tmp_unpack, fn])
-            if rc != 0:
-                raise ReviewException("could not unsquash '%s': %s" %
-                                      (os.path.basename(fn), out))
-            (rc, out) = cmd(['mksquashfs', tmp_unpack, tmp_repack,
-                             '-fstime', fstime] + MKSQUASHFS_OPTS)
-            if rc != 0:
-                raise ReviewException("could not mksquashfs '%s': %s" %
-                                      (os.path.relpath(tmp_unpack, tmpdir),
-                                       out))
-        except ReviewException as e:
+        # Repack the snap as it was already unsquashed into unpack_dir
+        (rc, out) = cmd(['mksquashfs', self.unpack_dir, tmp_repack,
+                         '-fstime', fstime] + MKSQUASHFS_OPTS)
+        if rc != 0:
             t = 'error'
             n = self._get_check_name('squashfs_resquash')
-            self._add_result(t, n, str(e))
+            s = "could not mksquashfs unpacked '%s': %s" % \
+                (os.path.basename(fn), out)
+            self._add_result(t, n, s)
             return
-        finally:
-            os.umask(old_umask)
-            os.chdir(curdir)
 
         # Now calculate the hashes
         t = 'info'
@@ -227,40 +239,160 @@ class SnapReviewSecurity(SnapReview):
                     "'mksquashfs <dir> <snap> %s'" % " ".join(MKSQUASHFS_OPTS)
         self._add_result(t, n, s)
 
-    def check_squashfs_files(self):
-        '''Check squashfs files'''
+    def _read_squashfs_entries(self, snap_pkg):
+        '''Return the squashfs.SquashfsEntry list of a snap package, or
+           None if the image cannot be read without unsquashfs (eg, it uses
+           a compression not supported by python)'''
+        if not squashfs.is_squashfs(snap_pkg):
+            return None
+        try:
+            return squashfs.list_entries(snap_pkg)
+        except squashfs.SquashfsException:
+            return None
+
+    def _get_squashfs_entries(self):
+        '''Return the squashfs.SquashfsEntry list for the snap, or None as
+           with _read_squashfs_entries(). With a PackageContext, the image
+           is only read once per package.'''
+        fn = os.path.abspath(self.pkg_filename)
+        return self._get_cached('squashfs_entries',
+                                lambda: self._read_squashfs_entries(fn))
+
+    def _squashfs_mode_error(self, pkgname, snap_type, fname, ftype, mode):
+        '''Return the error for the file type and mode (as with 'ls -l')
+           of an entry in the squashfs, if any'''
         def _check_allowed_perms(mode, allowed):
             for p in mode[1:]:
                 if p not in allowed:
                     return False
             return True
 
-        if not self.is_snap2:
-            return
-
-        pkgname = self.snap_yaml['name']
+        # Also see 'info ls', but we list only the Linux ones
+        if ftype not in ['b', 'c', 'd', 'l', 'p', 's', '-']:
+            return "unknown type '%s' for entry '%s'" % (ftype, fname)
+
+        if ftype == 'd' or ftype == '-':
+            perms = ['r', 'w', 'x', '-']
+            if ftype == 'd':  # allow sticky directories for stage-packages
+                perms.append('t')
+            if not _check_allowed_perms(mode, perms):
+                if pkgname not in sec_mode_overrides or \
+                    fname not in sec_mode_overrides[pkgname] or \
+                        sec_mode_overrides[pkgname][fname] != mode:
+                    return "unusual mode '%s' for entry '%s'" % (mode, fname)
+            # No point checking for world-writable, the squashfs is
+            # readonly
+        elif ftype == 'l':
+            if mode != 'rwxrwxrwx':
+                return "unusual mode '%s' for symlink '%s'" % (mode, fname)
+        elif snap_type != 'os':
+            return "file type '%s' not allowed (%s)" % (ftype, fname)
+        return None
+
+    def _squashfs_owner_error(self, snap_type, fname, user, group):
+        '''Return the error for the owner of an entry in the squashfs, if
+           any'''
+        # we enforce 'root/root'
+        if snap_type != 'os' and (user != 'root' or group != 'root'):
+            return "unusual user/group '%s/%s' for '%s'" % (user, group,
+                                                            fname)
+        return None
+
+    def _squashfs_fields_malformed(self, fname, ftype, size, rdev, date,
+                                   hhmm):
+        '''Return what is malformed in the size (or the (major, minor) rdev
+           of devices), date and time of an entry in the squashfs, as shown
+           by unsquashfs -lls'''
+        malformed = []
+        if ftype == 'b' or ftype == 'c':
+            (major, minor) = rdev
+            try:
+                int(major)
+            except:
+                malformed.append("major '%s' malformed for '%s'" %
+                                 (major, fname))
+            try:
+                int(minor)
+            except:
+                malformed.append("minor '%s' malformed for '%s'" %
+                                 (minor, fname))
+        else:
+            try:
+                int(size)
+            except:
+                malformed.append("size '%s' malformed for '%s'" % (size,
+                                                                   fname))
+                return malformed
+
+        if not SQUASHFS_DATE_PAT.search(date):
+            malformed.append("date '%s' malformed for '%s'" % (date, fname))
+        elif not SQUASHFS_TIME_PAT.search(hhmm):
+            malformed.append("time '%s' malformed for '%s'" % (hhmm, fname))
+        return malformed
+
+    def _check_squashfs_entries(self, entries, pkgname, snap_type):
+        '''Check the squashfs.SquashfsEntry list of the snap as
+           _check_squashfs_lls() checks the unsquashfs -lls output,
+           returning the errors and malformed entries'''
+        def _id_name(getter, i):
+            # unsquashfs -lls shows the name on this system, if any
+            try:
+                return getter(i)[0]
+            except KeyError:
+                return str(i)
 
-        snap_type = 'app'
-        if 'type' in self.snap_yaml:
-            snap_type = self.snap_yaml['type']
+        errors = []
+        malformed = []
+        if len(entries) == 0:
+            t = 'error'
+            n = self._get_check_name('squashfs_files_malformed output')
+            s = "unsquashfs -lls ouput too short"
+            self._add_result(t, n, s)
 
-        fn = os.path.abspath(self.pkg_filename)
+        for entry in entries:
+            mode = stat.filemode(entry.mode)[1:]
+            if len(mode) != 9:
+                malformed.append("mode '%s' malformed for '%s'" %
+                                 (mode, entry.path))
+                continue
+            err = self._squashfs_mode_error(pkgname, snap_type, entry.path,
+                                            entry.type, mode)
+            if err is None:
+                err = self._squashfs_owner_error(
+                    snap_type, entry.path, _id_name(pwd.getpwuid, entry.uid),
+                    _id_name(grp.getgrgid, entry.gid))
+            if err is not None:
+                errors.append(err)
+                continue
 
-        (rc, out) = self._unsquashfs_lls(fn)
+            # unsquashfs -lls shows the local time
+            mtime = time.localtime(entry.mtime)
+            rdev = None
+            if entry.rdev is not None:
+                rdev = tuple(str(i) for i in entry.rdev)
+            malformed += self._squashfs_fields_malformed(
+                entry.path, entry.type, str(entry.size), rdev,
+                time.strftime('%Y-%m-%d', mtime),
+                time.strftime('%H:%M', mtime))
+        return (errors, malformed)
+
+    def _check_squashfs_lls(self, pkgname, snap_type):
+        '''Check the files in the snap using the output of unsquashfs -lls,
+           returning the errors and malformed lines. Returns None if
+           unsquashfs failed.'''
+        (rc, out) = self._get_squashfs_metadata('lls')
         if rc != 0:
             t = 'error'
             n = self._get_check_name('squashfs_files_unsquash')
             s = 'unsquashfs -lls <snap> failed'
             self._add_result(t, n, s)
-            return
+            return None
 
         in_header = True
         malformed = []
         errors = []
 
         fname_pat = re.compile(r'.* squashfs-root')
-        date_pat = re.compile(r'^\d\d\d\d-\d\d-\d\d$')
-        time_pat = re.compile(r'^\d\d:\d\d$')
         mknod_pat_full = re.compile(r'.,.')
         count = 0
 
@@ -277,47 +409,20 @@ class SnapReviewSecurity(SnapReview):
                 continue
 
             fname = fname_pat.sub('.', line)
-            ftype = tmp[0][0]
-
-            # Also see 'info ls', but we list only the Linux ones
             ftype = line[0]
-            if ftype not in ['b', 'c', 'd', 'l', 'p', 's', '-']:
-                errors.append("unknown type '%s' for entry '%s'" % (ftype,
-                                                                    fname))
-                continue
 
             # verify mode
             mode = tmp[0][1:]
-            if len(mode) != 9:
+            if ftype in ['b', 'c', 'd', 'l', 'p', 's', '-'] and \
+                    len(mode) != 9:
                 malformed.append("mode '%s' malformed for '%s'" % (mode,
                                                                    fname))
                 continue
-            if ftype == 'd' or ftype == '-':
-                perms = ['r', 'w', 'x', '-']
-                if ftype == 'd':  # allow sticky directories for stage-packages
-                    perms.append('t')
-                if not _check_allowed_perms(mode, perms):
-                    if pkgname not in sec_mode_overrides or \
-                        fname not in sec_mode_overrides[pkgname] or \
-                            sec_mode_overrides[pkgname][fname] != mode:
-                        errors.append("unusual mode '%s' for entry '%s'" %
-                                      (mode, fname))
-                        continue
-                # No point checking for world-writable, the squashfs is
-                # readonly
-                # if mode[-2] != '-':
-                #     errors.append("'%s' is world-writable" % fn)
-                #     continue
-            elif ftype == 'l':
-                if mode != 'rwxrwxrwx':
-                    errors.append("unusual mode '%s' for symlink '%s'" %
-                                  (mode, fname))
-                    continue
-            else:
-                if snap_type != 'os':
-                    errors.append("file type '%s' not allowed (%s)" % (ftype,
-                                                                       fname))
-                    continue
+            err = self._squashfs_mode_error(pkgname, snap_type, fname, ftype,
+                                            mode)
+            if err is not None:
+                errors.append(err)
+                continue
 
             # verify user and group
             if '/' not in tmp[1]:
@@ -325,57 +430,27 @@ class SnapReviewSecurity(SnapReview):
                                  (tmp[1], fname))
                 continue
             (user, group) = tmp[1].split('/')
-            # we enforce 'root/root'
-            if snap_type != 'os' and (user != 'root' or group != 'root'):
-                errors.append("unusual user/group '%s' for '%s'" % (tmp[1],
-                                                                    fname))
+            err = self._squashfs_owner_error(snap_type, fname, user, group)
+            if err is not None:
+                errors.append(err)
                 continue
 
             date_idx = 3
             time_idx = 4
+            rdev = None
             if ftype == 'b' or ftype == 'c':
                 # Account for unsquashfs -lls doing:
                 # crw-rw-rw- root/root             1,  8 2016-08-09 ...
                 # crw-rw---- root/root            10,141 2016-08-09 ...
 
                 if mknod_pat_full.search(tmp[2]):
-                    (major, minor) = tmp[2].split(',')
+                    rdev = tuple(tmp[2].split(','))
                 else:
                     date_idx = 4
                     time_idx = 5
-                    major = tmp[2][:-1]
-                    minor = tmp[3]
-
-                try:
-                    int(major)
-                except:
-                    malformed.append("major '%s' malformed for '%s'" %
-                                     (major, fname))
-                try:
-                    int(minor)
-                except:
-                    malformed.append("minor '%s' malformed for '%s'" %
-                                     (minor, fname))
-            else:
-                size = tmp[2]
-                try:
-                    int(size)
-                except:
-                    malformed.append("size '%s' malformed for '%s'" % (size,
-                                                                       fname))
-                    continue
-
-            date = tmp[date_idx]
-            if not date_pat.search(date):
-                malformed.append("date '%s' malformed for '%s'" % (date,
-                                                                   fname))
-                continue
-
-            time = tmp[time_idx]
-            if not time_pat.search(time):
-                malformed.append("time '%s' malformed for '%s'" % (time,
-                                                                   fname))
-                continue
+                    rdev = (tmp[2][:-1], tmp[3])
+            malformed += self._squashfs_fields_malformed(
+                fname, ftype, tmp[2], rdev, tmp[date_idx], tmp[time_idx])
 
         if count < 4:
             t = 'error'
@@ -383,6 +458,32 @@ class SnapReviewSecurity(SnapReview):
             s = "unsquashfs -lls ouput too short"
             self._add_result(t, n, s)
 
+        return (errors, malformed)
+
+    def check_squashfs_files(self):
+        '''Check squashfs files'''
+        if not self.is_snap2:
+            return
+
+        pkgname = self.snap_yaml['name']
+
+        snap_type = 'app'
+        if 'type' in self.snap_yaml:
+            snap_type = self.snap_yaml['type']
+
+        # Read the metadata directly from the image if possible, otherwise
+        # fall back to parsing unsquashfs -lls
+        entries = self._get_squashfs_entries()
+        if entries is not None:
+            (errors, malformed) = self._check_squashfs_entries(entries,
+                                                               pkgname,
+                                                               snap_type)
+        else:
+            res = self._check_squashfs_lls(pkgname, snap_type)
+            if res is None:
+                return
+            (errors, malformed) = res
+
         if len(malformed) > 0:
             t = 'error'
             n = self._get_check_name('squashfs_files_malformed_line')
@@ -20,8 +20,11 @@ from clickreviews.sr_common import SnapReview
 
 class SnapReviewSkeleton(SnapReview):
     '''This class represents click lint reviews'''
-    def __init__(self, fn, overrides=None):
-        SnapReview.__init__(self, fn, "skeleton-snap-v2", overrides=overrides)
+    review_type = "skeleton-snap-v2"
+
+    def __init__(self, fn, overrides=None, context=None):
+        SnapReview.__init__(self, fn, self.review_type, overrides=overrides,
+                            context=context)
 
     def check_foo(self):
         '''Check foo'''
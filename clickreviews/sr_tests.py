@@ -95,7 +95,6 @@ def create_patches():
         'clickreviews.sr_common.SnapReview._path_join',
         _path_join))
     patches.append(patch('clickreviews.common.unpack_pkg', _mock_func))
-    patches.append(patch('clickreviews.common.raw_unpack_pkg', _mock_func))
     patches.append(patch('clickreviews.common.detect_package',
                    _detect_package))
     patches.append(patch('clickreviews.sr_common.SnapReview._list_all_files',
@@ -0,0 +1,100 @@
+'''test_apparmor_policy.py: tests for the apparmor_policy module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+
+from clickreviews import apparmor_policy
+
+import json
+
+POLICY = {
+    'ubuntu': {
+        '1.3': {
+            'templates': {
+                'common': ['default', 'ubuntu-sdk'],
+                'reserved': ['unconfined'],
+            },
+            'policy_groups': {
+                'common': ['networking', 'audio', 'vendor/camera'],
+                'reserved': ['debug', 'audio'],
+            },
+        },
+        '15.10': {},
+        '1.2': {
+            'templates': {'common': ['default']},
+            'policy_groups': {'common': ['networking']},
+        },
+    },
+}
+
+
+class ApparmorPolicyTestCase(TestCase):
+    """Tests for the apparmor_policy module."""
+    def _index(self):
+        # the indexes are stored as json
+        indexes = apparmor_policy.index_policy(POLICY)
+        return apparmor_policy.PolicyIndex(json.loads(json.dumps(
+            indexes, sort_keys=True)))
+
+    def test_versions(self):
+        '''Test PolicyIndex() versions'''
+        index = self._index()
+        self.assertTrue(index.has_vendor('ubuntu'))
+        self.assertFalse(index.has_vendor('ubuntu-core'))
+        self.assertEqual(index.versions('ubuntu'), ['1.2', '1.3', '15.10'])
+        self.assertTrue(index.has_version('ubuntu', '1.3'))
+        self.assertTrue(index.has_version('ubuntu', 1.3))
+        self.assertFalse(index.has_version('ubuntu', '1.4'))
+        self.assertFalse(index.has_version('ubuntu-core', '1.3'))
+
+        index.add_version('ubuntu', '1.10')
+        index.add_version('ubuntu-core', 15.04)
+        self.assertEqual(index.versions('ubuntu'),
+                         ['1.10', '1.2', '1.3', '15.10'])
+        self.assertEqual(index.versions('ubuntu-core'), ['15.04'])
+        self.assertEqual(index.names('ubuntu-core', '15.04', 'templates'), [])
+
+    def test_names(self):
+        '''Test PolicyIndex() names and types'''
+        index = self._index()
+        self.assertEqual(index.names('ubuntu', '1.3', 'policy_groups'),
+                         ['audio', 'audio', 'debug', 'networking',
+                          'vendor/camera'])
+        self.assertEqual(index.names('ubuntu', '1.3', 'templates',
+                                     'reserved'), ['unconfined'])
+        self.assertEqual(index.names('ubuntu', '1.3', 'templates', 'nope'),
+                         [])
+        self.assertEqual(index.names('ubuntu', '15.10', 'templates'), [])
+        self.assertEqual(index.names('ubuntu', '1.4', 'templates'), [])
+
+        # the first type listing a name is its type
+        self.assertEqual(index.get_type('ubuntu', '1.3', 'policy_groups',
+                                        'audio'), 'common')
+        self.assertEqual(index.get_type('ubuntu', '1.3', 'policy_groups',
+                                        'debug'), 'reserved')
+        self.assertIsNone(index.get_type('ubuntu', '1.2', 'policy_groups',
+                                         'debug'))
+        self.assertTrue(index.has_name('ubuntu', '1.3', 'templates',
+                                       'ubuntu-sdk'))
+        self.assertFalse(index.has_name('ubuntu', '1.3', 'templates',
+                                        'networking'))
+
+        self.assertTrue(index.has_basename('ubuntu', '1.3', 'policy_groups',
+                                           'camera'))
+        self.assertFalse(index.has_basename('ubuntu', '1.2',
+                                            'policy_groups', 'camera'))
+        self.assertFalse(index.has_basename('ubuntu', '1.4',
+                                            'policy_groups', 'camera'))
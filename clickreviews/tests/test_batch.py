@@ -0,0 +1,117 @@
+'''test_batch.py: tests for the batch module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from clickreviews import batch, report_cache
+from clickreviews.common import cleanup_unpack
+from clickreviews.tests import utils
+
+import os
+import shutil
+import tempfile
+
+
+class BatchTestCase(TestCase):
+    """Tests for the batch module (without mocks)."""
+    def setUp(self):
+        self.addCleanup(cleanup_unpack)
+        super().setUp()
+
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def test_find_packages_dir(self):
+        '''Test find_packages() with a directory'''
+        output_dir = self.mkdtemp()
+        package = utils.make_click(output_dir=output_dir)
+        with open(os.path.join(output_dir, 'README'), 'w') as f:
+            f.write('not a package\n')
+        self.assertEqual(batch.find_packages(output_dir), [package])
+
+    def test_find_packages_list(self):
+        '''Test find_packages() with a list file'''
+        output_dir = self.mkdtemp()
+        fn = os.path.join(output_dir, 'list')
+        with open(fn, 'w') as f:
+            f.write('# comment\n/tmp/foo.snap\n\n  /tmp/bar.click \n')
+        self.assertEqual(batch.find_packages(fn),
+                         ['/tmp/foo.snap', '/tmp/bar.click'])
+
+    def test_review_package(self):
+        '''Test review_package()'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        report = batch.review_package(package)
+        self.assertEqual(report['filename'], package)
+        self.assertNotIn('runtime_errors', report)
+        self.assertIn('click,snap.v1_lint', report['results'])
+        self.assertEqual(report['rc'],
+                         batch.review_rc(report['results'], []))
+
+    def test_review_package_runtime_error(self):
+        '''Test review_package() with a broken package'''
+        output_dir = self.mkdtemp()
+        package = os.path.join(output_dir, 'broken.snap')
+        with open(package, 'w') as f:
+            f.write('garbage')
+        report = batch.review_package(package)
+        self.assertEqual(report['rc'], 1)
+        self.assertEqual(report['results'], {})
+        self.assertEqual(len(report['runtime_errors']), 1)
+
+    def test_review_package_cache(self):
+        '''Test review_package() with a ReportCache'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        cache = report_cache.ReportCache(cache_dir=self.mkdtemp())
+        expected = batch.review_package(package, cache=cache)
+        key = cache.key(package)
+        self.assertEqual(cache.get(key), expected['results'])
+
+        with patch('clickreviews.common.PackageContext') as mock_context:
+            report = batch.review_package(package, cache=cache)
+            self.assertFalse(mock_context.called)
+        self.assertEqual(report, expected)
+
+        # different overrides are reviewed again
+        overrides = {'snap_allow_classic': True}
+        self.assertIsNone(cache.get(cache.key(package, overrides)))
+        batch.review_package(package, overrides, cache=cache)
+        self.assertIsNotNone(cache.get(cache.key(package, overrides)))
+
+    def test_review_packages_jobs(self):
+        '''Test review_packages() in parallel matches sequential'''
+        output_dir = self.mkdtemp()
+        packages = [utils.make_click(name='test-%d' % i,
+                                     output_dir=output_dir)
+                    for i in range(3)]
+        expected = list(batch.review_packages(packages))
+        reports = list(batch.review_packages(packages, jobs=2))
+        self.assertEqual([r['filename'] for r in reports], packages)
+        self.assertEqual(reports, expected)
+
+    def test_review_rc(self):
+        '''Test review_rc()'''
+        clean = {'error': {}, 'warn': {}, 'info': {'a': {}}}
+        warn = {'error': {}, 'warn': {'a': {}}, 'info': {}}
+        error = {'error': {'a': {}}, 'warn': {}, 'info': {}}
+        self.assertEqual(batch.review_rc({'s': clean}, []), 0)
+        self.assertEqual(batch.review_rc({'s': clean, 't': warn}, []), 3)
+        self.assertEqual(batch.review_rc({'s': error, 't': warn}, []), 2)
+        self.assertEqual(batch.review_rc({'s': clean}, ['oops']), 1)
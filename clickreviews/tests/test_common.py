@@ -0,0 +1,563 @@
+'''test_common.py: tests for the common module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from clickreviews import common
+from clickreviews.common import cleanup_unpack, PackageContext
+from clickreviews.cr_desktop import ClickReviewDesktop
+from clickreviews.cr_lint import ClickReviewLint
+from clickreviews.cr_security import ClickReviewSecurity
+from clickreviews.tests import utils
+
+import os
+import shutil
+import tempfile
+
+
+class PackageContextTestCase(TestCase):
+    """Tests for PackageContext (without mocks)."""
+    def setUp(self):
+        self.addCleanup(cleanup_unpack)
+        super().setUp()
+
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def test_context(self):
+        '''Test PackageContext()'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        with PackageContext(package) as context:
+            self.assertTrue(os.path.isdir(context.unpack_dir))
+            self.assertEqual(context.pkgfmt, ("click", 1))
+            self.assertIn(os.path.join(context.unpack_dir, "DEBIAN/control"),
+                          context.pkg_files)
+            unpack_dir = context.unpack_dir
+        self.assertFalse(os.path.exists(unpack_dir))
+
+    def test_context_shared_by_reviews(self):
+        '''Test PackageContext() only unpacks once for several reviews'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        with PackageContext(package) as context:
+            with patch('clickreviews.common.unpack_pkg') as mock_unpack, \
+                    patch('clickreviews.common.detect_package') as \
+                    mock_detect:
+                lint = ClickReviewLint(package, context=context)
+                security = ClickReviewSecurity(package, context=context)
+                self.assertFalse(mock_unpack.called)
+                self.assertFalse(mock_detect.called)
+
+            self.assertEqual(lint.unpack_dir, context.unpack_dir)
+            self.assertEqual(security.unpack_dir, context.unpack_dir)
+            self.assertEqual(lint.pkg_files, security.pkg_files)
+            self.assertIs(lint.mime, security.mime)
+            self.assertIsNone(common.UNPACK_DIR)
+
+    def test_context_get_cached(self):
+        '''Test PackageContext.get_cached()'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {'foo': ['bar']}
+
+        with PackageContext(package) as context:
+            first = context.get_cached('test', loader)
+            first['foo'].append('baz')
+            second = context.get_cached('test', loader)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second, {'foo': ['bar']})
+
+    def test_context_reviews_match(self):
+        '''Test reviews with and without PackageContext() agree'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        c = ClickReviewLint(package)
+        c.do_checks()
+        expected = c.click_report
+        cleanup_unpack()
+
+        with PackageContext(package) as context:
+            c = ClickReviewLint(package, context=context)
+            c.do_checks()
+            self.assertEqual(c.click_report, expected)
+
+    def test_context_without_unpack(self):
+        '''Test PackageContext(unpack=False)'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        with PackageContext(package) as context:
+            c = ClickReviewSecurity(package, context=context)
+            c.do_checks()
+            expected = c.click_report
+
+        with patch('clickreviews.common.unpack_pkg') as mock_unpack:
+            with PackageContext(package, unpack=False) as context:
+                self.assertEqual(context.pkgfmt, ("click", 1))
+                self.assertIn(os.path.join(package, "DEBIAN/control"),
+                              context.pkg_files)
+                c = ClickReviewSecurity(package, context=context)
+                c.do_checks()
+                self.assertEqual(c.click_report, expected)
+                # lint reviews the files on disk
+                self.assertRaises(SystemExit, ClickReviewLint, package,
+                                  context=context)
+            self.assertFalse(mock_unpack.called)
+
+    def test_profile(self):
+        '''Test do_checks() with PROFILE'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        keys = ['bytes_read', 'cpu', 'subprocesses', 'wall']
+        with patch('clickreviews.common.PROFILE', True):
+            with PackageContext(package) as context:
+                c = ClickReviewLint(package, context=context)
+                c.do_checks()
+        report = c.click_report
+        profile = report.pop('profile')
+        self.assertEqual(sorted(profile.keys()),
+                         ['checks', 'init', 'package'])
+        for phase in ['unpack', 'detect', 'inventory']:
+            self.assertEqual(sorted(profile['package'][phase].keys()), keys)
+        self.assertIn('check_control', profile['checks'])
+        for delta in profile['checks'].values():
+            self.assertEqual(sorted(delta.keys()), keys)
+            self.assertGreaterEqual(delta['wall'], 0)
+
+        # the report is otherwise the same
+        c = ClickReviewLint(package)
+        c.do_checks()
+        self.assertEqual(c.click_report, report)
+
+    def test_profile_counters(self):
+        '''Test profile_delta() counts subprocesses'''
+        start = common.profile_counters()
+        common.cmd(['true'])
+        common.cmd(['true'])
+        delta = common.profile_delta(start)
+        self.assertEqual(delta['subprocesses'], 2)
+        self.assertGreaterEqual(delta['wall'], 0)
+
+
+class HashFilesTestCase(TestCase):
+    """Tests for hash_file() and hash_files()."""
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def write_files(self):
+        tmp_dir = self.mkdtemp()
+        fns = []
+        for (i, size) in enumerate([0, 1, common.HASH_CHUNK_SIZE + 1]):
+            fn = os.path.join(tmp_dir, str(i))
+            with open(fn, 'wb') as f:
+                f.write(b'x' * size)
+            fns.append(fn)
+        return fns
+
+    def test_hash_file(self):
+        '''Test hash_file() matches sha512sum and md5sum'''
+        for fn in self.write_files():
+            for algorithm in ['sha512', 'md5']:
+                (rc, out) = common.cmd(['%ssum' % algorithm, fn])
+                self.assertEqual(common.hash_file(fn, algorithm),
+                                 out.split()[0])
+
+    def test_hash_file_unreadable(self):
+        '''Test hash_file() with missing files and directories'''
+        tmp_dir = self.mkdtemp()
+        self.assertIsNone(common.hash_file(tmp_dir, 'md5'))
+        self.assertIsNone(common.hash_file(os.path.join(tmp_dir, 'missing'),
+                                           'md5'))
+
+    def test_hash_files(self):
+        '''Test hash_files()'''
+        fns = self.write_files() + ['/nonexistent']
+        expected = dict((fn, common.hash_file(fn, 'sha512')) for fn in fns)
+        self.assertEqual(common.hash_files(fns, 'sha512'), expected)
+        self.assertEqual(common.hash_files(fns, 'sha512', jobs=1), expected)
+        self.assertEqual(common.hash_files(fns, 'sha512', jobs=4), expected)
+
+    def test_thread_map(self):
+        '''Test thread_map()'''
+        items = list(range(20)) + [3]
+        expected = dict((i, i * i) for i in range(20))
+        for jobs in [None, 1, 4]:
+            self.assertEqual(common.thread_map(lambda i: i * i, items, jobs),
+                             expected)
+
+
+class PackageInventoryTestCase(TestCase):
+    """Tests for PackageInventory."""
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def make_tree(self):
+        '''Create a directory tree with files, directories and symlinks'''
+        d = self.mkdtemp()
+        for rel in ['a.desktop', 'bin/foo', 'meta/gui/b.desktop',
+                    'meta/gui/icons/c.png', 'meta/guix/d.desktop',
+                    'usr/lib/libfoo.so.1']:
+            fn = os.path.join(d, rel)
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            with open(fn, 'w') as f:
+                f.write(rel)
+        os.symlink('libfoo.so.1', os.path.join(d, 'usr/lib/libfoo.so'))
+        os.symlink('/etc/passwd', os.path.join(d, 'bin/passwd'))
+        os.symlink('/nonexistent', os.path.join(d, 'bin/broken'))
+        os.symlink('/usr', os.path.join(d, 'usrlink'))
+        return d
+
+    def test_scan(self):
+        '''Test scan() lists the same files as os.walk()'''
+        d = self.make_tree()
+        expected = []
+        for root, dirnames, filenames in os.walk(d):
+            for f in filenames:
+                expected.append(os.path.join(root, f))
+        inventory = common.PackageInventory.scan(d)
+        self.assertEqual(inventory.paths(), expected)
+        self.assertEqual(common.list_all_files(d), expected)
+        for e in inventory:
+            self.assertEqual(e.relpath, os.path.relpath(e.path, d))
+            st = os.lstat(e.path)
+            self.assertEqual((e.st_mode, e.st_size), (st.st_mode, st.st_size))
+            self.assertEqual(e.realpath, os.path.realpath(e.path))
+        self.assertNotIn(os.path.join(d, 'usrlink'), inventory)
+
+    def test_lookups(self):
+        '''Test PackageInventory lookups'''
+        d = self.make_tree()
+        inventory = common.PackageInventory.scan(d)
+        self.assertIn(os.path.join(d, 'bin/foo'), inventory)
+        self.assertNotIn(os.path.join(d, 'bin'), inventory)
+        self.assertIsNone(inventory.get(os.path.join(d, 'nonexistent')))
+        self.assertEqual([e.relpath for e in inventory.with_basename('foo')],
+                         ['bin/foo'])
+        self.assertEqual(
+            sorted(e.relpath for e in inventory.with_extension('.desktop')),
+            ['a.desktop', 'meta/gui/b.desktop', 'meta/guix/d.desktop'])
+        # in os.walk() order, as checks report the first one found
+        self.assertEqual(
+            [e.path for e in inventory.with_extension('.desktop')],
+            [fn for fn in inventory.paths() if fn.endswith('.desktop')])
+        self.assertEqual([e.relpath for e in inventory.under('meta/gui')],
+                         ['meta/gui/b.desktop', 'meta/gui/icons/c.png'])
+        self.assertEqual([e.relpath for e in inventory.under('meta/gui/')],
+                         ['meta/gui/b.desktop', 'meta/gui/icons/c.png'])
+        self.assertEqual(inventory.under('nonexistent'), [])
+        self.assertEqual(
+            sorted((e.relpath, e.link_target) for e in inventory.symlinks()),
+            [('bin/broken', '/nonexistent'), ('bin/passwd', '/etc/passwd'),
+             ('usr/lib/libfoo.so', 'libfoo.so.1')])
+
+    def test_from_paths(self):
+        '''Test from_paths() with missing files and reusing entries'''
+        d = self.make_tree()
+        inventory = common.PackageInventory.scan(d)
+        paths = inventory.paths() + [os.path.join(d, 'missing')]
+        updated = common.PackageInventory.from_paths(d, paths, inventory)
+        self.assertEqual(updated.paths(), paths)
+        for e in inventory:
+            self.assertIs(updated.get(e.path), e)
+        missing = updated.get(os.path.join(d, 'missing'))
+        self.assertEqual(missing.relpath, 'missing')
+        self.assertFalse(missing.exists)
+        self.assertFalse(missing.is_symlink)
+
+    def test_find_external_symlinks(self):
+        '''Test find_external_symlinks()'''
+        d = self.make_tree()
+        inventory = common.PackageInventory.scan(d)
+        self.assertEqual(
+            sorted(common.find_external_symlinks(inventory, 'foo')),
+            ['bin/broken', 'bin/passwd'])
+
+
+class ClassifyFilesTestCase(TestCase):
+    """Tests for the libmagic file classification."""
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def test_file_mime(self):
+        '''Test file_mime() matches libmagic'''
+        d = self.mkdtemp()
+        fn = os.path.join(d, 'script')
+        with open(fn, 'w') as f:
+            f.write('#!/bin/sh\necho hello\n')
+        mime = common.load_mime()
+        self.assertEqual(common.file_mime(fn), mime.file(fn))
+        self.assertIsNone(common.file_mime(os.path.join(d, 'missing')))
+
+    def test_file_mime_memoized(self):
+        '''Test file_mime() classifies identical files once'''
+        d = self.mkdtemp()
+        fns = [os.path.join(d, name) for name in ['a', 'b']]
+        for fn in fns:
+            with open(fn, 'w') as f:
+                f.write('the same contents\n')
+        before = len(common._mime_cache)
+        self.assertEqual(common.file_mime(fns[0]), common.file_mime(fns[1]))
+        self.assertEqual(len(common._mime_cache), before + 1)
+
+    def test_file_mime_cache_size(self):
+        '''Test file_mime() keeps at most MIME_CACHE_SIZE results'''
+        d = self.mkdtemp()
+        fns = [os.path.join(d, name) for name in ['a', 'b', 'c']]
+        for fn in fns:
+            with open(fn, 'w') as f:
+                f.write(fn)
+        with patch('clickreviews.common.MIME_CACHE_SIZE', 2):
+            for fn in fns:
+                common.file_mime(fn)
+            self.assertEqual(len(common._mime_cache), 2)
+
+    def test_file_mime_preloaded(self):
+        '''Test file_mime() uses the handles loaded by load_mime()'''
+        d = self.mkdtemp()
+        fns = []
+        for i in range(8):
+            fns.append(os.path.join(d, str(i)))
+            with open(fns[-1], 'w') as f:
+                f.write('%s\n' % fns[-1])
+        common.load_mime(jobs=4)
+        inventory = common.PackageInventory.scan(d)
+        with patch('clickreviews.common.open_magic') as mock_open:
+            for i in range(2):
+                common._mime_cache.clear()
+                common.classify_files(inventory, jobs=4)
+            mock_open.assert_not_called()
+
+    def test_classify_files(self):
+        '''Test classify_files() only classifies regular files'''
+        d = self.mkdtemp()
+        for name in ['a.txt', 'b/c.txt']:
+            fn = os.path.join(d, name)
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            with open(fn, 'w') as f:
+                f.write(name)
+        os.symlink('a.txt', os.path.join(d, 'link'))
+        os.mkfifo(os.path.join(d, 'fifo'))
+        inventory = common.PackageInventory.scan(d)
+        mimes = common.classify_files(inventory)
+        self.assertEqual(sorted(mimes.keys()),
+                         [os.path.join(d, 'a.txt'),
+                          os.path.join(d, 'b/c.txt')])
+        for fn in mimes:
+            self.assertEqual(mimes[fn], common.file_mime(fn))
+
+    def test_file_description(self):
+        '''Test file_description() matches file -b'''
+        d = self.mkdtemp()
+        fn = os.path.join(d, 'script')
+        with open(fn, 'w') as f:
+            f.write('#!/bin/sh\necho hello\n')
+        (rc, out) = common.cmd(['file', '-b', fn])
+        self.assertEqual(rc, 0)
+        self.assertEqual(common.file_description(fn), out.strip())
+        self.assertIn('text', common.file_description(fn))
+        # the mime type of the same file is memoized separately
+        self.assertEqual(common.file_mime(fn), common.load_mime().file(fn))
+        self.assertIsNone(common.file_description(os.path.join(d,
+                                                               'missing')))
+
+
+class PackageBaselineTestCase(TestCase):
+    """Tests for PackageBaseline."""
+    def setUp(self):
+        self.addCleanup(cleanup_unpack)
+        super().setUp()
+
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def test_baseline(self):
+        '''Test PackageContext() only classifies files changed since the
+           baseline'''
+        new = utils.make_click(output_dir=self.mkdtemp(),
+                               extra_files=['bin/foo', '/bin/ls,bin/ls',
+                                            'bin/bar', 'bin/baz'])
+        baseline = common.PackageBaseline.from_package(new)
+        self.assertIn('bin/foo', baseline.files)
+        self.assertEqual(baseline.files['bin/ls']['target'], '/bin/ls')
+        # a previous revision without bin/bar and with older files
+        del baseline.files['bin/bar']
+        baseline.files['bin/baz']['mtime'] -= 1
+        baseline.files['DEBIAN/manifest']['size'] += 1
+
+        def relative(context, d):
+            return dict((os.path.relpath(fn, context.unpack_dir), v)
+                        for (fn, v) in d.items())
+
+        with PackageContext(new) as context:
+            expected = relative(context, context.file_mimes)
+
+        with PackageContext(new, baseline=baseline) as context:
+            changed = [os.path.relpath(fn, context.unpack_dir)
+                       for fn in context.changed]
+            self.assertIn('bin/bar', changed)
+            self.assertIn('bin/baz', changed)
+            self.assertIn('DEBIAN/manifest', changed)
+            self.assertNotIn('bin/foo', changed)
+            self.assertNotIn('bin/ls', changed)
+            with patch('clickreviews.common.file_mime',
+                       side_effect=common.file_mime) as mock_mime:
+                self.assertEqual(relative(context, context.file_mimes),
+                                 expected)
+            classified = [os.path.relpath(c[0][0], context.unpack_dir)
+                          for c in mock_mime.call_args_list]
+            self.assertEqual(sorted(classified), sorted(changed))
+
+    def test_save_load(self):
+        '''Test PackageBaseline.save() and load()'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        baseline = common.PackageBaseline.load(package)
+        fn = os.path.join(self.mkdtemp(), 'baseline.json')
+        baseline.save(fn)
+        self.assertEqual(common.PackageBaseline.load(fn).files,
+                         baseline.files)
+
+        with open(fn, 'w') as f:
+            f.write('{"format": 0}')
+        self.assertRaises(SystemExit, common.PackageBaseline.load, fn)
+
+
+class CheckSelectionTestCase(TestCase):
+    """Tests for CheckSelection and the checks it selects."""
+    def setUp(self):
+        self.addCleanup(cleanup_unpack)
+        super().setUp()
+
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def _check_names(self):
+        fn = os.path.join(os.path.dirname(__file__), '../../check-names.list')
+        with open(fn, 'r') as f:
+            return [line.split('|')[0] for line in f.read().splitlines()]
+
+    def test_selected(self):
+        '''Test CheckSelection.selected()'''
+        selection = common.CheckSelection(only=['lint-snap-v2:*',
+                                                'security:yaml_*'],
+                                          skip=['*:hooks*'])
+        self.assertTrue(selection.selected('lint-snap-v2:snap_type_valid'))
+        self.assertTrue(selection.selected('security:yaml_caps:app:extra'))
+        self.assertFalse(selection.selected('lint:snap_type_valid'))
+        self.assertFalse(selection.selected('lint-snap-v2:hooks_present'))
+        self.assertFalse(selection.selected('security:policy_vendor'))
+        # the app and extra parts aren't matched
+        self.assertFalse(selection.selected('security:policy_vendor:yaml_x'))
+
+        selection = common.CheckSelection(skip=['lint:*'])
+        self.assertTrue(selection.selected('desktop:validates'))
+        self.assertFalse(selection.selected('lint:hooks'))
+
+    def test_review_selected(self):
+        '''Test CheckSelection.review_selected() agrees with selected()'''
+        names = self._check_names()
+        review_types = set(name.split(':')[0] for name in names)
+        for (only, skip) in [(['declaration-snap-v2:*'], []),
+                             (['lint:*'], []),
+                             (['lint*'], []),
+                             (['*:hooks*'], []),
+                             (['security:yaml_?aps'], []),
+                             (['[ls]*:valid*'], []),
+                             ([], ['lint-snap-v2:*']),
+                             ([], ['*']),
+                             ([], ['lint:hooks'])]:
+            selection = common.CheckSelection(only, skip)
+            for review_type in review_types:
+                expected = [n for n in names
+                            if n.startswith(review_type + ':') and
+                            selection.selected(n)]
+                if expected:
+                    self.assertTrue(selection.review_selected(review_type),
+                                    (only, skip, review_type))
+
+        selection = common.CheckSelection(only=['declaration-snap-v2:*'])
+        self.assertTrue(selection.review_selected('declaration-snap-v2'))
+        self.assertFalse(selection.review_selected('lint-snap-v2'))
+        self.assertFalse(selection.review_selected('declaration'))
+        selection = common.CheckSelection(skip=['lint*'])
+        self.assertFalse(selection.review_selected('lint-snap-v2'))
+        self.assertTrue(selection.review_selected('desktop'))
+
+    def test_do_checks(self):
+        '''Test do_checks() only reports and runs the selected checks'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        name = 'lint:control_architecture_valid_contents'
+        selection = common.CheckSelection(only=[name])
+        with PackageContext(package) as context:
+            with patch('clickreviews.common.SELECTION', selection):
+                c = ClickReviewLint(package, context=context)
+                c.do_checks()
+        self.assertEqual(c.click_report['info'].keys(), set([name]))
+        self.assertEqual(c.click_report['warn'], {})
+        self.assertEqual(c.click_report['error'], {})
+
+    def test_requires(self):
+        '''Test the setup of unselected checks is skipped'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        selection = common.CheckSelection(only=['security:yaml_*'])
+        with PackageContext(package) as context:
+            with patch('clickreviews.common.SELECTION', selection), \
+                    patch.object(ClickReviewSecurity, '_load_aa_policy',
+                                 autospec=True) as mock_load:
+                c = ClickReviewSecurity(package, context=context)
+                c.do_checks()
+                self.assertFalse(mock_load.called)
+
+            with patch.object(ClickReviewSecurity, '_load_aa_policy',
+                              autospec=True,
+                              side_effect=ClickReviewSecurity._load_aa_policy
+                              ) as mock_load:
+                c = ClickReviewSecurity(package, context=context)
+                self.assertFalse(mock_load.called)
+                c.do_checks()
+                # once for all the checks which require it
+                self.assertEqual(mock_load.call_count, 1)
+
+    def test_requires_desktop(self):
+        '''Test the desktop files are only parsed for selected checks'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        for (only, calls) in [(['lint:*'], 0),
+                              (['desktop:Icon', 'desktop:Type'], 1)]:
+            selection = common.CheckSelection(only=only)
+            with PackageContext(package) as context:
+                with patch('clickreviews.common.SELECTION', selection), \
+                        patch.object(ClickReviewDesktop,
+                                     '_extract_desktop_entries',
+                                     autospec=True) as mock_extract:
+                    c = ClickReviewDesktop(package, context=context)
+                    c.do_checks()
+                    self.assertEqual(mock_extract.call_count, calls)
@@ -27,6 +27,7 @@ import clickreviews.cr_tests as cr_tests
 import os
 import shutil
 import stat
+import subprocess
 import tempfile
 
 
@@ -1933,6 +1934,33 @@ class TestClickReviewLint(cr_tests.TestClickReview):
         expected_counts = {'info': None, 'warn': 0, 'error': 1}
         self.check_results(r, expected_counts)
 
+    def test_check_snappy_hashes_archive_files_bad_sha512(self):
+        '''Test check_snappy_hashes() - bad sha512'''
+        self.set_test_pkgfmt("snap", "15.04")
+        c = ClickReviewLint(self.test_name)
+        yaml = self._create_hashes_yaml()
+        c.pkg_files = self._test_pkg_files
+        yaml['files'].append({'name': 'bin/bar',
+                              'size': yaml['files'][1]['size'],
+                              'mode': yaml['files'][1]['mode'],
+                              'sha512': 'deadbeef'})
+        yaml['files'].append({'name': 'bin/baz',
+                              'size': yaml['files'][1]['size'],
+                              'mode': yaml['files'][1]['mode'],
+                              'sha512': 'beefdead'})
+        self.set_test_hashes_yaml(yaml)
+        c.check_snappy_hashes()
+        r = c.click_report
+        expected_counts = {'info': None, 'warn': 0, 'error': 1}
+        self.check_results(r, expected_counts)
+        expected = dict()
+        expected['error'] = dict()
+        expected['error']['lint:sha512sums'] = {
+            "text": "found bad checksums: '%s' != '%s' for 'bin/bar', "
+                    "'%s' != '%s' for 'bin/baz'" % ('deadbeef', self.sha512,
+                                                    'beefdead', self.sha512)}
+        self.check_results(r, expected=expected)
+
     def test_check_snappy_hashes_extra(self):
         '''Test check_snappy_hashes() - extra'''
         self.set_test_pkgfmt("snap", "15.04")
@@ -2003,12 +2031,12 @@ class TestClickReviewLint(cr_tests.TestClickReview):
 class ClickReviewLintTestCase(TestCase):
     """Tests without mocks where they are not needed."""
     def setUp(self):
-        # XXX cleanup_unpack() is required because global variables
-        # UNPACK_DIR, RAW_UNPACK_DIR are initialised to None at module
-        # load time, but updated when a real (non-Mock) test runs, such as
-        # here. While, at the same time, two of the existing tests using
-        # mocks depend on both global vars being None. Ideally, those
-        # global vars should be refactored away.
+        # XXX cleanup_unpack() is required because the global variable
+        # UNPACK_DIR is initialised to None at module load time, but
+        # updated when a real (non-Mock) test runs, such as here. While, at
+        # the same time, two of the existing tests using mocks depend on
+        # the global var being None. Ideally, that global var should be
+        # refactored away.
         self.addCleanup(cleanup_unpack)
         super().setUp()
 
@@ -2027,3 +2055,54 @@ class ClickReviewLintTestCase(TestCase):
 
         errors = list(c.click_report['error'].keys())
         self.assertEqual(errors, ['lint:dot_click'])
+
+    def test_check_md5sums(self):
+        '''Test check_md5sums()'''
+        package = utils.make_click(extra_files=['foo', 'a b/c'],
+                                   output_dir=self.mkdtemp())
+        c = ClickReviewLint(package)
+        # DEBIAN/md5sums as click build would write it
+        sums = subprocess.check_output(['md5sum', 'foo', 'a b/c'],
+                                       cwd=c.unpack_dir)
+        with open(c.control_files['md5sums'], 'wb') as f:
+            f.write(sums)
+
+        c.check_md5sums()
+        report = c.click_report
+        self.assertEqual(len(report['error']), 0)
+        self.assertEqual(len(report['info']), 1)
+
+    def test_check_md5sums_bad(self):
+        '''Test check_md5sums() - bad and missing files'''
+        package = utils.make_click(extra_files=['foo'],
+                                   output_dir=self.mkdtemp())
+        c = ClickReviewLint(package)
+        with open(c.control_files['md5sums'], 'w') as f:
+            f.write('%s  foo\n' % ('0' * 32))
+            f.write('%s  missing\n' % ('0' * 32))
+
+        c.check_md5sums()
+        errors = c.click_report['error']
+        self.assertEqual(list(errors.keys()), ['lint:md5sums'])
+        self.assertEqual(errors['lint:md5sums']['text'],
+                         'found bad checksums: foo, missing')
+
+    def test_check_contents_for_hardcoded_paths(self):
+        '''Test check_contents_for_hardcoded_paths() - the files which
+           'file' describes as text'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        c = ClickReviewLint(package)
+        contents = {'run': '#!/bin/sh\nexec /opt/click.ubuntu.com/foo\n',
+                    'data.bin': '\0\1\2/opt/click.ubuntu.com/foo\0\3'}
+        for (name, data) in contents.items():
+            fn = os.path.join(c.unpack_dir, name)
+            with open(fn, 'w') as f:
+                f.write(data)
+            c.pkg_files.append(fn)
+
+        c.check_contents_for_hardcoded_paths()
+        errors = c.click_report['error']
+        self.assertEqual(list(errors.keys()), ['lint:hardcoded_paths'])
+        self.assertEqual(errors['lint:hardcoded_paths']['text'],
+                         "Hardcoded path '/opt/click.ubuntu.com/' found in "
+                         "'%s'." % os.path.join(c.unpack_dir, 'run'))
@@ -0,0 +1,122 @@
+'''test_daemon.py: tests for the daemon module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from clickreviews import batch, daemon
+from clickreviews.common import cleanup_unpack
+from clickreviews.tests import utils
+
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import types
+
+
+def _die(*args):
+    '''A review which kills its worker'''
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+class ReviewDaemonTestCase(TestCase):
+    """Tests for the review daemon (without mocks)."""
+    def setUp(self):
+        self.addCleanup(cleanup_unpack)
+        super().setUp()
+
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def start_server(self, **kwargs):
+        """Start a daemon on a unix socket, returning a connection to it."""
+        review_daemon = daemon.ReviewDaemon(**kwargs)
+        path = os.path.join(self.mkdtemp(), 'socket')
+        server = daemon.ReviewUnixHTTPServer(path, review_daemon)
+        thread = threading.Thread(target=daemon.serve, args=(server,))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+
+        conn = daemon.UnixHTTPConnection(path, timeout=60)
+        self.addCleanup(conn.close)
+        return (review_daemon, conn)
+
+    def post(self, conn, body):
+        conn.request('POST', '/review', body=body)
+        resp = conn.getresponse()
+        return (resp.status, json.loads(resp.read().decode('utf-8')))
+
+    def test_review(self):
+        '''Test reviews match click-review'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        expected = batch.review_package(package)
+        (review_daemon, conn) = self.start_server()
+
+        (rc, results) = daemon.request_review(conn, package)
+        self.assertEqual(rc, expected['rc'])
+        self.assertEqual(results, expected['results'])
+
+        # again after restarting the workers
+        review_daemon.reload()
+        (rc, results) = daemon.request_review(conn, package)
+        self.assertEqual(results, expected['results'])
+
+    def test_review_busy(self):
+        '''Test reviews are refused when too many are pending'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        (review_daemon, conn) = self.start_server(max_pending=0)
+        (status, body) = self.post(conn, json.dumps({'filename': package}))
+        self.assertEqual(status, 503)
+
+    def test_review_timeout(self):
+        '''Test reviews time out when their worker dies'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        (review_daemon, conn) = self.start_server(timeout=2)
+        pool = review_daemon.pool
+        # not clickreviews.batch itself, the new workers are forked with it
+        with patch('clickreviews.daemon.batch',
+                   types.SimpleNamespace(review_package=_die)):
+            (status, body) = self.post(conn,
+                                       json.dumps({'filename': package}))
+        self.assertEqual(status, 504)
+        self.assertIn('error', body)
+        self.assertIsNot(review_daemon.pool, pool)
+
+        # the new workers review as usual
+        (rc, results) = daemon.request_review(conn, package)
+        self.assertEqual(results, batch.review_package(package)['results'])
+
+    def test_review_bad_requests(self):
+        '''Test bad requests'''
+        (review_daemon, conn) = self.start_server()
+        for body in ['garbage', '[]', '{}',
+                     json.dumps({'filename': '/nonexistent'}),
+                     json.dumps({'filename': __file__, 'overrides': []})]:
+            (status, resp) = self.post(conn, body)
+            self.assertEqual(status, 400, body)
+            self.assertIn('error', resp)
+
+        conn.request('POST', '/nonexistent', body='{}')
+        resp = conn.getresponse()
+        resp.read()
+        self.assertEqual(resp.status, 404)
@@ -0,0 +1,223 @@
+'''test_deb.py: tests for the deb module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+
+from clickreviews import deb
+from clickreviews.common import cmd
+from clickreviews.tests import utils
+
+import hashlib
+import io
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+
+
+def make_tar(members):
+    '''Return a tar.gz with the given (TarInfo, data) members'''
+    f = io.BytesIO()
+    with tarfile.open(fileobj=f, mode='w:gz') as tar:
+        for (info, data) in members:
+            if data is not None:
+                info.size = len(data)
+                data = io.BytesIO(data)
+            tar.addfile(info, data)
+    return f.getvalue()
+
+
+def make_ar(members):
+    '''Return an ar archive with the given (name, data) members'''
+    out = deb.AR_MAGIC
+    for (name, data) in members:
+        header = '%-16s%-12d%-6d%-6d%-8o%-10d`\n' % (name + '/', 0, 0, 0,
+                                                     0o100644, len(data))
+        out += header.encode()
+        out += data
+        if len(data) % 2:
+            out += b'\n'
+    return out
+
+
+class DebTestCase(TestCase):
+    """Tests for the deb module."""
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def _tree(self, d):
+        '''Return what dpkg-deb -R preserves of the files under d'''
+        files = []
+        for root, dirnames, filenames in os.walk(d):
+            for name in dirnames + filenames:
+                fn = os.path.join(root, name)
+                st = os.lstat(fn)
+                link = os.readlink(fn) if os.path.islink(fn) else None
+                size = 0 if stat.S_ISDIR(st.st_mode) else st.st_size
+                files.append((os.path.relpath(fn, d),
+                              stat.filemode(st.st_mode), size, link))
+        return sorted(files)
+
+    def _make_deb(self, data_members, control_members=None):
+        if control_members is None:
+            info = tarfile.TarInfo('./control')
+            control_members = [(info, b'Package: test\n')]
+        fn = os.path.join(self.mkdtemp(), 'test.click')
+        with open(fn, 'wb') as f:
+            f.write(make_ar([('debian-binary', b'2.0\n'),
+                             ('control.tar.gz', make_tar(control_members)),
+                             ('data.tar.gz', make_tar(data_members))]))
+        return fn
+
+    def test_extract(self):
+        '''Test extract() matches dpkg-deb -R'''
+        package = utils.make_click(output_dir=self.mkdtemp(),
+                                   extra_files=['some/dir/', 'bin/foo',
+                                                '/bin/ls,bin/ls',
+                                                'bin/foo,bin/bar'])
+        expected_dir = os.path.join(self.mkdtemp(), 'expected')
+        (rc, out) = cmd(['dpkg-deb', '-R', package, expected_dir])
+        self.assertEqual(rc, 0)
+
+        d = self.mkdtemp()
+        with deb.DebFile(package) as debfile:
+            digests = debfile.extract(d)
+        self.assertEqual(self._tree(d), self._tree(expected_dir))
+
+        ar_dir = self.mkdtemp()
+        (rc, out) = cmd(['ar', 'x', package, '--output', ar_dir])
+        self.assertEqual(rc, 0)
+        self.assertEqual(sorted(digests.keys()), sorted(os.listdir(ar_dir)))
+        for name in digests:
+            with open(os.path.join(ar_dir, name), 'rb') as f:
+                expected = hashlib.sha512(f.read()).hexdigest()
+            self.assertEqual(digests[name], expected)
+            self.assertEqual(deb.member_hash(package, name), expected)
+
+    def test_open_member(self):
+        '''Test open_member()'''
+        fn = self._make_deb([(tarfile.TarInfo('./foo'), b'foo')])
+        with deb.DebFile(fn) as debfile:
+            self.assertEqual([m.name for m in debfile.members],
+                             ['debian-binary', 'control.tar.gz',
+                              'data.tar.gz'])
+            with debfile.open_member('debian-binary') as f:
+                self.assertEqual(f.read(), b'2.0\n')
+            with debfile.open_member('data.tar.gz') as f:
+                with tarfile.open(fileobj=f, mode='r|gz') as tar:
+                    member = tar.next()
+                    self.assertEqual(member.name, './foo')
+                    self.assertEqual(tar.extractfile(member).read(), b'foo')
+            self.assertRaises(deb.DebException, debfile.open_member,
+                              'nonexistent')
+
+    def test_open_tar(self):
+        '''Test open_tar() uncompresses the member'''
+        info = tarfile.TarInfo('./foo')
+        info.size = 3
+        for comp in ['', 'gz', 'bz2', 'xz']:
+            f = io.BytesIO()
+            with tarfile.open(fileobj=f, mode='w:%s' % comp) as tar:
+                tar.addfile(info, io.BytesIO(b'foo'))
+            name = 'data.tar.%s' % comp if comp else 'data.tar'
+            fn = os.path.join(self.mkdtemp(), 'test.click')
+            with open(fn, 'wb') as out:
+                out.write(make_ar([('debian-binary', b'2.0\n'),
+                                   (name, f.getvalue())]))
+            with deb.DebFile(fn) as debfile:
+                with debfile.open_tar(name) as tar_f:
+                    with tarfile.open(fileobj=tar_f, mode='r|') as tar:
+                        member = tar.next()
+                        self.assertEqual(tar.extractfile(member).read(),
+                                         b'foo')
+
+    def test_member_hash(self):
+        '''Test member_hash() without extracting'''
+        fn = self._make_deb([(tarfile.TarInfo('./foo'), b'foo')])
+        self.assertEqual(deb.member_hash(fn, 'debian-binary', 'md5'),
+                         hashlib.md5(b'2.0\n').hexdigest())
+
+    def test_not_deb(self):
+        '''Test DebFile() - not a deb'''
+        fn = os.path.join(self.mkdtemp(), 'test.click')
+        for data in [b'', b'garbage', make_ar([('foo', b'bar')]),
+                     deb.AR_MAGIC + b'x' * 100]:
+            with open(fn, 'wb') as f:
+                f.write(data)
+            self.assertRaises(deb.DebException, deb.DebFile, fn)
+
+    def test_extract_outside(self):
+        '''Test extract() - paths outside of the package'''
+        link = tarfile.TarInfo('./link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = '/tmp'
+        hardlink = tarfile.TarInfo('./hardlink')
+        hardlink.type = tarfile.LNKTYPE
+        hardlink.linkname = '../etc/passwd'
+        for members in [[(tarfile.TarInfo('../evil'), b'')],
+                        [(tarfile.TarInfo('/evil'), b'')],
+                        [(link, None), (tarfile.TarInfo('./link/evil'), b'')],
+                        [(hardlink, None)]]:
+            fn = self._make_deb(members)
+            d = self.mkdtemp()
+            with deb.DebFile(fn) as debfile:
+                self.assertRaises(deb.DebException, debfile.extract, d)
+
+    def test_extract_over_symlink(self):
+        '''Test extract() - a member replaces a symlink to outside of the
+           package instead of writing through it'''
+        victim = os.path.join(self.mkdtemp(), 'victim')
+        with open(victim, 'w') as f:
+            f.write('victim')
+        link = tarfile.TarInfo('./foo')
+        link.type = tarfile.SYMTYPE
+        link.linkname = victim
+        fn = self._make_deb([(link, None),
+                             (tarfile.TarInfo('./foo'), b'evil')])
+        d = self.mkdtemp()
+        with deb.DebFile(fn) as debfile:
+            debfile.extract(d)
+        with open(victim) as f:
+            self.assertEqual(f.read(), 'victim')
+        self.assertFalse(os.path.islink(os.path.join(d, 'foo')))
+        with open(os.path.join(d, 'foo')) as f:
+            self.assertEqual(f.read(), 'evil')
+
+    def test_extract_hardlink_through_symlink(self):
+        '''Test extract() - hardlinks through symlinks to outside of the
+           package'''
+        victim_dir = self.mkdtemp()
+        victim = os.path.join(victim_dir, 'victim')
+        with open(victim, 'w') as f:
+            f.write('victim')
+        link = tarfile.TarInfo('./link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = victim_dir
+        hardlink = tarfile.TarInfo('./hardlink')
+        hardlink.type = tarfile.LNKTYPE
+        hardlink.linkname = './link/victim'
+        fn = self._make_deb([(link, None), (hardlink, None),
+                             (tarfile.TarInfo('./hardlink'), b'evil')])
+        d = self.mkdtemp()
+        with deb.DebFile(fn) as debfile:
+            self.assertRaises(deb.DebException, debfile.extract, d)
+        self.assertFalse(os.path.exists(os.path.join(d, 'hardlink')))
+        with open(victim) as f:
+            self.assertEqual(f.read(), 'victim')
@@ -0,0 +1,250 @@
+'''test_declaration.py: tests for the declaration module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from clickreviews import declaration
+
+import re
+
+
+class DeclarationTestCase(TestCase):
+    """Tests for the declaration module."""
+    def test_regex_matcher(self):
+        '''Test RegexMatcher() matches as re.search(^(...)$) did'''
+        for (against, val) in [('foo', 'foo'), ('foo', 'foo\n'),
+                               ('foo', 'foobar'), ('foo', 'xfoo'),
+                               ('a|b', 'a'), ('a|b', 'ab'),
+                               ('(a)\\2', 'aa'), ('(a)\\2', 'a'),
+                               ('.*', ''), ('a\n', 'a\n'), ('a$', 'a\n'),
+                               ('^$', '')]:
+            expected = re.search(r'^(%s)$' % against, val) is not None
+            matcher = declaration.compile_matcher(against)
+            self.assertIsInstance(matcher, declaration.RegexMatcher)
+            self.assertEqual(matcher.matches(val), expected,
+                             (against, val))
+
+        # invalid regexes are only an error when matching
+        matcher = declaration.compile_matcher('a(b')
+        self.assertFalse(matcher.matches(True))
+        self.assertRaises(re.error, matcher.matches, 'ab')
+
+    def test_matchers(self):
+        '''Test compile_matcher()'''
+        for (against, val, expected) in [
+                (['a', 'b'], ['b', 'a'], True),
+                (['a', 'b'], ['a'], False),
+                (True, True, True),
+                (True, False, False),
+                ({'a': 'b'}, {'a': 'b'}, True),
+                ({'a': 'b'}, {'a': 'c'}, False),
+                ('a', ['a'], False),
+                ('$SLOT(content)', 'foo', True),
+                ('$SLOT(content)', True, True)]:
+            matcher = declaration.compile_matcher(against)
+            self.assertEqual(matcher.matches(val), expected, (against, val))
+
+        matcher = declaration.compile_matcher(1)
+        self.assertFalse(matcher.matches('1'))
+        self.assertRaises(declaration.SnapDeclarationException,
+                          matcher.matches, 1)
+
+    def test_constraint_search(self):
+        '''Test Constraint.search()'''
+        for (value, val, expected, expected_inverted) in [
+                (True, True, True, False),
+                (False, True, False, True),
+                (['app', 'core'], 'app', True, False),
+                (['app', 'core'], 'gadget', False, True),
+                ({'a': 'b.*', 'c': 'd'}, {'a': 'bar'}, True, False),
+                ({'a': 'b.*', 'c': 'd'}, {'a': 'bar', 'c': 'x'}, True, True),
+                ({'a': 'b.*'}, {'a': 'foo'}, False, True),
+                ({'a': 'b.*'}, {'x': 'foo'}, False, False),
+                ({'a': 'b.*'}, 'app', False, False),
+                (True, {'a': 'b'}, False, True)]:
+            cstr = declaration.Constraint(value)
+            self.assertEqual(cstr.search(val), expected, (value, val))
+            self.assertEqual(cstr.search(val, inverted=True),
+                             expected_inverted, (value, val))
+
+    def test_evaluator(self):
+        '''Test DeclarationEvaluator()'''
+        base = {
+            'slots': {
+                'foo': {
+                    'allow-installation': {
+                        'slot-snap-type': ['core'],
+                    },
+                    'deny-connection': {
+                        'plug-attributes': {'bar': 'baz.*'},
+                    },
+                },
+            },
+        }
+        evaluator = declaration.DeclarationEvaluator(base)
+
+        # compiled once
+        decision = evaluator.decision('plugs', 'foo')
+        self.assertIs(evaluator.decision('plugs', 'foo'), decision)
+        self.assertEqual(len(list(decision.iter_rulesets())), 1)
+        self.assertFalse(decision.has_alternates)
+
+        self.assertEqual(evaluator.evaluate('plugs', 'foo', 'app'),
+                         (False, []))
+        # plug-attributes are checked on the slots side
+        (manual, flagged) = evaluator.evaluate('plugs', 'foo', 'app',
+                                               {'bar': 'bazz'})
+        self.assertTrue(manual)
+        self.assertEqual([(r.key, r.subkey, r.decl_type) for r in flagged],
+                         [('deny-connection', 'plug-attributes', 'base')])
+
+        (manual, flagged) = evaluator.evaluate('slots', 'foo', 'app')
+        self.assertTrue(manual)
+        self.assertEqual([(r.key, r.subkey) for r in flagged],
+                         [('allow-installation', 'slot-snap-type')])
+        self.assertEqual(evaluator.evaluate('slots', 'foo', 'core'),
+                         (False, []))
+
+    def test_evaluator_snap_declaration(self):
+        '''Test DeclarationEvaluator() - snap declaration with alternates'''
+        base = {'slots': {'foo': {'deny-installation': True}}}
+        snap = {
+            'slots': {
+                'foo': {
+                    'allow-installation': [
+                        {'slot-snap-type': ['gadget'], 'on-classic': False},
+                        {'slot-snap-type': ['app']},
+                    ],
+                },
+            },
+        }
+        evaluator = declaration.DeclarationEvaluator(base, snap)
+        decision = evaluator.decision('slots', 'foo')
+        self.assertTrue(decision.has_alternates)
+
+        # the first alternate isn't an exact denial, so it passes and the
+        # second isn't compiled
+        self.assertEqual(evaluator.evaluate('slots', 'foo', 'app'),
+                         (False, []))
+        self.assertEqual(len(decision.rulesets), 1)
+        self.assertEqual(len(list(decision.iter_rulesets())), 2)
+
+        # both alternates are exact denials
+        (manual, flagged) = evaluator.evaluate('slots', 'foo', 'core')
+        self.assertTrue(manual)
+        self.assertEqual([(r.key, r.subkey) for r in flagged],
+                         [('allow-installation', 'slot-snap-type'),
+                          ('allow-installation', 'on-classic'),
+                          ('allow-installation', 'slot-snap-type')])
+
+    def test_iter_combinations(self):
+        '''Test iter_combinations()'''
+        base = {
+            'plugs': {'foo': {'allow-installation': False}},
+            'slots': {
+                'foo': {
+                    'deny-installation': [True, False],
+                    'allow-connection': True,
+                    'deny-connection': [{'on-classic': True}, True],
+                },
+            },
+        }
+        snap = {'plugs': {'foo': {'allow-connection': [True, False]}}}
+        self.assertTrue(declaration.has_alternates(base, None, 'foo'))
+        self.assertFalse(declaration.has_alternates(base, None, 'bar'))
+
+        combinations = list(declaration.iter_combinations(base, snap, 'foo'))
+        self.assertEqual(len(combinations), 8)
+        # the snap alternates change the fastest
+        (b, s) = combinations[1]
+        self.assertEqual(b, {'plugs': {'foo': {'allow-installation': False}},
+                             'slots': {'foo': {'deny-installation': True,
+                                               'allow-connection': True,
+                                               'deny-connection':
+                                               {'on-classic': True}}}})
+        self.assertEqual(s, {'plugs': {'foo': {'allow-connection': False}}})
+        (b, s) = combinations[2]
+        self.assertEqual(b['slots']['foo'], {'deny-installation': True,
+                                             'allow-connection': True,
+                                             'deny-connection': True})
+        self.assertEqual(s, {'plugs': {'foo': {'allow-connection': True}}})
+        self.assertEqual(combinations[4][0]['slots']['foo'],
+                         {'deny-installation': False,
+                          'allow-connection': True,
+                          'deny-connection': {'on-classic': True}})
+
+        # the snap declaration is None when it has nothing for interface
+        self.assertEqual([s for (b, s) in
+                          declaration.iter_combinations(base, {}, 'foo')],
+                         [None] * 4)
+        self.assertEqual(list(declaration.iter_combinations({}, snap, 'foo')),
+                         [])
+
+    def test_freeze(self):
+        '''Test freeze()'''
+        self.assertEqual(declaration.freeze({'a': [1, {'b': True}]}),
+                         declaration.freeze({'a': [1, {'b': True}]}))
+        self.assertNotEqual(declaration.freeze({'a': True}),
+                            declaration.freeze({'a': 1}))
+        self.assertNotEqual(declaration.freeze(['a', 'b']),
+                            declaration.freeze(['b', 'a']))
+        self.assertEqual(hash(declaration.freeze({'a': {'b': 'c'}})),
+                         hash(declaration.freeze({'a': {'b': 'c'}})))
+
+    def test_evaluator_verdicts(self):
+        '''Test DeclarationEvaluator() - verdicts are remembered'''
+        base = {
+            'slots': {
+                'foo': {
+                    'deny-connection': {'plug-attributes': {'bar': 'baz.*'}},
+                },
+            },
+        }
+        evaluator = declaration.DeclarationEvaluator(base)
+        decision = evaluator.decision('plugs', 'foo')
+        with patch.object(decision, 'evaluate',
+                          wraps=decision.evaluate) as mock:
+            for attribs in [{'bar': 'bazz'}, {'bar': 'bazz'}, None, None,
+                            {'bar': 'x'}, {'bar': ['bazz']}]:
+                evaluator.evaluate('plugs', 'foo', 'app', attribs)
+            self.assertEqual(mock.call_count, 4)
+            self.assertTrue(evaluator.evaluate('plugs', 'foo', 'app',
+                                               {'bar': 'bazz'})[0])
+            self.assertFalse(evaluator.evaluate('plugs', 'foo', 'app',
+                                                {'bar': 'x'})[0])
+
+            # unhashable attributes aren't remembered
+            evaluator.evaluate('plugs', 'foo', 'app', {'bar': set()})
+            evaluator.evaluate('plugs', 'foo', 'app', {'bar': set()})
+            self.assertEqual(mock.call_count, 6)
+
+    @patch.dict('clickreviews.declaration._evaluators', clear=True)
+    def test_get_evaluator(self):
+        '''Test get_evaluator()'''
+        base = {'slots': {'foo': {'deny-installation': True}}}
+        snap = {'slots': {'foo': {'allow-installation': True}}}
+        evaluator = declaration.get_evaluator(base)
+        self.assertIs(declaration.get_evaluator(dict(base)), evaluator)
+        self.assertIsNot(declaration.get_evaluator(base, snap), evaluator)
+        # the declarations are copied
+        self.assertEqual(evaluator.base, base)
+        self.assertIsNot(evaluator.base, base)
+
+        with patch('clickreviews.declaration.MAX_EVALUATORS', 1):
+            declaration.get_evaluator(snap)
+            self.assertEqual(len(declaration._evaluators), 1)
+            self.assertIsNot(declaration.get_evaluator(base), evaluator)
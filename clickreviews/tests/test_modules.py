@@ -1,6 +1,15 @@
-from clickreviews import modules, cr_tests
+from clickreviews import common, modules, cr_tests
+from clickreviews.common import cleanup_unpack, PackageContext
+from clickreviews.tests import utils
+from unittest import TestCase
+from unittest.mock import patch
 import clickreviews
 import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 
 
 class TestModules(cr_tests.TestClickReview):
@@ -19,6 +28,18 @@ class TestModules(cr_tests.TestClickReview):
     def test_number_of_suitable_modules_greater0(self):
         self.assertTrue(len(self.modules) > 0)
 
+    def test_select_modules(self):
+        '''Test select_modules()'''
+        self.assertEqual(modules.select_modules(self.modules), self.modules)
+        selection = common.CheckSelection(only=['declaration-snap-v2:*',
+                                                'lint:hooks'])
+        self.assertEqual(modules.select_modules(self.modules, selection),
+                         ['cr_lint', 'sr_declaration'])
+        selection = common.CheckSelection(skip=['lint*'])
+        self.assertEqual(modules.select_modules(self.modules, selection),
+                         [m for m in self.modules
+                          if m not in ['cr_lint', 'sr_lint']])
+
     def test_number_of_available_review_classes(self):
         count = 0
         for module_name in self.modules:
@@ -28,3 +49,99 @@ class TestModules(cr_tests.TestClickReview):
         self.assertEqual(count, len(self.modules),
                          'Not all files in clickreviews/[cs]r_*.py contain '
                          'classes named Click|Snap*Review.')
+
+    def test_review_modules_registry(self):
+        '''Test REVIEW_MODULES'''
+        for module_name in self.modules:
+            cls = modules.find_main_class(module_name)
+            self.assertEqual(cls.__module__, 'clickreviews.%s' % module_name)
+            self.assertIs(modules.find_main_class(module_name), cls)
+            if module_name.startswith('cr_'):
+                self.assertEqual(modules.REVIEW_MODULES[module_name][1],
+                                 [modules.CLICK, modules.SNAP_V1])
+            else:
+                self.assertEqual(modules.REVIEW_MODULES[module_name][1],
+                                 [modules.SNAP_V2])
+        self.assertIsNone(modules.find_main_class('cr_skeleton'))
+
+    def test_lazy_imports(self):
+        '''Test importing the review modules doesn't import heavy modules'''
+        heavy = ['magic', 'xdg', 'lxml', 'debian', 'yaml', 'http.client',
+                 'urllib.request']
+        code = "import sys\n"
+        for module_name in self.modules:
+            code += "import clickreviews.%s\n" % module_name
+        code += "print(' '.join(m for m in %r if m in sys.modules))" % heavy
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(clickreviews.__path__[0])
+        out = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                      universal_newlines=True)
+        self.assertEqual(out.split(), [])
+
+    def test_package_type(self):
+        '''Test package_type()'''
+        self.assertEqual(modules.package_type(('click', 1)), modules.CLICK)
+        self.assertEqual(modules.package_type(('snap', 1)), modules.SNAP_V1)
+        self.assertEqual(modules.package_type(('snap', 2)), modules.SNAP_V2)
+        self.assertTrue(modules.reviews_package_type('cr_lint',
+                                                     modules.SNAP_V1))
+        self.assertFalse(modules.reviews_package_type('cr_lint',
+                                                      modules.SNAP_V2))
+        self.assertFalse(modules.reviews_package_type('sr_lint',
+                                                      modules.CLICK))
+
+
+class TestReviewModules(TestCase):
+    '''Tests for running review modules (without mocks).'''
+    def setUp(self):
+        self.addCleanup(cleanup_unpack)
+        self.modules = modules.get_modules()
+        super().setUp()
+
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def _review_modules(self, package, jobs):
+        with PackageContext(package) as context:
+            return list(modules.review_modules(self.modules, package,
+                                               context=context, jobs=jobs))
+
+    def test_review_modules(self):
+        '''Test review_modules()'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        results = self._review_modules(package, 1)
+        self.assertEqual([r[0] for r in results], self.modules)
+        for (module_name, report, exc) in results:
+            self.assertIsNone(exc)
+            self.assertIsNotNone(report)
+
+    def test_review_modules_package_type(self):
+        '''Test review_modules() - modules for other package types'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        with patch('clickreviews.modules.find_main_class',
+                   wraps=modules.find_main_class) as mock:
+            results = self._review_modules(package, 1)
+        self.assertEqual(sorted(c[0][0] for c in mock.call_args_list),
+                         [m for m in self.modules if m.startswith('cr_')])
+        for (module_name, report, exc) in results:
+            if module_name.startswith('sr_'):
+                self.assertEqual(report, modules.empty_report())
+
+    def test_review_modules_jobs(self):
+        '''Test review_modules() - parallel matches sequential'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        expected = self._review_modules(package, 1)
+        self.assertEqual(self._review_modules(package, 4), expected)
+
+    def test_review_modules_jobs_exit(self):
+        '''Test review_modules() - parallel exits like sequential'''
+        package = utils.make_click(output_dir=self.mkdtemp())
+        deb = os.path.join(self.mkdtemp(), 'test.deb')
+        shutil.copy(package, deb)
+        with PackageContext(deb) as context:
+            with self.assertRaises(SystemExit):
+                list(modules.review_modules(self.modules, deb,
+                                            context=context, jobs=4))
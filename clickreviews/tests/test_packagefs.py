@@ -0,0 +1,158 @@
+'''test_packagefs.py: tests for the packagefs module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from clickreviews import packagefs
+from clickreviews.common import cmd
+from clickreviews.tests import utils
+from clickreviews.tests.test_squashfs import make_image
+
+import os
+import shutil
+import stat
+import tempfile
+
+
+class PackageFSTestCase(TestCase):
+    """Tests for the packagefs module."""
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def _make_click(self):
+        return utils.make_click(output_dir=self.mkdtemp(),
+                                extra_files=['some/dir/', 'bin/foo',
+                                             '/bin/ls,bin/ls',
+                                             'bin/foo,bin/bar',
+                                             'some,link-to-dir',
+                                             '.hidden'])
+
+    def _unpack(self, package):
+        d = os.path.join(self.mkdtemp(), 'unpack')
+        (rc, out) = cmd(['dpkg-deb', '-R', package, d])
+        self.assertEqual(rc, 0)
+        return d
+
+    def _describe(self, fs):
+        '''Return what both DirFS and DebFS know about the files of fs'''
+        files = []
+        for (top, dirnames, filenames) in fs.walk():
+            for name in dirnames + filenames:
+                rel = os.path.join(top, name)
+                st = fs.lstat(rel)
+                if stat.S_ISLNK(st.st_mode):
+                    files.append((rel, 'l', fs.readlink(rel)))
+                elif stat.S_ISDIR(st.st_mode):
+                    files.append((rel, stat.filemode(st.st_mode), None))
+                else:
+                    files.append((rel, stat.filemode(st.st_mode),
+                                  fs.read(rel)))
+        return files
+
+    def test_normpath(self):
+        '''Test normpath()'''
+        for (path, expected) in [('', ''), ('.', ''), ('/', ''),
+                                 ('a/b/', 'a/b'), ('/a//b', 'a/b'),
+                                 ('../../a', 'a'), ('a/../../b', 'b')]:
+            self.assertEqual(packagefs.normpath(path), expected)
+
+    def test_debfs_matches_dirfs(self):
+        '''Test DebFS() matches DirFS() of the unpacked package'''
+        package = self._make_click()
+        dirfs = packagefs.DirFS(self._unpack(package))
+        with packagefs.open_package_fs(package) as debfs:
+            self.assertIsInstance(debfs, packagefs.DebFS)
+            self.assertEqual(self._describe(debfs), self._describe(dirfs))
+            for pattern in ['*', 'DEBIAN/*', 'bin/*', '*/foo', '.*',
+                            'nonexistent/*', 'DEBIAN/control']:
+                self.assertEqual(debfs.glob(pattern), dirfs.glob(pattern))
+            for rel in ['link-to-dir', 'link-to-dir/dir', 'DEBIAN',
+                        'bin/..']:
+                self.assertEqual(stat.filemode(debfs.stat(rel).st_mode),
+                                 stat.filemode(dirfs.stat(rel).st_mode))
+            self.assertEqual(debfs.read('DEBIAN/control'),
+                             dirfs.read('DEBIAN/control'))
+            with debfs.open_text('DEBIAN/manifest') as f:
+                self.assertIn('"name"', f.read())
+
+    def test_debfs_outside(self):
+        '''Test DebFS() - files outside of the package'''
+        package = self._make_click()
+        with packagefs.DebFS(package) as fs:
+            self.assertTrue(fs.islink('bin/ls'))
+            self.assertEqual(fs.readlink('bin/ls'), '/bin/ls')
+            self.assertFalse(fs.exists('bin/ls'))
+            self.assertRaises(packagefs.PackageFSException, fs.open,
+                              'bin/ls')
+            self.assertRaises(packagefs.PackageFSException, fs.lstat,
+                              'nonexistent')
+            # as in a chroot, '..' at the top is the top
+            self.assertEqual(fs.listdir('../..'), fs.listdir(''))
+
+    def test_debfs_read_in_place(self):
+        '''Test DebFS() reads files from the deb without copying it'''
+        package = self._make_click()
+        dirfs = packagefs.DirFS(self._unpack(package))
+        with patch('clickreviews.packagefs.tempfile') as mock_tempfile, \
+                packagefs.DebFS(package) as fs:
+            with patch.object(fs._deb, 'open_tar',
+                              side_effect=fs._deb.open_tar) as mock_open:
+                # in the order of the package, each member is read once
+                rels = sorted(['bin/foo', '.hidden', 'DEBIAN/control',
+                               'DEBIAN/manifest'],
+                              key=lambda rel: fs._nodes[rel].key)
+                for rel in rels:
+                    self.assertEqual(fs.read(rel), dirfs.read(rel))
+                self.assertEqual(mock_open.call_count, 2)
+                # reading backwards starts the member again
+                self.assertEqual(fs.read(rels[0]), dirfs.read(rels[0]))
+                self.assertEqual(mock_open.call_count, 3)
+        self.assertFalse(mock_tempfile.mock_calls)
+
+    def test_debfs_local_path(self):
+        '''Test DebFS.local_path()'''
+        package = self._make_click()
+        with packagefs.DebFS(package) as fs:
+            fn = fs.local_path('DEBIAN/control')
+            self.assertEqual(os.path.basename(fn), 'control')
+            with open(fn, 'rb') as f:
+                self.assertEqual(f.read(), fs.read('DEBIAN/control'))
+            self.assertEqual(fs.local_path('DEBIAN/control'), fn)
+        self.assertFalse(os.path.exists(fn))
+
+    def test_squashfsfs(self):
+        '''Test SquashfsFS()'''
+        fn = os.path.join(self.mkdtemp(), 'test.snap')
+        with open(fn, 'wb') as f:
+            f.write(make_image())
+        with packagefs.open_package_fs(fn) as fs:
+            self.assertIsInstance(fs, packagefs.SquashfsFS)
+            self.assertEqual(list(fs.walk()),
+                             [('', [], ['dev', 'file', 'link'])])
+            self.assertEqual(fs.path('file'), os.path.join(fn, 'file'))
+            self.assertEqual(fs.relpath(fs.path('file')), 'file')
+            self.assertTrue(fs.isfile('link'))
+            self.assertTrue(fs.islink('link'))
+            self.assertEqual(fs.readlink('link'), 'file')
+            self.assertEqual(fs.stat('link').st_size, 42)
+            self.assertTrue(stat.S_ISCHR(fs.stat('dev').st_mode))
+            # the test image's file is sparse
+            self.assertEqual(fs.read('link'), b'\0' * 42)
+            self.assertFalse(fs.access_x('file'))
@@ -1,7 +1,18 @@
+import hashlib
+import http.client
+import http.server
+import io
+import os
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
 import time
 from unittest import TestCase
 from unittest.mock import patch
 
+from clickreviews import remote
 from clickreviews.remote import UPDATE_INTERVAL, _update_is_necessary
 
 
@@ -36,3 +47,270 @@ class RemoteTestCase(TestCase):
         self.mock_path.getmtime.return_value = now - UPDATE_INTERVAL - 10
 
         self.assertTrue(_update_is_necessary('some-file'))
+
+
+def index_keys(d):
+    return sorted(d.keys())
+
+
+def index_values(d):
+    return sorted(d.values())
+
+
+class ReadDataFileTestCase(TestCase):
+    '''Tests for reading (and compiling) data files'''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.compiled_dir = os.path.join(self.tmp_dir, 'compiled')
+        p = patch('clickreviews.remote.COMPILED_DIR', self.compiled_dir)
+        p.start()
+        self.addCleanup(p.stop)
+        p = patch('clickreviews.remote._data_file_cache', {})
+        p.start()
+        self.addCleanup(p.stop)
+
+    def _write(self, name, data):
+        fn = os.path.join(self.tmp_dir, name)
+        with open(fn, 'w') as f:
+            f.write(data)
+        return fn
+
+    def _read(self, fn, **kwargs):
+        '''Read fn as a new process would'''
+        remote._data_file_cache.clear()
+        return remote._read_data_file(fn, **kwargs)
+
+    def test_compiled_yaml(self):
+        '''Test yaml is only parsed once per content'''
+        fn = self._write('decl.yaml', 'plugs:\n  foo: {allow: true}\n')
+        expected = {'plugs': {'foo': {'allow': True}}}
+        self.assertEqual(self._read(fn, as_yaml=True), (expected, None))
+        self.assertEqual(len(os.listdir(self.compiled_dir)), 1)
+
+        with patch('yaml.load') as mock_load:
+            (d, indexes) = self._read(fn, as_yaml=True)
+            self.assertFalse(mock_load.called)
+        self.assertEqual(d, expected)
+
+        # changed contents are parsed again
+        self._write('decl.yaml', 'plugs: {}\n')
+        self.assertEqual(self._read(fn, as_yaml=True), ({'plugs': {}}, None))
+        self.assertEqual(len(os.listdir(self.compiled_dir)), 2)
+
+    def test_indexes(self):
+        '''Test the indexes are compiled along with the data'''
+        fn = self._write('policy.json', '{"b": 1, "a": 2}')
+        self.assertEqual(self._read(fn), ({'b': 1, 'a': 2}, None))
+        # json without indexes isn't worth compiling
+        self.assertFalse(os.path.exists(self.compiled_dir))
+
+        self.assertEqual(self._read(fn, indexer=index_keys),
+                         ({'b': 1, 'a': 2}, ['a', 'b']))
+        # not what another indexer compiled
+        self.assertEqual(self._read(fn, indexer=index_values),
+                         ({'b': 1, 'a': 2}, [1, 2]))
+        self.assertEqual(self._read(fn, indexer=index_keys),
+                         ({'b': 1, 'a': 2}, ['a', 'b']))
+
+    def test_memoized(self):
+        '''Test the data is parsed once per process and copied'''
+        fn = self._write('decl.yaml', 'foo: [bar]\n')
+        (d, indexes) = self._read(fn, as_yaml=True)
+        d['foo'].append('baz')
+        with patch('clickreviews.remote._load_compiled') as mock_load:
+            (d, indexes) = remote._read_data_file(fn, as_yaml=True)
+            self.assertFalse(mock_load.called)
+        self.assertEqual(d, {'foo': ['bar']})
+
+    def test_not_json(self):
+        '''Test yaml which json can't represent isn't compiled'''
+        fn = self._write('decl.yaml', '16: foo\n')
+        self.assertEqual(self._read(fn, as_yaml=True), ({16: 'foo'}, None))
+        self.assertEqual(self._read(fn, as_yaml=True), ({16: 'foo'}, None))
+        self.assertFalse(os.path.exists(self.compiled_dir))
+
+    def test_invalid_compiled(self):
+        '''Test invalid compiled forms are ignored'''
+        fn = self._write('decl.yaml', 'foo: bar\n')
+        self._read(fn, as_yaml=True)
+        compiled = os.path.join(self.compiled_dir,
+                                os.listdir(self.compiled_dir)[0])
+        for data in ['', '[]', '{"format": 0}']:
+            with open(compiled, 'w') as f:
+                f.write(data)
+            self.assertEqual(self._read(fn, as_yaml=True),
+                             ({'foo': 'bar'}, None))
+
+    def test_parse_error(self):
+        '''Test unparsable files'''
+        fn = self._write('decl.yaml', 'foo: [bar\n')
+        self.assertRaises(ValueError, self._read, fn, as_yaml=True)
+
+
+class DataRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''Serve the server's content at any path, with an ETag and
+       Last-Modified and honoring conditional GETs'''
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        time.sleep(server.delay)
+        if server.status != 200:
+            self.send_error(server.status)
+            return
+
+        etag = '"%s"' % hashlib.sha256(server.content).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', 'Mon, 02 Jan 2017 00:00:00 GMT')
+        if server.truncate:
+            self.send_header('Content-Length', len(server.content) + 10)
+        else:
+            self.send_header('Content-Length', len(server.content))
+        self.end_headers()
+        self.wfile.write(server.content)
+
+
+class DataHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    content = b'{"foo": "bar"}'
+    status = 200
+    delay = 0
+    truncate = False
+
+    def __init__(self):
+        self.requests = []
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                        DataRequestHandler)
+
+
+class RefreshTestCase(TestCase):
+    '''Tests for refreshing data files'''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.fn = os.path.join(self.tmp_dir, 'data', 'policy.json')
+
+        self.server = DataHTTPServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/policy.json' % \
+            self.server.server_address[1]
+
+        p = patch('clickreviews.remote._data_file_cache', {})
+        p.start()
+        self.addCleanup(p.stop)
+
+    def _age(self, fn, secs):
+        t = time.time() - secs
+        os.utime(fn, (t, t))
+
+    def test_refresh_file(self):
+        '''Test refresh_file() with conditional GETs'''
+        self.assertTrue(remote.refresh_file(self.fn, self.url))
+        with open(self.fn, 'rb') as f:
+            self.assertEqual(f.read(), self.server.content)
+        self.assertNotIn('If-None-Match', self.server.requests[0])
+
+        # unchanged, but marked as fresh
+        self._age(self.fn, UPDATE_INTERVAL + 10)
+        self.assertFalse(remote.refresh_file(self.fn, self.url))
+        self.assertIn('If-None-Match', self.server.requests[1])
+        self.assertEqual(self.server.requests[1]['If-Modified-Since'],
+                         'Mon, 02 Jan 2017 00:00:00 GMT')
+        self.assertFalse(_update_is_necessary(self.fn))
+
+        self.server.content = b'{"foo": "baz"}'
+        self.assertTrue(remote.refresh_file(self.fn, self.url))
+        with open(self.fn, 'rb') as f:
+            self.assertEqual(f.read(), self.server.content)
+
+        # validators are only used for the same url and when forced
+        self.assertTrue(remote.refresh_file(self.fn, self.url + '?new'))
+        self.assertTrue(remote.refresh_file(self.fn, self.url, force=True))
+        self.assertNotIn('If-None-Match', self.server.requests[-1])
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.fn))),
+                         ['policy.json', 'policy.json.meta'])
+
+    def test_refresh_file_errors(self):
+        '''Test refresh_file() failures leave the file as it was'''
+        remote.refresh_file(self.fn, self.url)
+        content = self.server.content
+        self.server.content = b'{"foo": "baz"}'
+
+        self.server.status = 404
+        self.assertRaises(OSError, remote.refresh_file, self.fn, self.url)
+        self.server.status = 200
+
+        self.server.truncate = True
+        self.assertRaises(http.client.HTTPException, remote.refresh_file,
+                          self.fn, self.url)
+        self.server.truncate = False
+
+        self.server.delay = 0.5
+        self.assertRaises(socket.timeout, remote.refresh_file, self.fn,
+                          self.url, timeout_secs=0.1)
+
+        with open(self.fn, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.fn))),
+                         ['policy.json', 'policy.json.meta'])
+
+    def test_read_cr_data(self):
+        '''Test read_cr_data() refreshes stale files'''
+        self.assertEqual(remote.read_cr_file(self.fn, self.url),
+                         {'foo': 'bar'})
+        self.assertEqual(len(self.server.requests), 1)
+        # fresh files aren't downloaded again
+        self.assertEqual(remote.read_cr_file(self.fn, self.url),
+                         {'foo': 'bar'})
+        self.assertEqual(len(self.server.requests), 1)
+
+        self.server.content = b'{"foo": "baz"}'
+        self._age(self.fn, UPDATE_INTERVAL + 10)
+        self.assertEqual(remote.read_cr_file(self.fn, self.url),
+                         {'foo': 'baz'})
+
+        # failures use what there is, quietly unless there is nothing
+        self.server.status = 500
+        self._age(self.fn, UPDATE_INTERVAL + 10)
+        with patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertEqual(remote.read_cr_file(self.fn, self.url),
+                             {'foo': 'baz'})
+            self.assertEqual(stderr.getvalue(), '')
+            self.assertEqual(remote.read_cr_file(self.fn + '.new',
+                                                 self.url), {})
+            self.assertIn("Could not refresh '%s.new'" % self.fn,
+                          stderr.getvalue())
+
+    def test_read_cr_data_background(self):
+        '''Test read_cr_data() with set_background_refresh()'''
+        remote.set_background_refresh()
+        self.addCleanup(remote.set_background_refresh, False)
+
+        # there is nothing to use yet, so it is downloaded right away
+        self.assertEqual(remote.read_cr_file(self.fn, self.url),
+                         {'foo': 'bar'})
+
+        self.server.content = b'{"foo": "baz"}'
+        self.server.delay = 0.2
+        self._age(self.fn, UPDATE_INTERVAL + 10)
+        self.assertEqual(remote.read_cr_file(self.fn, self.url),
+                         {'foo': 'bar'})
+        # only one refresh at a time
+        thread = remote.refresh_in_background(self.fn, self.url)
+        remote.wait_for_refreshes()
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(remote.read_cr_file(self.fn, self.url),
+                         {'foo': 'baz'})
@@ -0,0 +1,154 @@
+'''test_report_cache.py: tests for the report_cache module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from clickreviews import common, report_cache
+
+import os
+import shutil
+import tempfile
+
+
+class ReportCacheTestCase(TestCase):
+    """Tests for the report_cache module."""
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def _write(self, fn, data):
+        with open(fn, 'w') as f:
+            f.write(data)
+
+    def test_cache_key(self):
+        '''Test cache_key()'''
+        d = self.mkdtemp()
+        data_dir = self.mkdtemp()
+        package = os.path.join(d, 'test.snap')
+        self._write(package, 'package')
+        self._write(os.path.join(data_dir, 'policy.json'), '{}')
+        key = report_cache.cache_key(package, data_dirs=[data_dir])
+
+        # overrides are normalized
+        self.assertEqual(report_cache.cache_key(package, {},
+                                                data_dirs=[data_dir]), key)
+        self.assertEqual(
+            report_cache.cache_key(package, {'a': 1, 'b': [2]},
+                                   data_dirs=[data_dir]),
+            report_cache.cache_key(package, {'b': [2], 'a': 1},
+                                   data_dirs=[data_dir]))
+        self.assertNotEqual(
+            report_cache.cache_key(package, {'snap_allow_classic': True},
+                                   data_dirs=[data_dir]), key)
+
+        # as are the selected checks
+        selection = common.CheckSelection(only=['lint:*'])
+        self.assertNotEqual(report_cache.cache_key(package,
+                                                   data_dirs=[data_dir],
+                                                   selection=selection), key)
+
+        # only the package contents matter, not its name
+        other = os.path.join(d, 'other.snap')
+        shutil.copy(package, other)
+        self.assertEqual(report_cache.cache_key(other, data_dirs=[data_dir]),
+                         key)
+        self._write(package, 'changed')
+        self.assertNotEqual(report_cache.cache_key(package,
+                                                   data_dirs=[data_dir]), key)
+
+        # as do the data files
+        self._write(os.path.join(data_dir, 'policy.json'), '{"a": 1}')
+        self.assertNotEqual(report_cache.cache_key(other,
+                                                   data_dirs=[data_dir]), key)
+        # but not other files
+        key = report_cache.cache_key(other, data_dirs=[data_dir])
+        self._write(os.path.join(data_dir, 'README'), 'foo')
+        self.assertEqual(report_cache.cache_key(other, data_dirs=[data_dir]),
+                         key)
+
+        # as does the code of the checks
+        with patch('clickreviews.report_cache.code_hash',
+                   return_value='changed'):
+            self.assertNotEqual(report_cache.cache_key(other,
+                                                       data_dirs=[data_dir]),
+                                key)
+
+        # and the installed frameworks
+        frameworks_dir = self.mkdtemp()
+        with patch('clickreviews.report_cache.FRAMEWORKS_DIR',
+                   frameworks_dir):
+            key = report_cache.cache_key(other, data_dirs=[data_dir])
+            self._write(os.path.join(frameworks_dir,
+                                     'ubuntu-sdk-15.04.framework'), '')
+            self.assertNotEqual(report_cache.cache_key(other,
+                                                       data_dirs=[data_dir]),
+                                key)
+
+    def test_code_hash(self):
+        '''Test code_hash()'''
+        code_dirs = [self.mkdtemp(), self.mkdtemp(), self.mkdtemp()]
+        for d in code_dirs:
+            self._write(os.path.join(d, 'cr_lint.py'), 'checks')
+            self._write(os.path.join(d, 'README'), 'readme')
+        self._write(os.path.join(code_dirs[1], 'README'), 'changed')
+        self._write(os.path.join(code_dirs[2], 'cr_lint.py'), 'changed')
+        self.assertEqual(report_cache.code_hash(code_dirs[0]),
+                         report_cache.code_hash(code_dirs[1]))
+        self.assertNotEqual(report_cache.code_hash(code_dirs[0]),
+                            report_cache.code_hash(code_dirs[2]))
+        self.assertEqual(report_cache.code_hash(),
+                         report_cache.code_hash(report_cache.CODE_DIR))
+
+    def test_get_put(self):
+        '''Test ReportCache.get() and put()'''
+        cache = report_cache.ReportCache(cache_dir=os.path.join(
+            self.mkdtemp(), 'reports'))
+        self.assertIsNone(cache.get('foo'))
+        results = {'section': {'info': {'a': {'text': 'OK'}}, 'warn': {},
+                               'error': {}}}
+        cache.put('foo', results)
+        self.assertEqual(cache.get('foo'), results)
+
+    def test_evict(self):
+        '''Test ReportCache() evicts the least recently used reports'''
+        d = self.mkdtemp()
+        results = {'section': 'x' * 100}
+        size = len('{"section": "%s"}' % ('x' * 100))
+        cache = report_cache.ReportCache(cache_dir=d, max_size=3 * size)
+        for (i, key) in enumerate(['a', 'b', 'c']):
+            cache.put(key, results)
+            os.utime(os.path.join(d, '%s.json' % key), (i, i))
+
+        self.assertEqual(cache.get('a'), results)
+        cache.put('d', results)
+        self.assertEqual(sorted(os.listdir(d)),
+                         ['a.json', 'c.json', 'd.json'])
+
+    def test_baseline(self):
+        '''Test ReportCache.get_baseline() and put_baseline()'''
+        d = self.mkdtemp()
+        package = os.path.join(d, 'test.snap')
+        self._write(package, 'package')
+        cache = report_cache.ReportCache(cache_dir=os.path.join(d, 'cache'))
+        self.assertIsNone(cache.get_baseline(package))
+        baseline = common.PackageBaseline({'a': {'size': 1}})
+        cache.put_baseline(package, baseline)
+        self.assertEqual(cache.get_baseline(package).files, baseline.files)
+        self._write(package, 'another package')
+        self.assertIsNone(cache.get_baseline(package))
@@ -0,0 +1,156 @@
+'''test_squashfs.py: tests for the squashfs module'''
+#
+# Copyright (C) 2017 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase, skipUnless
+
+from clickreviews import squashfs
+from clickreviews.common import cmd
+from clickreviews.tests import utils
+
+import os
+import shutil
+import stat
+import struct
+import tempfile
+
+
+def _metadata_block(data):
+    '''Return data as an uncompressed metadata block'''
+    return struct.pack('<H', len(data) | 0x8000) + data
+
+
+def make_image(compression=4):
+    '''Return a minimal squashfs image with uncompressed metadata holding
+       a character device, a file and a symlink'''
+    mtime = 1457717100
+    inodes = b''
+    # (name, inode type, offset in inode table, inode number)
+    children = []
+
+    def header(itype, mode, ino):
+        return struct.pack('<HHHHII', itype, mode, 0, 0, mtime, ino)
+
+    children.append(('dev', 5, len(inodes), 1))
+    inodes += header(5, 0o666, 1) + struct.pack('<II', 1, (1 << 8) | 3)
+    children.append(('file', 2, len(inodes), 2))
+    inodes += header(2, 0o644, 2) + struct.pack('<IIIII', 96, 0xffffffff,
+                                                0, 42, 0)
+    children.append(('link', 3, len(inodes), 3))
+    inodes += header(3, 0o777, 3) + struct.pack('<II', 1, 4) + b'file'
+
+    listing = struct.pack('<III', len(children) - 1, 0, 1)
+    for (name, itype, offset, ino) in children:
+        listing += struct.pack('<HhHH', offset, ino - 1, itype,
+                               len(name) - 1) + name.encode()
+    root = len(inodes)
+    inodes += header(1, 0o755, 4) + struct.pack('<IIHHI', 0, 2,
+                                                len(listing) + 3, 0, 5)
+
+    inode_table = _metadata_block(inodes)
+    directory_table = _metadata_block(listing)
+    ids = _metadata_block(struct.pack('<I', 0))
+    inode_table_start = 96
+    directory_table_start = inode_table_start + len(inode_table)
+    ids_start = directory_table_start + len(directory_table)
+    id_table_start = ids_start + len(ids)
+    bytes_used = id_table_start + 8
+
+    superblock = struct.pack('<IIIIIHHHHHHQQQQQQQQ', squashfs.SQUASHFS_MAGIC,
+                             4, mtime, 131072, 0, compression, 17, 0, 1, 4, 0,
+                             root, bytes_used, id_table_start,
+                             0xffffffffffffffff, inode_table_start,
+                             directory_table_start, ids_start,
+                             0xffffffffffffffff)
+    return superblock + inode_table + directory_table + ids + \
+        struct.pack('<Q', ids_start)
+
+
+class SquashfsTestCase(TestCase):
+    """Tests for the squashfs module."""
+    def mkdtemp(self):
+        """Create a temp dir which is cleaned up after test."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        return tmp_dir
+
+    def write_image(self, data):
+        fn = os.path.join(self.mkdtemp(), 'test.snap')
+        with open(fn, 'wb') as f:
+            f.write(data)
+        return fn
+
+    def test_entries(self):
+        '''Test list_entries()'''
+        fn = self.write_image(make_image())
+        self.assertTrue(squashfs.is_squashfs(fn))
+        entries = squashfs.list_entries(fn)
+        self.assertEqual([e.path for e in entries],
+                         ['.', './dev', './file', './link'])
+        self.assertEqual([stat.filemode(e.mode) for e in entries],
+                         ['drwxr-xr-x', 'crw-rw-rw-', '-rw-r--r--',
+                          'lrwxrwxrwx'])
+        self.assertEqual([e.type for e in entries], ['d', 'c', '-', 'l'])
+        self.assertEqual([e.size for e in entries],
+                         [entries[0].size, 0, 42, 4])
+        self.assertEqual([e.rdev for e in entries], [None, (1, 3), None, None])
+        for e in entries:
+            self.assertEqual((e.uid, e.gid, e.mtime), (0, 0, 1457717100))
+
+    def test_superblock(self):
+        '''Test SquashfsImage() superblock'''
+        fn = self.write_image(make_image())
+        with squashfs.SquashfsImage(fn) as image:
+            self.assertEqual(image.mkfs_time, 1457717100)
+            self.assertEqual(image.compression_name, 'xz')
+
+    def test_not_squashfs(self):
+        '''Test SquashfsImage() - not squashfs'''
+        for data in [b'', b'garbage', b'x' * 4096]:
+            fn = self.write_image(data)
+            self.assertFalse(squashfs.is_squashfs(fn))
+            self.assertRaises(squashfs.SquashfsException,
+                              squashfs.SquashfsImage, fn)
+
+    def test_unsupported_compression(self):
+        '''Test SquashfsImage() - unsupported compression (lzo)'''
+        fn = self.write_image(make_image(compression=3))
+        self.assertTrue(squashfs.is_squashfs(fn))
+        self.assertRaises(squashfs.SquashfsException,
+                          squashfs.SquashfsImage, fn)
+
+    def test_truncated(self):
+        '''Test SquashfsImage() - truncated'''
+        fn = self.write_image(make_image()[:200])
+        self.assertRaises(squashfs.SquashfsException,
+                          squashfs.SquashfsImage, fn)
+
+    @skipUnless(shutil.which('mksquashfs'), "needs mksquashfs")
+    def test_entries_match_unsquashfs(self):
+        '''Test list_entries() matches unsquashfs -lls'''
+        package = utils.make_snap2(output_dir=self.mkdtemp())
+        (rc, out) = cmd(['unsquashfs', '-lls', package])
+        self.assertEqual(rc, 0)
+        expected = []
+        for line in out.split('\n\n', 1)[1].splitlines():
+            tmp = line.split()
+            path = line[line.index(' squashfs-root') + 1:]
+            if tmp[0].startswith('l'):
+                path = path.split(' -> ')[0]
+            expected.append((path.replace('squashfs-root', '.', 1), tmp[0]))
+
+        entries = squashfs.list_entries(package)
+        self.assertEqual([(e.path, stat.filemode(e.mode)) for e in entries],
+                         expected)
@@ -1483,6 +1483,42 @@ slots:
         expected_counts = {'info': 0, 'warn': 0, 'error': 0}
         self.check_results(r, expected_counts)
 
+    def test_check_declaration_apps_shared_verdict(self):
+        '''Test check_declaration_apps - apps using the same interface'''
+        apps = {'app1': {'plugs': ['foo']},
+                'app2': {'plugs': ['foo']},
+                'app3': {'plugs': ['foo', 'bar']}}
+        self.set_test_snap_yaml("apps", apps)
+
+        c = SnapReviewDeclaration(self.test_name)
+        base = {
+            'plugs': {
+                'foo': {
+                    'deny-connection': True
+                },
+                'bar': {
+                    'deny-connection': False
+                }
+            },
+            'slots': {}
+        }
+        self._set_base_declaration(c, base)
+        c.check_declaration_apps()
+        r = c.click_report
+        expected_counts = {'info': 1, 'warn': 0, 'error': 3}
+        self.check_results(r, expected_counts)
+
+        expected = dict()
+        expected['error'] = dict()
+        expected['warn'] = dict()
+        expected['info'] = dict()
+        for app in ['app1', 'app2', 'app3']:
+            name = 'declaration-snap-v2:plugs_deny-connection:%s:foo' % app
+            expected['error'][name] = {"text": "human review required due to 'deny-connection' constraint from base declaration"}
+        name = 'declaration-snap-v2:plugs:app3:bar'
+        expected['info'][name] = {"text": "OK"}
+        self.check_results(r, expected=expected)
+
     def test_check_declaration_slots_deny_installation_true(self):
         '''Test check_declaration - slots/deny-installation/true'''
         slots = {'iface-foo': {'interface': 'foo'}}
@@ -2966,6 +3002,46 @@ slots:
         expected['info'][name] = {"text": "OK"}
         self.check_results(r, expected=expected)
 
+    def test_check_declaration_slots_alternates_pass_not_staged(self):
+        '''Test check_declaration - slots alternates pass - nothing staged'''
+        slots = {'iface': {'interface': 'foo'},
+                 'other': {'interface': 'bar'}}
+        self.set_test_snap_yaml("slots", slots)
+        self.set_test_snap_yaml("type", "app")
+        overrides = {
+            'snap_decl_slots': {
+                'foo': {
+                    'allow-installation': [
+                        {'slot-snap-type': ['gadget'], 'on-classic': False},
+                        {'slot-snap-type': ['app']},
+                    ],
+                },
+            },
+        }
+        c = SnapReviewDeclaration(self.test_name, overrides=overrides)
+        base = {
+            'slots': {
+                'foo': {'deny-installation': True},
+                'bar': {'deny-installation': True},
+            },
+        }
+        self._set_base_declaration(c, base)
+
+        c.check_declaration()
+        r = c.click_report
+        # the alternates of 'foo' flagged for manual review but one passed,
+        # so only 'bar' is reported
+        expected = dict()
+        expected['error'] = dict()
+        expected['warn'] = dict()
+        expected['info'] = dict()
+        name = 'declaration-snap-v2:slots_deny-installation:other:bar'
+        expected['error'][name] = {"text": "human review required due to 'deny-installation' constraint from base declaration"}
+        name = 'declaration-snap-v2:slots:iface:foo'
+        expected['info'][name] = {"text": "OK"}
+        self.check_results(r, expected=expected)
+        self.assertEqual(len(r['error']), 1)
+
     def test_check_declaration_plugs_installation_alternates_one_denied(self):
         '''Test check_declaration - plugs installation alternates - core matching attrib'''
         plugs = {'iface': {'interface': 'foo', 'name': 'one'}}
@@ -3409,16 +3409,29 @@ class TestSnapReviewLint(sr_tests.TestSnapReview):
         expected_counts = {'info': None, 'warn': 0, 'error': 1}
         self.check_results(r, expected_counts)
 
+    def test_check_iffy_order(self):
+        '''Test check_iffy() - files are listed in package order'''
+        c = SnapReviewLint(self.test_name)
+        c.unpack_dir = '/fake'
+        c.pkg_files = [os.path.join(c.unpack_dir, f)
+                       for f in ['.z.swp', 'bin/foo', '.a/.b.swp']]
+        c.check_iffy()
+        r = c.click_report
+        name = 'lint-snap-v2:iffy_files'
+        self.assertEqual(r['warn'][name]['text'],
+                         "found potentially sensitive files in package: "
+                         ".z.swp, .a/.b.swp")
+
 
 class TestSnapReviewLintNoMock(TestCase):
     """Tests without mocks where they are not needed."""
     def setUp(self):
-        # XXX cleanup_unpack() is required because global variables
-        # UNPACK_DIR, RAW_UNPACK_DIR are initialised to None at module
-        # load time, but updated when a real (non-Mock) test runs, such as
-        # here. While, at the same time, two of the existing tests using
-        # mocks depend on both global vars being None. Ideally, those
-        # global vars should be refactored away.
+        # XXX cleanup_unpack() is required because the global variable
+        # UNPACK_DIR is initialised to None at module load time, but
+        # updated when a real (non-Mock) test runs, such as here. While, at
+        # the same time, two of the existing tests using mocks depend on
+        # the global var being None. Ideally, that global var should be
+        # refactored away.
         self.addCleanup(cleanup_unpack)
         super().setUp()
 
@@ -15,16 +15,20 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import print_function
-from unittest import TestCase
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
 import os
 import shutil
+import stat
 import tempfile
 
-from clickreviews.common import cleanup_unpack
+from clickreviews.common import cleanup_unpack, PackageContext
 from clickreviews.common import check_results as common_check_results
 from clickreviews.sr_security import SnapReviewSecurity
+from clickreviews import squashfs
 import clickreviews.sr_tests as sr_tests
 from clickreviews.tests import utils
+from clickreviews.tests.test_squashfs import make_image
 
 
 class TestSnapReviewSecurity(sr_tests.TestSnapReview):
@@ -856,16 +860,215 @@ brw-rw-rw- root/root                8,12a 2016-03-11 12:25 squashfs-root/foo
         expected['error'][name] = {"text": "malformed lines in unsquashfs output: 'time 'z2:25' malformed for './foo''"}
         self.check_results(report, expected=expected)
 
+    def _create_squashfs_entries(self):
+        def _entry(path, mode, uid=0, gid=0, rdev=None):
+            return squashfs.SquashfsEntry(path, stat.filemode(mode)[0], mode,
+                                          uid, gid, 0, 1457717100, rdev)
+        return [_entry('.', stat.S_IFDIR | 0o775),
+                _entry('./bin', stat.S_IFDIR | 0o775),
+                _entry('./bin/echo', stat.S_IFREG | 0o775),
+                _entry('./bin/sh', stat.S_IFLNK | 0o777),
+                _entry('./meta', stat.S_IFDIR | 0o775),
+                _entry('./meta/snap.yaml', stat.S_IFREG | 0o664)]
+
+    def _check_squashfs_entries(self, entries, expected_error=None):
+        c = SnapReviewSecurity(self.test_name)
+        with patch.object(c, '_get_squashfs_entries', return_value=entries):
+            c.check_squashfs_files()
+        report = c.click_report
+        if expected_error is None:
+            expected_counts = {'info': 1, 'warn': 0, 'error': 0}
+            self.check_results(report, expected_counts)
+            return
+        expected_counts = {'info': None, 'warn': 0, 'error': 1}
+        self.check_results(report, expected_counts)
+        expected = dict()
+        expected['error'] = dict()
+        expected['warn'] = dict()
+        expected['info'] = dict()
+        name = 'security-snap-v2:squashfs_files'
+        expected['error'][name] = {
+            "text": "found errors in file output: %s" % expected_error}
+        self.check_results(report, expected=expected)
+
+    def test_check_squashfs_files_entries(self):
+        '''Test check_squashfs_files() - entries'''
+        self._check_squashfs_entries(self._create_squashfs_entries())
+
+    def test_check_squashfs_files_entries_bad_mode(self):
+        '''Test check_squashfs_files() - entries - bad mode'''
+        entries = self._create_squashfs_entries()
+        entries[2] = entries[2]._replace(mode=stat.S_IFREG | 0o4775)
+        self._check_squashfs_entries(
+            entries, "unusual mode 'rwsrwxr-x' for entry './bin/echo'")
+
+    def test_check_squashfs_files_entries_bad_mode_symlink(self):
+        '''Test check_squashfs_files() - entries - bad symlink mode'''
+        entries = self._create_squashfs_entries()
+        entries[3] = entries[3]._replace(mode=stat.S_IFLNK | 0o755)
+        self._check_squashfs_entries(
+            entries, "unusual mode 'rwxr-xr-x' for symlink './bin/sh'")
+
+    def test_check_squashfs_files_entries_bad_owner(self):
+        '''Test check_squashfs_files() - entries - bad owner'''
+        entries = self._create_squashfs_entries()
+        entries[2] = entries[2]._replace(uid=54321, gid=54321)
+        self._check_squashfs_entries(
+            entries, "unusual user/group '54321/54321' for './bin/echo'")
+
+    def test_check_squashfs_files_entries_device(self):
+        '''Test check_squashfs_files() - entries - device'''
+        entries = self._create_squashfs_entries()
+        entries.append(squashfs.SquashfsEntry('./dev-null', 'c',
+                                              stat.S_IFCHR | 0o666, 0, 0, 0,
+                                              1457717100, (1, 3)))
+        self._check_squashfs_entries(
+            entries, "file type 'c' not allowed (./dev-null)")
+
+    def test_check_squashfs_files_entries_device_os(self):
+        '''Test check_squashfs_files() - entries - device (os snap)'''
+        self.set_test_snap_yaml("type", "os")
+        entries = self._create_squashfs_entries()
+        entries.append(squashfs.SquashfsEntry('./dev-null', 'c',
+                                              stat.S_IFCHR | 0o666, 0, 0, 0,
+                                              1457717100, (1, 3)))
+        self._check_squashfs_entries(entries)
+
+    def test_check_squashfs_files_entries_bad_date(self):
+        '''Test check_squashfs_files() - entries - malformed date'''
+        entries = self._create_squashfs_entries()
+        # after the year 9999
+        entries[2] = entries[2]._replace(mtime=10 ** 12)
+        c = SnapReviewSecurity(self.test_name)
+        with patch.object(c, '_get_squashfs_entries', return_value=entries):
+            c.check_squashfs_files()
+        report = c.click_report
+        expected_counts = {'info': 1, 'warn': 0, 'error': 1}
+        self.check_results(report, expected_counts)
+        name = 'security-snap-v2:squashfs_files_malformed_line'
+        self.assertRegex(report['error'][name]['text'],
+                         "^malformed lines in unsquashfs output: 'date "
+                         "'[0-9]{5}-[0-9]{2}-[0-9]{2}' malformed for "
+                         "'./bin/echo''$")
+
+    def test_check_squashfs_files_entries_empty(self):
+        '''Test check_squashfs_files() - entries - none'''
+        c = SnapReviewSecurity(self.test_name)
+        with patch.object(c, '_get_squashfs_entries', return_value=[]):
+            c.check_squashfs_files()
+        report = c.click_report
+        expected_counts = {'info': 1, 'warn': 0, 'error': 1}
+        self.check_results(report, expected_counts)
+        name = 'security-snap-v2:squashfs_files_malformed output'
+        self.assertIn(name, report['error'])
+
+    def test_check_squashfs_files_image(self):
+        '''Test check_squashfs_files() - read from the image'''
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        fn = os.path.join(tmp_dir, 'test.snap')
+        with open(fn, 'wb') as f:
+            f.write(make_image())
+        c = SnapReviewSecurity(self.test_name)
+        c.pkg_filename = fn
+        with patch.object(c, '_check_squashfs_lls') as mock_lls:
+            c.check_squashfs_files()
+        self.assertFalse(mock_lls.called)
+        report = c.click_report
+        expected_counts = {'info': None, 'warn': 0, 'error': 1}
+        self.check_results(report, expected_counts)
+        name = 'security-snap-v2:squashfs_files'
+        self.assertEqual(report['error'][name]['text'],
+                         "found errors in file output: file type 'c' not "
+                         "allowed (./dev)")
+
+    def test_get_squashfs_entries_cached(self):
+        '''Test _get_squashfs_entries() reads the image once with a
+           context'''
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        fn = os.path.join(tmp_dir, 'test.snap')
+        with open(fn, 'wb') as f:
+            f.write(make_image())
+        c = SnapReviewSecurity(self.test_name)
+        c.pkg_filename = fn
+        cache = dict()
+
+        def _get_cached(name, loader):
+            if name not in cache:
+                cache[name] = loader()
+            return cache[name]
+
+        with patch.object(c, '_get_cached', side_effect=_get_cached), \
+                patch('clickreviews.sr_security.squashfs.list_entries',
+                      side_effect=squashfs.list_entries) as mock_entries:
+            entries = c._get_squashfs_entries()
+            self.assertEqual(c._get_squashfs_entries(), entries)
+        self.assertEqual([e.path for e in entries],
+                         ['.', './dev', './file', './link'])
+        self.assertEqual(mock_entries.call_count, 1)
+        self.assertEqual(list(cache), ['squashfs_entries'])
+
+    def _check_squashfs_resquash(self, entries, lls=None):
+        def _metadata(name):
+            if name == 'fstime':
+                return (0, '1457717100\n')
+            self.assertIsNotNone(lls)
+            return (0, lls)
+
+        c = SnapReviewSecurity(self.test_name)
+        with patch.object(c, '_get_squashfs_entries', return_value=entries), \
+                patch.object(c, '_get_squashfs_metadata',
+                             side_effect=_metadata), \
+                patch('clickreviews.sr_security.cmd',
+                      return_value=(1, 'test error')) as mock_cmd:
+            c.check_squashfs_resquash()
+        return (c.click_report, mock_cmd)
+
+    def test_check_squashfs_resquash_entries_1555305(self):
+        '''Test check_squashfs_resquash() - entries with symlink'''
+        (report, mock_cmd) = self._check_squashfs_resquash(
+            self._create_squashfs_entries())
+        self.assertFalse(mock_cmd.called)
+        expected_counts = {'info': 1, 'warn': 0, 'error': 0}
+        self.check_results(report, expected_counts)
+        name = 'security-snap-v2:squashfs_resquash_1555305'
+        self.assertIn(name, report['info'])
+
+    def test_check_squashfs_resquash_entries_no_symlinks(self):
+        '''Test check_squashfs_resquash() - entries without symlink'''
+        entries = [e for e in self._create_squashfs_entries()
+                   if e.type != 'l']
+        (report, mock_cmd) = self._check_squashfs_resquash(entries)
+        self.assertTrue(mock_cmd.called)
+        expected_counts = {'info': 0, 'warn': 0, 'error': 1}
+        self.check_results(report, expected_counts)
+        name = 'security-snap-v2:squashfs_resquash'
+        self.assertIn(name, report['error'])
+
+    def test_check_squashfs_resquash_lls_1555305(self):
+        '''Test check_squashfs_resquash() - unsquashfs -lls with symlink'''
+        lls = '''Parallel unsquashfs: Using 4 processors
+8 inodes (2 blocks) to write
+
+drwxrwxr-x root/root 38 2016-03-11 12:25 squashfs-root
+lrwxrwxrwx root/root 4 2016-03-11 12:25 squashfs-root/bin/sh -> echo
+'''
+        (report, mock_cmd) = self._check_squashfs_resquash(None, lls)
+        self.assertFalse(mock_cmd.called)
+        name = 'security-snap-v2:squashfs_resquash_1555305'
+        self.assertIn(name, report['info'])
+
 
 class TestSnapReviewSecurityNoMock(TestCase):
     """Tests without mocks where they are not needed."""
     def setUp(self):
-        # XXX cleanup_unpack() is required because global variables
-        # UNPACK_DIR, RAW_UNPACK_DIR are initialised to None at module
-        # load time, but updated when a real (non-Mock) test runs, such as
-        # here. While, at the same time, two of the existing tests using
-        # mocks depend on both global vars being None. Ideally, those
-        # global vars should be refactored away.
+        # XXX cleanup_unpack() is required because the global variable
+        # UNPACK_DIR is initialised to None at module load time, but
+        # updated when a real (non-Mock) test runs, such as here. While, at
+        # the same time, two of the existing tests using mocks depend on
+        # the global var being None. Ideally, that global var should be
+        # refactored away.
         self.addCleanup(cleanup_unpack)
         super().setUp()
 
@@ -889,6 +1092,31 @@ class TestSnapReviewSecurityNoMock(TestCase):
         expected_counts = {'info': 1, 'warn': 0, 'error': 0}
         self.check_results(report, expected_counts)
 
+    @skipUnless(shutil.which('mksquashfs'), "needs mksquashfs")
+    def test_squashfs_metadata_cached(self):
+        '''Test the image is only read and unsquashfs -fstime only run once
+           per package'''
+        package = utils.make_snap2(output_dir=self.mkdtemp())
+        lls = SnapReviewSecurity._unsquashfs_lls
+        fstime = SnapReviewSecurity._unsquashfs_fstime
+        with PackageContext(package) as context, \
+                patch.object(SnapReviewSecurity, '_unsquashfs_lls',
+                             autospec=True, side_effect=lls) as mock_lls, \
+                patch.object(SnapReviewSecurity, '_unsquashfs_fstime',
+                             autospec=True, side_effect=fstime) as mock_fstime, \
+                patch('clickreviews.sr_security.squashfs.list_entries',
+                      side_effect=squashfs.list_entries) as mock_entries:
+            for i in range(2):
+                c = SnapReviewSecurity(package, context=context)
+                c.check_squashfs_resquash()
+                c.check_squashfs_files()
+                report = c.click_report
+                expected_counts = {'info': 2, 'warn': 0, 'error': 0}
+                self.check_results(report, expected_counts)
+            self.assertEqual(mock_entries.call_count, 1)
+            self.assertEqual(mock_lls.call_count, 0)
+            self.assertEqual(mock_fstime.call_count, 1)
+
     def test_check_squashfs_resquash_no_fstime(self):
         '''Test check_squashfs_resquash() - no -fstime'''
         output_dir = self.mkdtemp()